@@ -0,0 +1,36 @@
+#!/bin/sh
+set -e
+
+# Start several replicas of the service on this machine, on ports 5001 and up, forming one peer
+# ring. Each replica gets its own index and hot cache directory, as if it were on its own host.
+# Usage: MINIO_SECRET_KEY=... scripts/start_peers.sh [number of replicas]
+count=${1:-3}
+workers=${WORKERS:-2}
+base_dir=${PEERS_DIR:-/tmp/caching_service_peers}
+
+peers=""
+for num in $(seq 1 "$count"); do
+  peers="${peers:+$peers,}http://127.0.0.1:$((5000 + num))"
+done
+
+export PEERS="$peers"
+export PEER_SECRET=${PEER_SECRET:-$(python -c 'import uuid; print(uuid.uuid4())')}
+
+python -m src.caching_service.utils.init_app
+
+trap 'kill 0' INT TERM EXIT
+for num in $(seq 1 "$count"); do
+  port=$((5000 + num))
+  SELF_URL="http://127.0.0.1:$port" \
+  INDEX_PATH="$base_dir/$port/index.db" \
+  HOT_CACHE_DIR="$base_dir/$port/hot" \
+    gunicorn \
+      --config python:src.caching_service.gunicorn_conf \
+      --worker-class gevent \
+      --timeout 1800 \
+      --workers "$workers" \
+      --bind "127.0.0.1:$port" \
+      --preload \
+      src.caching_service.server:app &
+done
+wait
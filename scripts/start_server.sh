@@ -6,12 +6,16 @@ set -e
 calc_workers="$(($(nproc) * 2 + 1))"
 # Use the WORKERS environment variable, if present
 workers=${WORKERS:-$calc_workers}
+# Reload on code changes in development; otherwise import the app once and fork the workers from it
+mode=${DEVELOPMENT:+"--reload"}
+mode=${mode:-"--preload"}
 
 python -m src.caching_service.utils.init_app && \
   gunicorn \
+    --config python:src.caching_service.gunicorn_conf \
     --worker-class gevent \
     --timeout 1800 \
     --workers $workers \
     --bind :5000 \
-    ${DEVELOPMENT:+"--reload"} \
+    $mode \
     src.caching_service.server:app
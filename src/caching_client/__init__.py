@@ -0,0 +1,2 @@
+"""A lightweight python client for the caching service."""
+from .client import CacheClient  # noqa
@@ -0,0 +1,20 @@
+"""
+Cache IDs, computed exactly as the server's generate_cache_id does, so that the client does not
+depend on the server's code.
+"""
+import hashlib
+import json
+
+
+def generate_cache_id(token_id, json_data):
+    """
+    Generate a cache ID (a blake2b hash) from an 'auth_url:username' token ID, or a namespace's
+    owner ID, and non-empty JSON-serializable identifying data.
+    """
+    if not token_id or not isinstance(token_id, str):
+        raise TypeError('`token_id` must be a non-empty string')
+    if not json_data or not isinstance(json_data, dict):
+        raise TypeError('Must provide non-empty JSON data for the cache identifier')
+    # A uniform json string, with its keys sorted
+    json_text = json.dumps(json_data, sort_keys=True)
+    return hashlib.blake2b((token_id + '\n' + json_text).encode()).hexdigest()
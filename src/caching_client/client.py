@@ -0,0 +1,408 @@
+"""
+Python client for the caching service API.
+
+Cache IDs are computed locally with the same function that the server uses, so checking for a
+cached result costs a single HEAD request, or no request at all when the optional local result
+cache already holds the file.
+"""
+import io
+import json
+import math
+import os
+import shutil
+import time
+import urllib.parse
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache_id import generate_cache_id
+
+# Size of chunks written to disk while streaming a download
+_chunk_size = 1024 * 1024
+# Errors that are worth retrying a transfer for
+_transfer_errors = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError
+)
+
+
+class CacheClientError(Exception):
+    """The caching service (or the auth service) responded with an error."""
+
+    def __init__(self, msg, status_code=None):
+        self.msg = msg
+        self.status_code = status_code
+
+    def __str__(self):
+        return self.msg
+
+
+class CacheClient:
+    """
+    Client for a running caching service.
+
+    Args:
+        url - required - base URL of the API, including the version (eg. 'https://host/cache/v1')
+        token - required - service authentication token
+        auth_url - required - KBase auth URL; must match the server's KBASE_AUTH_URL setting so
+          that locally generated cache IDs are identical to the server's
+        token_id - optional - the 'auth_url:username' identity of the token, if already known;
+          otherwise it is fetched once from the auth service
+        local_cache_dir - optional - directory in which to keep copies of downloaded results
+        retries - optional - how many times to retry a failed request or transfer
+        pool_size - optional - number of HTTP connections to keep open for re-use
+        timeout - optional - seconds to wait on the server before giving up on a request
+        namespace - optional - shared namespace to compute cache IDs in, so that they are the same
+          for every token; it must be set up on the server, and the token must be one of its readers
+    """
+
+    def __init__(self, url, token, auth_url, token_id=None, local_cache_dir=None, retries=3,
+                 pool_size=10, timeout=60, namespace=None):
+        self.url = url.rstrip('/')
+        self.auth_url = auth_url
+        self.local_cache_dir = local_cache_dir
+        self.retries = retries
+        self.timeout = timeout
+        self._token_id = token_id
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = token
+        if namespace:
+            self.session.headers['X-Cache-Namespace'] = namespace
+        self.namespace = namespace
+        # Only idempotent methods are retried by the adapter; uploads do their own retries
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if local_cache_dir:
+            os.makedirs(local_cache_dir, exist_ok=True)
+
+    @property
+    def token_id(self):
+        """The 'auth_url:username' identity of the token, as the server computes it."""
+        if self._token_id is None:
+            resp = self.session.get(self.auth_url + '/api/V2/token', timeout=self.timeout)
+            auth_json = resp.json()
+            if 'error' in auth_json:
+                raise CacheClientError(auth_json['error']['message'], resp.status_code)
+            self._token_id = ':'.join([self.auth_url, auth_json['user']])
+        return self._token_id
+
+    def cache_id(self, params):
+        """Compute the cache ID for some identifying JSON data without contacting the server."""
+        # The entries of a namespace are owned by it rather than by a token, as on the server
+        owner = 'namespace:' + self.namespace if self.namespace else self.token_id
+        return generate_cache_id(owner, params)
+
+    def register(self, params, tags=None):
+        """
+        Register a cache ID with the server (POST /cache_id), which is required before uploading.
+        Any `tags` are added to the cache entry, so that it can later be deleted along with all of
+        the other entries that have one of them. Returns the cache ID. In a namespace that the
+        token may only read, the server looks up the cache ID without registering it.
+        """
+        headers = {'X-Cache-Tags': ','.join(tags)} if tags else {}
+        resp = self.session.post(self.url + '/cache_id', json=params, headers=headers, timeout=self.timeout)
+        return _check(resp).json()['cache_id']
+
+    def wait(self, cache_id, timeout=60):
+        """
+        Wait for another client to finish producing the file for a cache ID. Returns None once the
+        file is ready. Otherwise returns the lease on the cache ID: if its 'state' is 'acquired',
+        the other client gave up and the caller should now produce the file itself; if it is still
+        'in_progress', the wait timed out.
+        """
+        resp = self.session.get(self._cache_url(cache_id) + '/wait', params={'timeout': timeout},
+                                timeout=self.timeout + timeout)
+        return _check(resp).json().get('lease')
+
+    def list_caches(self, page_size=100):
+        """
+        Iterate over the cache entries of this client's token, as dicts with the `cache_id`,
+        `filename`, `size`, `expiration`, and whether it is only a `placeholder`. The server must
+        have its owner index enabled.
+        """
+        cursor = None
+        while True:
+            params = {'limit': page_size}
+            if cursor:
+                params['cursor'] = cursor
+            resp = _check(self.session.get(self.url + '/caches', params=params, timeout=self.timeout))
+            body = resp.json()
+            yield from body['caches']
+            cursor = body['cursor']
+            if not cursor:
+                break
+
+    def exists(self, cache_id):
+        """Check whether a file has been saved under a cache ID, without downloading it."""
+        if self._local_path(cache_id) and os.path.exists(self._local_path(cache_id)):
+            return True
+        resp = self.session.head(self._cache_url(cache_id), timeout=self.timeout)
+        if resp.status_code == 404:
+            return False
+        _check(resp)
+        return resp.headers.get('X-Cache-Placeholder') != 'true'
+
+    def get(self, params, path):
+        """Download the cached result for some identifying JSON data. See `download`."""
+        return self.download(self.cache_id(params), path)
+
+    def put(self, params, path, compute_seconds=None):
+        """Upload a result for some identifying JSON data. See `upload`."""
+        return self.upload(self.cache_id(params), path, params=params, compute_seconds=compute_seconds)
+
+    def download(self, cache_id, path):
+        """
+        Download a cache file to `path`, resuming with byte ranges if the transfer is interrupted.
+        Returns `path`, or None if nothing has been cached under the cache ID.
+        """
+        local_path = self._local_path(cache_id)
+        if local_path and os.path.exists(local_path):
+            shutil.copyfile(local_path, path)
+            return path
+        partial = path + '.part'
+        if os.path.exists(partial):
+            os.remove(partial)
+        # The ETag of the file being downloaded, so that a resumed download does not splice two versions
+        validator = {}  # type: dict
+        found = self._retry(lambda: self._download_range(cache_id, partial, validator))
+        if not found:
+            return None
+        os.replace(partial, path)
+        self._save_local(cache_id, path)
+        return path
+
+    def download_batch(self, cache_ids, path, fmt='tar'):
+        """
+        Download many cache files as a single archive ('tar' or 'zip') saved to `path`, in which
+        each file is named '<cache_id>/<filename>'. Returns `path`.
+        """
+        body = {'cache_ids': list(cache_ids), 'format': fmt}
+        with self.session.post(self.url + '/cache/batch_download', json=body, stream=True,
+                               timeout=self.timeout) as resp:
+            _check(resp)
+            with open(path, 'wb') as fd:
+                for chunk in resp.iter_content(_chunk_size):
+                    fd.write(chunk)
+        return path
+
+    def upload(self, cache_id, path, params=None, compute_seconds=None):
+        """
+        Upload the file at `path` to a cache ID, streaming it from disk. Pass the number of seconds
+        that the result took to compute as `compute_seconds`, to have the server count the compute
+        time that its cache hits save.
+
+        If the cache ID has not been registered with the server yet and `params` is given, then
+        it is registered and the upload is retried.
+        """
+        resp = self._retry(lambda: self._upload_file(cache_id, path, compute_seconds))
+        if resp.status_code == 404 and params is not None:
+            self.register(params)
+            resp = self._retry(lambda: self._upload_file(cache_id, path, compute_seconds))
+        _check(resp)
+        self._save_local(cache_id, path)
+
+    def upload_in_parts(self, cache_id, path, part_size=64 * 1024 * 1024, upload_id=None, workers=4,
+                        compute_seconds=None):
+        """
+        Upload a large file through a resumable upload session, sending chunks of `part_size` bytes
+        over `workers` parallel connections. Every chunk except the last must be at least 5MiB.
+        `compute_seconds` is as for `upload`.
+
+        To resume an interrupted upload, pass the `upload_id` of its session along with the same
+        `part_size`; chunks that the server already has are skipped. Returns the upload ID.
+        """
+        if upload_id is None:
+            resp = self.session.post(self._cache_url(cache_id) + '/uploads', timeout=self.timeout,
+                                     headers={'X-Cache-Filename': os.path.basename(path)})
+            upload_id = _check(resp).json()['upload_id']
+        session_url = self._cache_url(cache_id) + '/uploads/' + upload_id
+        resp = _check(self.session.get(session_url, timeout=self.timeout))
+        received = {part['part_number'] for part in resp.json()['parts']}
+        part_count = max(1, math.ceil(os.path.getsize(path) / part_size))
+        missing = [num for num in range(1, part_count + 1) if num not in received]
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda num: self._upload_part(session_url, path, num, part_size), missing))
+        _check(self.session.post(session_url + '/complete', headers=_compute_header(compute_seconds),
+                                 timeout=self.timeout))
+        self._save_local(cache_id, path)
+        return upload_id
+
+    def copy(self, cache_id, dest_id, filename=None):
+        """
+        Copy a cache file to another registered cache ID, on the server, without downloading or
+        uploading it. The copy keeps the original filename unless another one is given.
+        """
+        body = {'destination': dest_id}
+        if filename:
+            body['filename'] = filename
+        resp = self.session.post(self._cache_url(cache_id) + '/copy', json=body, timeout=self.timeout)
+        _check(resp)
+
+    def delete(self, cache_id):
+        """Delete a cache entry, both on the server and in the local result cache."""
+        local_path = self._local_path(cache_id)
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+        _check(self.session.delete(self._cache_url(cache_id), timeout=self.timeout))
+
+    def invalidate(self, tag, on_progress=None):
+        """
+        Delete all of this client's cache entries on the server that have a tag, or those of its
+        namespace, of which the token must be a writer. The server
+        reports its progress after each batch of entries, which is passed to `on_progress` if it
+        is given. Returns the final progress, a dict with the `total` number of tagged entries and
+        how many were `deleted`, already `missing`, or could not be removed (`errors`).
+        """
+        url = self.url + '/tags/' + urllib.parse.quote(tag)
+        with self.session.delete(url, stream=True, timeout=self.timeout) as resp:
+            _check(resp)
+            for line in resp.iter_lines():
+                progress = json.loads(line)
+                if progress['status'] == 'error':
+                    raise CacheClientError(progress['error'], resp.status_code)
+                if on_progress:
+                    on_progress(progress)
+        return progress
+
+    def _download_range(self, cache_id, partial, validator):
+        """
+        Fetch the remainder of a cache file into `partial`. Returns False if it is missing.
+
+        A range is only asked for with an If-Range header holding the ETag in `validator`, which is
+        that of the first response, so that the server sends the whole file again if it has been
+        replaced since.
+        """
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {}
+        if offset and validator.get('etag'):
+            headers = {'Range': 'bytes=%d-' % offset, 'If-Range': validator['etag']}
+        with self.session.get(self._cache_url(cache_id), headers=headers, stream=True,
+                              timeout=self.timeout) as resp:
+            if resp.status_code == 404:
+                return False
+            _check(resp)
+            # The server sends the whole file (status 200) if it ignores the range or the file changed
+            mode = 'ab' if resp.status_code == 206 else 'wb'
+            if resp.status_code != 206:
+                etag = resp.headers.get('ETag', '')
+                # Weak ETags cannot be used in If-Range
+                validator['etag'] = None if etag.startswith('W/') else etag
+            with open(partial, mode) as fd:
+                for chunk in resp.iter_content(_chunk_size):
+                    fd.write(chunk)
+        return True
+
+    def _upload_file(self, cache_id, path, compute_seconds=None):
+        """Send a file as a raw request body, or as a multipart form to servers without PUT."""
+        headers = {'Content-Type': 'application/octet-stream', 'X-Cache-Filename': os.path.basename(path)}
+        headers.update(_compute_header(compute_seconds))
+        with open(path, 'rb') as fd:
+            resp = self.session.put(self._cache_url(cache_id), data=fd, headers=headers, timeout=self.timeout)
+        if resp.status_code != 405:
+            return resp
+        body = _MultipartFile(path, os.path.basename(path))
+        headers = {'Content-Type': 'multipart/form-data; boundary=' + body.boundary}
+        headers.update(_compute_header(compute_seconds))
+        try:
+            return self.session.post(self._cache_url(cache_id), data=body, headers=headers,
+                                     timeout=self.timeout)
+        finally:
+            body.close()
+
+    def _upload_part(self, session_url, path, part_number, part_size):
+        with open(path, 'rb') as fd:
+            fd.seek((part_number - 1) * part_size)
+            data = fd.read(part_size)
+        url = session_url + '/' + str(part_number)
+        # PUTs of a part are idempotent, so the session's adapter also retries error statuses
+        _check(self._retry(lambda: self.session.put(url, data=data, timeout=self.timeout)))
+
+    def _retry(self, fn):
+        """Call `fn` until it stops raising a transfer error, with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                return fn()
+            except _transfer_errors:
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.5 * (2 ** attempt))
+
+    def _cache_url(self, cache_id):
+        return self.url + '/cache/' + cache_id
+
+    def _local_path(self, cache_id):
+        if not self.local_cache_dir:
+            return None
+        return os.path.join(self.local_cache_dir, cache_id)
+
+    def _save_local(self, cache_id, path):
+        """Keep a copy of a result in the local result cache, if one is configured."""
+        local_path = self._local_path(cache_id)
+        if not local_path:
+            return
+        tmp_path = local_path + '.' + uuid.uuid4().hex
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, local_path)
+
+
+class _MultipartFile:
+    """
+    A file-like multipart/form-data request body holding a single 'file' field.
+
+    The file is read from disk as the request is sent, rather than loaded into memory. Having a
+    length lets requests send an explicit Content-Length instead of a chunked body.
+    """
+
+    def __init__(self, path, filename):
+        self.boundary = uuid.uuid4().hex
+        filename = filename.replace('"', '%22')
+        head = (
+            '--' + self.boundary + '\r\n'
+            'Content-Disposition: form-data; name="file"; filename="' + filename + '"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode()
+        tail = ('\r\n--' + self.boundary + '--\r\n').encode()
+        self._length = len(head) + os.path.getsize(path) + len(tail)
+        self._parts = [io.BytesIO(head), open(path, 'rb'), io.BytesIO(tail)]
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0).close()
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+
+def _compute_header(compute_seconds):
+    """Headers telling the server how long an uploaded result took to compute, if known."""
+    return {} if compute_seconds is None else {'X-Compute-Duration': str(compute_seconds)}
+
+
+def _check(resp):
+    """Raise a CacheClientError for an error response from the server."""
+    if resp.status_code < 400:
+        return resp
+    try:
+        msg = resp.json()['error']
+    except (ValueError, KeyError):
+        msg = 'Request failed with status ' + str(resp.status_code)
+    raise CacheClientError(msg, resp.status_code)
@@ -0,0 +1,17 @@
+"""
+Packaging for the python client, which is installed on its own as the `caching_client` package:
+
+    pip install ./src/caching_client
+"""
+from setuptools import setup
+
+setup(
+    name='kbase-caching-client',
+    version='0.1.0',
+    description='A lightweight python client for the KBase file caching service',
+    license='MIT',
+    packages=['caching_client'],
+    package_dir={'caching_client': '.'},
+    python_requires='>=3.6',
+    install_requires=['requests>=2.20'],
+)
@@ -2,17 +2,101 @@
 
 Usage:
     admin.py expire_all
+    admin.py evict [--max-bytes=<bytes>]
+    admin.py reap_placeholders [--max-age=<seconds>]
+    admin.py abort_uploads [--max-age=<seconds>]
+    admin.py pack
+    admin.py compact_packs [--min-dead=<ratio>]
+    admin.py restore_packs
+    admin.py index_owners
+    admin.py usage [--reconcile] [--limit=<count>]
+    admin.py analytics [--limit=<count>]
+    admin.py export <destination> [--workers=<count>] [--manifest=<path>]
+    admin.py import <source> [--workers=<count>]
 
 Commands:
-    expire_all    Find all expired caches and remove them
+    expire_all           Find all expired caches and remove them
+    evict                Remove the least recently used caches until the bucket fits in its byte budget
+    reap_placeholders    Remove placeholders for cache IDs that never had a file uploaded
+    abort_uploads        Abort abandoned resumable upload sessions and discard their parts
+    pack                 Move small cache files into shared pack objects
+    compact_packs        Rewrite packs that are mostly taken up by expired or removed files
+    restore_packs        Rebuild the pack index from the manifests of the packs, after the index was lost
+    index_owners         Fill the owner index from the metadata of all existing cache entries
+    usage                Report the files and bytes stored by each token, from the owner index
+    analytics            Report the hit ratios of tokens and cache entries, and the compute hours saved
+    export               Copy all unexpired caches to an archive directory or to a bucket URL
+    import               Upload the caches in an archive directory made by `export`
+
+Options:
+    --max-bytes=<bytes>      Byte budget for the bucket (defaults to the MAX_BUCKET_BYTES setting)
+    --max-age=<seconds>      Only remove placeholders or sessions older than this [default: 86400]
+    --min-dead=<ratio>       Fraction of a pack that must be dead space (defaults to the PACK_COMPACT_RATIO setting)
+    --reconcile              First rebuild the usage totals from a scan of the bucket, in case they have drifted
+    --limit=<count>          Only report the tokens that store the most bytes, or the tokens and
+                             entries with the most hits [default: 20]
+    --workers=<count>        Caches to copy at a time (defaults to the MIGRATION_WORKERS setting)
+    --manifest=<path>        Where to record the progress of an export to a bucket [default: export-manifest.jsonl]
 """
 
 from docopt import docopt
 
-from .minio import expire_entries
+from . import analytics
+from . import index
+from .migration import export_entries, import_entries
+from .minio import expire_entries, evict_entries, reap_placeholders, index_owners, reconcile_usage
+from .multipart import abort_stale_sessions
+from .packs import pack_entries, compact_packs, restore_packs
+
+
+def _optional(parse, value):
+    return parse(value) if value else None
+
+
+def report_usage(reconcile, limit):
+    """Print the usage totals of the tokens that store the most bytes."""
+    if reconcile:
+        reconcile_usage()
+    (tokens, objects, num_bytes) = index.get_total_usage()
+    print('{} tokens store {} files, taking up {} bytes'.format(tokens, objects, num_bytes))
+    for (token_id, objs, size) in index.get_usage(limit):
+        print('{:>16} {:>10} {}'.format(size, objs, token_id))
+
+
+def report_analytics(limit):
+    """Print the hit ratios and compute hours saved of all entries, and of those with the most hits."""
+    report = analytics.report(limit)
+    total = report['total']
+    print('{} hits and {} misses (hit ratio {}), saving {} compute hours'.format(
+        total['hits'], total['misses'], total['hit_ratio'], total['hours_saved']
+    ))
+    for (name, key) in [('Tokens', 'token_id'), ('Entries', 'cache_id')]:
+        print(name + ' with the most hits:')
+        for row in report[name.lower()]:
+            print('{:>10} {:>10} {:>8} {:>10} {}'.format(
+                row['hits'], row['misses'], row['hit_ratio'], row['hours_saved'], row[key]
+            ))
+
+
+# Command name -> function of the parsed arguments
+commands = {
+    'expire_all': lambda args: expire_entries(),
+    'evict': lambda args: evict_entries(_optional(int, args['--max-bytes'])),
+    'reap_placeholders': lambda args: reap_placeholders(int(args['--max-age'])),
+    'abort_uploads': lambda args: abort_stale_sessions(int(args['--max-age'])),
+    'pack': lambda args: pack_entries(),
+    'compact_packs': lambda args: compact_packs(_optional(float, args['--min-dead'])),
+    'restore_packs': lambda args: restore_packs(),
+    'index_owners': lambda args: index_owners(),
+    'usage': lambda args: report_usage(args['--reconcile'], int(args['--limit'])),
+    'analytics': lambda args: report_analytics(int(args['--limit'])),
+    'export': lambda args: export_entries(args['<destination>'], _optional(int, args['--workers']), args['--manifest']),
+    'import': lambda args: import_entries(args['<source>'], _optional(int, args['--workers'])),
+}
 
 
 if __name__ == '__main__':
     args = docopt(__doc__, help=True)
-    if args['expire_all']:
-        expire_entries()
+    for (name, command) in commands.items():
+        if args[name]:
+            command(args)
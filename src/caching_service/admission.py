@@ -0,0 +1,192 @@
+"""
+Admission control for file transfers.
+
+Uploads and downloads are counted while they are in flight, along with the bytes that they hold
+in memory or on temporary disk. Each worker records its own counts in the local index every
+Config.admission_refresh_interval seconds, so that every worker can see the totals for the whole
+host. The index is never read or written while the counts are locked. A new transfer that would take its worker or
+the host past one of the watermarks in Config queues for up to Config.admission_wait seconds for
+others to finish, and is then turned away with a 503 and a Retry-After. Cheap requests, such as
+generating a cache ID or fetching metadata, are never held back.
+"""
+import functools
+import os
+import threading
+import time
+import flask
+
+from .batcher import Batcher
+from .config import Config
+from . import exceptions
+from . import index
+from . import metrics
+
+# Transfers in flight in this worker, and the number that it has rejected
+_local = {'bytes': 0, 'transfers': 0, 'rejected': 0}
+# Transfers in flight in the other workers on the host, as last read from the index
+_others = {'bytes': 0, 'transfers': 0, 'read': 0.0}
+# Notified whenever a transfer in this worker finishes
+_cond = threading.Condition()
+
+
+def transfer(fn):
+    """Decorate a route that transfers a file, so that it is only run while there is room for it."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if flask.request.method == 'HEAD':
+            return fn(*args, **kwargs)
+        ticket = admit(flask.request.content_length or 0)
+        try:
+            response = flask.make_response(fn(*args, **kwargs))
+        except Exception:
+            release(ticket)
+            raise
+        # Streamed responses are still in flight until they have been completely sent
+        response.call_on_close(lambda: release(ticket))
+        return response
+    return wrapper
+
+
+def admit(size):
+    """
+    Count a new transfer of `size` bytes as in flight, waiting for room if needed. Returns a ticket
+    to pass to `release` once it is over. Raises Overloaded if there is no room in time.
+    """
+    deadline = time.monotonic() + Config.admission_wait
+    while not _try_admit(size, deadline):
+        pass
+    ticket = {'bytes': size}
+    flask.g.transfer = ticket
+    return ticket
+
+
+def _try_admit(size, deadline):
+    """
+    Count a new transfer if there is room for it. Otherwise wait until a transfer in this worker
+    finishes, or until it is time to read the other workers' transfers again, and return False.
+    """
+    # Transfers that finish in other workers are only seen when the index is read again
+    _read_others()
+    with _cond:
+        reason = _over_limit(size)
+        if not reason:
+            _local['bytes'] += size
+            _local['transfers'] += 1
+            _publish()
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _local['rejected'] += 1
+            _publish()
+            raise exceptions.Overloaded('Too many transfers in progress (' + reason + '), try again later',
+                                        Config.admission_retry_after)
+        _cond.wait(min(remaining, Config.admission_refresh_interval))
+        return False
+
+
+def add_bytes(size):
+    """Count more bytes for the transfer of the current request, once they are known."""
+    ticket = flask.g.get('transfer')
+    if ticket is None:
+        return
+    with _cond:
+        ticket['bytes'] += size
+        _local['bytes'] += size
+        _publish()
+
+
+def release(ticket):
+    """End a transfer that was admitted, making room for others."""
+    with _cond:
+        _local['bytes'] -= ticket['bytes']
+        _local['transfers'] -= 1
+        _publish()
+        _cond.notify_all()
+
+
+def _over_limit(size):
+    """Return the name of the first watermark that a new transfer would cross, if any."""
+    worker_bytes = _local['bytes']
+    host_bytes = worker_bytes + _others['bytes']
+    worker_transfers = _local['transfers']
+    host_transfers = worker_transfers + _others['transfers']
+    checks = [
+        ('worker transfers', worker_transfers + 1, Config.max_worker_transfers),
+        ('host transfers', host_transfers + 1, Config.max_transfers),
+        # A single transfer larger than a byte limit is let through once nothing else is in flight
+        ('worker bytes', worker_bytes + size if worker_bytes else 0, Config.max_worker_transfer_bytes),
+        ('host bytes', host_bytes + size if host_bytes else 0, Config.max_transfer_bytes),
+    ]
+    for (name, value, limit) in checks:
+        if limit and value > limit:
+            return name
+    return None
+
+
+def _enabled():
+    return any([Config.max_worker_transfers, Config.max_transfers,
+                Config.max_worker_transfer_bytes, Config.max_transfer_bytes])
+
+
+def _publish():
+    """Queue up this worker's transfers to be recorded in the index, which is only needed for admission control."""
+    if _enabled():
+        _published.add(os.getpid(), (_local['bytes'], _local['transfers'], _local['rejected']))
+
+
+def _write_transfers(batch):
+    for (pid, (num_bytes, transfers, rejected)) in batch.items():
+        index.set_transfers(pid, num_bytes, transfers, rejected)
+
+
+def _read_others():
+    """Refresh the totals of the other workers, at most every Config.admission_refresh_interval."""
+    if time.monotonic() - _others['read'] < Config.admission_refresh_interval:
+        return
+    rows = [row for row in _live_transfers() if row[0] != os.getpid()]
+    _others['bytes'] = sum(row[1] for row in rows)
+    _others['transfers'] = sum(row[2] for row in rows)
+    _others['read'] = time.monotonic()
+
+
+def _live_transfers():
+    """Return the index's transfer rows, forgetting those of workers that have exited."""
+    rows = index.get_transfers()
+    dead = [pid for (pid, _, transfers, _) in rows if transfers and not _is_running(pid)]
+    index.remove_transfers(dead)
+    return [row for row in rows if row[0] not in dead]
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@metrics.collector
+def collect_metrics():
+    rows = _live_transfers()
+    limits = [
+        ({'scope': 'worker', 'kind': 'transfers'}, Config.max_worker_transfers),
+        ({'scope': 'host', 'kind': 'transfers'}, Config.max_transfers),
+        ({'scope': 'worker', 'kind': 'bytes'}, Config.max_worker_transfer_bytes),
+        ({'scope': 'host', 'kind': 'bytes'}, Config.max_transfer_bytes),
+    ]
+    return [
+        ('cache_transfers_in_flight', 'gauge', 'File transfers in progress.',
+         [({'scope': 'worker'}, _local['transfers']), ({'scope': 'host'}, sum(row[2] for row in rows))]),
+        ('cache_transfer_bytes_in_flight', 'gauge', 'Bytes held by the file transfers in progress.',
+         [({'scope': 'worker'}, _local['bytes']), ({'scope': 'host'}, sum(row[1] for row in rows))]),
+        ('cache_admission_limit', 'gauge', 'Watermarks beyond which new transfers are rejected (0 if disabled).',
+         limits),
+        ('cache_admission_rejected_total', 'counter', 'Transfers rejected for being over a watermark.',
+         [({}, sum(row[3] for row in rows))]),
+    ]
+
+
+# This worker's pid -> (bytes, transfers, rejected), until written to the index
+_published = Batcher(_write_transfers, Config.admission_refresh_interval)
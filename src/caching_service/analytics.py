@@ -0,0 +1,75 @@
+"""
+Hit and miss counts of cache entries, and an estimate of the compute time that the cache saves.
+
+A download of a cache file counts as a hit of its entry, and generating a cache ID that has
+nothing uploaded for it yet counts as a miss. Uploads may give the number of seconds that the
+result took to compute in an X-Compute-Duration header, so that each hit is taken to save that much
+compute time. The counts are buffered in each worker and added to the local index every
+Config.analytics_flush_interval seconds, under the token that owns each entry. They are kept until
+Config.analytics_retention seconds after the entry expires. Nothing is counted without
+Config.analytics.
+"""
+from .batcher import Batcher
+from .config import Config
+from . import index
+
+
+def record_hit(cache_id, metadata):
+    """Count a download of the cache file with the given metadata."""
+    if Config.analytics:
+        _counts.add(cache_id, (metadata['token_id'], 1, 0, None, int(metadata['expiration'])))
+
+
+def record_miss(cache_id, metadata):
+    """Count a request for a cache ID that has only the placeholder with the given metadata."""
+    if Config.analytics:
+        _counts.add(cache_id, (metadata['token_id'], 0, 1, None, int(metadata['expiration'])))
+
+
+def record_compute(cache_id, metadata, seconds):
+    """Record how many seconds the newly uploaded file with the given metadata took to compute."""
+    if Config.analytics:
+        _counts.add(cache_id, (metadata['token_id'], 0, 0, float(seconds), int(metadata['expiration'])))
+
+
+def _merge(old, new):
+    (token_id, hits, misses, seconds, expiration) = new
+    return (token_id, old[1] + hits, old[2] + misses, old[3] if seconds is None else seconds,
+            max(old[4], expiration))
+
+
+def flush():
+    """Add the counts buffered in this worker to the index right away, rather than at the next interval."""
+    _counts.flush()
+
+
+def report(limit=100):
+    """
+    Summarize the counts in the index: the totals, the `limit` tokens with the most hits, and the
+    `limit` entries with the most hits. Each has its hit ratio and the compute hours saved.
+    """
+    return {
+        'total': _summary(index.get_total_stats()),
+        'tokens': [dict(token_id=row[0], **_summary(row[1:])) for row in index.get_token_stats(limit)],
+        'entries': [dict(cache_id=row[0], token_id=row[1], **_summary(row[2:]))
+                    for row in index.get_entry_stats(limit)],
+    }
+
+
+def _summary(row):
+    (hits, misses, saved_seconds) = row
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        'hours_saved': round(saved_seconds / 3600, 2),
+    }
+
+
+def remove_expired(now):
+    """Forget the counts of entries that expired more than Config.analytics_retention seconds ago."""
+    index.remove_stats_expiring_before(now - Config.analytics_retention)
+
+
+# cache_id -> (owner token_id, hits, misses, compute seconds or None, expiration), until flushed
+_counts = Batcher(index.add_stats, Config.analytics_flush_interval, merge=_merge)
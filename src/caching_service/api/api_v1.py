@@ -1,17 +1,45 @@
 """The primary router for the Caching Service API v1."""
+import collections
 import tempfile
 import json
+import mimetypes
+import os
 import flask
 import shutil
+import time
 
-from ..authorization.service_token import requires_service_token
+from ..authorization import namespaces
+from ..authorization.service_token import requires_admin_token, requires_service_token
 from ..generate_cache_id import generate_cache_id
+from .. import admission
+from .. import analytics
+from .. import archive
 from .. import exceptions
+from .. import index
+from .. import leases
+from .. import log
+from .. import multipart
+from .. import peers
+from .. import profiler
+from ..config import Config
+from ..log import timed
 from ..minio import (
-    download_cache,
+    authorize_access,
+    authorize_download,
+    authorize_many,
+    copy_cache,
+    is_cold,
+    read_ranges,
+    record_download,
+    save_download,
     upload_cache,
+    upload_stream,
+    stream_part_size,
     create_placeholder,
-    delete_cache
+    delete_cache,
+    delete_tagged,
+    get_cache_info,
+    get_metadata
 )
 
 api_v1 = flask.Blueprint('api_v1', __name__)
@@ -24,9 +52,28 @@ def root():
         'routes': {
             'root': 'GET /',
             'generate_cache_id': 'POST /cache_id',
+            'list_caches': 'GET /caches',
+            'storage_usage': 'GET /admin/usage',
+            'cache_analytics': 'GET /admin/analytics',
+            'start_profile': 'POST /admin/profile',
+            'get_profile': 'GET /admin/profile',
+            'stop_profile': 'DELETE /admin/profile',
             'download_cache_file': 'GET /cache/<cache_id>',
+            'check_cache_file': 'HEAD /cache/<cache_id>',
+            'batch_download': 'POST /cache/batch_download',
+            'cache_metadata': 'GET /cache/<cache_id>/meta',
+            'wait_for_cache_file': 'GET /cache/<cache_id>/wait',
+            'release_lease': 'DELETE /cache/<cache_id>/lease/<lease_id>',
             'upload_cache_file': 'POST /cache/<cache_id>',
-            'delete_cache_file': 'DELETE /cache/<cache_id>'
+            'put_cache_file': 'PUT /cache/<cache_id>',
+            'delete_cache_file': 'DELETE /cache/<cache_id>',
+            'copy_cache_file': 'POST /cache/<cache_id>/copy',
+            'delete_tag': 'DELETE /tags/<tag>',
+            'create_upload_session': 'POST /cache/<cache_id>/uploads',
+            'upload_part': 'PUT /cache/<cache_id>/uploads/<upload_id>/<part_number>',
+            'list_upload_parts': 'GET /cache/<cache_id>/uploads/<upload_id>',
+            'complete_upload_session': 'POST /cache/<cache_id>/uploads/<upload_id>/complete',
+            'abort_upload_session': 'DELETE /cache/<cache_id>/uploads/<upload_id>'
         }
     }
     return flask.jsonify(resp)
@@ -35,51 +82,451 @@ def root():
 @api_v1.route('/cache_id', methods=['POST'])
 @requires_service_token
 def make_cache_id():
-    """Generate a cache ID from identifying data."""
+    """
+    Generate a cache ID from identifying data, adding any tags in the X-Cache-Tags header. With an
+    X-Cache-Namespace header, the cache ID is that of the data in a shared namespace.
+    """
     check_content_type('application/json')
     check_header_present('Authorization')
+    tags = get_tags()
+    owner = get_owner()
     try:
-        cid = generate_cache_id(flask.session['token_id'], get_json())
+        cid = generate_cache_id(owner, get_json())
     except TypeError as err:
         result = {'status': 'error', 'error': str(err)}
         return flask.jsonify(result)
-    metadata = create_placeholder(cid, flask.session['token_id'])
+    if not namespaces.allows(owner, flask.session['token_id'], write=True):
+        return read_shared_cache_id(cid, owner, tags)
+    with timed('storage'):
+        metadata = create_placeholder(cid, owner, tags)
     result = {'cache_id': cid, 'status': 'ok', 'metadata': metadata}
+    if metadata['filename'] == 'placeholder':
+        result['lease'] = take_lease(cid)
     return flask.jsonify(result)
 
 
-@api_v1.route('/cache/<cache_id>', methods=['GET'])
+def read_shared_cache_id(cid, owner, tags):
+    """
+    Respond with a cache ID in a namespace that the caller may only read, along with its metadata,
+    which is null if nothing has been produced for it yet. No placeholder or lease is made for it.
+    """
+    if not namespaces.allows(owner, flask.session['token_id']):
+        raise exceptions.UnauthorizedAccess('You do not have access to that namespace')
+    if tags:
+        raise exceptions.UnauthorizedAccess('Only writers of a namespace may tag its entries')
+    try:
+        with timed('storage'):
+            metadata = get_metadata(cid)
+    except exceptions.MissingCache:
+        metadata = None
+    return flask.jsonify({'cache_id': cid, 'status': 'ok', 'metadata': metadata})
+
+
+@api_v1.route('/caches', methods=['GET'])
+@requires_service_token
+def list_caches():
+    """
+    List the cache entries of the caller's token, sorted by cache ID, a page at a time. Pass the
+    `cursor` of a response to get the next page; it is null on the last page.
+    """
+    if not Config.owner_index:
+        raise exceptions.InvalidRequest('Listing cache entries is not enabled on this server')
+    limit = get_limit()
+    after = flask.request.args.get('cursor', '')
+    with timed('index'):
+        rows = index.get_owned(flask.session['token_id'], after, limit, time.time())
+    caches = [
+        {'cache_id': cache_id, 'filename': filename, 'size': size, 'expiration': expiration,
+         'placeholder': filename == 'placeholder'}
+        for (cache_id, filename, size, expiration) in rows
+    ]
+    cursor = caches[-1]['cache_id'] if len(caches) == limit else None
+    return flask.jsonify({'status': 'ok', 'caches': caches, 'cursor': cursor})
+
+
+@api_v1.route('/admin/usage', methods=['GET'])
+@requires_service_token
+@requires_admin_token
+def storage_usage():
+    """Report the number of files and bytes stored by the tokens that store the most bytes."""
+    if not Config.owner_index:
+        raise exceptions.InvalidRequest('Usage accounting is not enabled on this server')
+    limit = get_limit()
+    with timed('index'):
+        rows = index.get_usage(limit)
+        (tokens, objects, num_bytes) = index.get_total_usage()
+    usage = [{'token_id': token_id, 'objects': objs, 'bytes': size} for (token_id, objs, size) in rows]
+    total = {'tokens': tokens, 'objects': objects, 'bytes': num_bytes}
+    return flask.jsonify({'status': 'ok', 'usage': usage, 'total': total})
+
+
+@api_v1.route('/admin/analytics', methods=['GET'])
+@requires_service_token
+@requires_admin_token
+def cache_analytics():
+    """Report the hit ratios of the tokens and cache entries with the most hits, and the compute time saved."""
+    if not Config.analytics:
+        raise exceptions.InvalidRequest('Analytics are not enabled on this server')
+    with timed('index'):
+        report = analytics.report(get_limit())
+    return flask.jsonify(dict(status='ok', **report))
+
+
+@api_v1.route('/admin/profile', methods=['POST'])
+@requires_service_token
+@requires_admin_token
+def start_profile():
+    """
+    Open a profiling window, discarding the samples of any earlier one. The body is JSON with the
+    number of `seconds` to profile for, the `rate` of requests to profile (1 by default), and an
+    optional `route` to only profile requests to, given by its URL rule or endpoint name.
+    """
+    check_content_type('application/json')
+    (seconds, rate, route) = parse_profile_request(get_json())
+    window = profiler.open_window(seconds, rate, route)
+    return flask.jsonify({'status': 'ok', 'profile': window})
+
+
+@api_v1.route('/admin/profile', methods=['GET'])
+@requires_service_token
+@requires_admin_token
+def get_profile():
+    """Download the stacks sampled by all of the workers, as folded stacks for a flame graph."""
+    return flask.Response(profiler.render(), mimetype='text/plain')
+
+
+@api_v1.route('/admin/profile', methods=['DELETE'])
+@requires_service_token
+@requires_admin_token
+def stop_profile():
+    """Close the profiling window early, keeping the samples taken so far."""
+    profiler.close_window()
+    return flask.jsonify({'status': 'ok'})
+
+
+def parse_profile_request(body):
+    """Return the (seconds, rate, route) of a request to start profiling."""
+    if not isinstance(body, dict):
+        raise exceptions.InvalidRequest('The body must be a JSON object')
+    (seconds, rate, route) = (body.get('seconds'), body.get('rate', 1), body.get('route', ''))
+    if not isinstance(seconds, (int, float)) or not 0 < seconds <= Config.profile_max_seconds:
+        raise exceptions.InvalidRequest('The seconds must be between 0 and ' + str(Config.profile_max_seconds))
+    if not isinstance(rate, (int, float)) or not 0 < rate <= 1:
+        raise exceptions.InvalidRequest('The rate must be between 0 and 1')
+    if not isinstance(route, str):
+        raise exceptions.InvalidRequest('The route must be a string')
+    return (seconds, rate, route)
+
+
+@api_v1.route('/cache/<cache_id>', methods=['GET', 'HEAD'])
 @requires_service_token
+@admission.transfer
 def download_cache_file(cache_id):
     """Fetch a file given a cache ID."""
+    if flask.request.method == 'HEAD':
+        return check_cache_file(cache_id)
+    with timed('storage'):
+        found = authorize_download(cache_id, flask.session['token_id'])
+    # Large files are streamed from Minio as they are read, unless a peer replica serves them
+    if found[1] >= Config.ranged_download_min and peers.ring.owner(cache_id) is None:
+        return stream_download(cache_id, found)
     save_dir = tempfile.mkdtemp()
-    path = download_cache(cache_id, flask.session['token_id'], save_dir)
+    with timed('storage'):
+        path = save_download(cache_id, found, save_dir, fetch=peers.fetch)
+    size = os.path.getsize(path)
+    admission.add_bytes(size)
 
     @flask.after_this_request
     def cleanup(response):
         """Remove temporary files when the request is completed."""
         shutil.rmtree(save_dir)
         return response
-    return flask.send_file(path)
+    # Conditional responses allow clients to resume interrupted downloads with a Range header. The
+    # ETag is the file's own, as in stream_download, rather than one made from the temporary copy
+    resp = flask.send_file(path, add_etags=False)
+    resp.set_etag(found[2])
+    return resp.make_conditional(flask.request, accept_ranges=True, complete_length=size)
+
+
+def stream_download(cache_id, found):
+    """
+    Stream a large cache file to the client with concurrent ranged reads from Minio, starting
+    before the whole file has been read. A single range in a Range header is served, unless an
+    If-Range header does not match the file's ETag. Several ranges would need a multipart
+    response, so they get the whole file instead, as RFC 7233 allows.
+    """
+    (metadata, size, etag) = found
+    (start, stop, status) = (0, size, 200)
+    (ranges, if_range) = (flask.request.range, flask.request.if_range)
+    if ranges and len(ranges.ranges) == 1 and if_range.etag in (None, etag) and not if_range.date:
+        bounds = ranges.range_for_length(size)
+        if bounds is None:
+            return ('', 416, {'Content-Range': 'bytes */' + str(size)})
+        (start, stop, status) = bounds + (206,)
+    admission.add_bytes(min(stop - start, Config.download_connections * Config.download_chunk_size))
+    record_download(cache_id, metadata)
+    mimetype = mimetypes.guess_type(metadata['filename'])[0] or 'application/octet-stream'
+    chunks = read_ranges(cache_id, start, stop, etag, cold=is_cold(metadata))
+    resp = flask.Response(chunks, status=status, mimetype=mimetype)
+    resp.headers['Content-Length'] = str(stop - start)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.set_etag(etag)
+    if status == 206:
+        resp.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1, size)
+    return resp
+
+
+@api_v1.route('/cache/batch_download', methods=['POST'])
+@requires_service_token
+@admission.transfer
+def batch_download():
+    """
+    Download many cache files at once as a single streamed archive. The body is JSON with a list
+    of `cache_ids` and an optional `format` of 'tar' (the default) or 'zip'.
+    """
+    check_content_type('application/json')
+    (cache_ids, fmt) = parse_batch_download(get_json())
+    with timed('storage'):
+        files = authorize_many(cache_ids, flask.session['token_id'], Config.batch_download_workers)
+    admission.add_bytes(min(sum(f['size'] for f in files), Config.batch_read_ahead))
+    resp = flask.Response(archive.stream_archive(files, fmt), mimetype=archive.mimetypes[fmt])
+    resp.headers['Content-Disposition'] = 'attachment; filename=caches.' + fmt
+    return resp
+
+
+def parse_batch_download(body):
+    """Return the (cache_ids, format) of a batch download request, without duplicate cache IDs."""
+    if not isinstance(body, dict) or not isinstance(body.get('cache_ids'), list):
+        raise exceptions.InvalidRequest('The body must have a list of cache_ids')
+    cache_ids = list(collections.OrderedDict.fromkeys(str(cache_id) for cache_id in body['cache_ids']))
+    if len(cache_ids) > Config.batch_download_max:
+        max_ids = str(Config.batch_download_max)
+        raise exceptions.InvalidRequest('At most ' + max_ids + ' cache IDs may be downloaded at once')
+    fmt = body.get('format', 'tar')
+    if fmt not in archive.mimetypes:
+        raise exceptions.InvalidRequest('Format must be one of: ' + ', '.join(archive.mimetypes))
+    return (cache_ids, fmt)
+
+
+def check_cache_file(cache_id):
+    """
+    Respond to HEAD requests for a cache file with its metadata in the headers. No temporary
+    files are made and no file data is read.
+    """
+    with timed('storage'):
+        info = get_cache_info(cache_id, flask.session['token_id'])
+    resp = flask.Response(status=200, mimetype='application/octet-stream')
+    resp.headers['Content-Length'] = str(info['size'])
+    resp.headers['ETag'] = '"' + info['etag'] + '"'
+    resp.headers['X-Cache-Filename'] = info['filename']
+    resp.headers['X-Cache-Expiration'] = info['expiration']
+    resp.headers['X-Cache-Placeholder'] = 'true' if info['placeholder'] else 'false'
+    return resp
+
+
+@api_v1.route('/cache/<cache_id>/meta', methods=['GET'])
+@requires_service_token
+def cache_metadata(cache_id):
+    """Fetch the metadata, size, and ETag of a cache file without downloading it."""
+    with timed('storage'):
+        info = get_cache_info(cache_id, flask.session['token_id'])
+    return flask.jsonify({'status': 'ok', 'metadata': info})
+
+
+@api_v1.route('/cache/<cache_id>/wait', methods=['GET'])
+@requires_service_token
+def wait_for_cache_file(cache_id):
+    """
+    Long-poll for the file of a cache ID that another client is producing. Responds as soon as the
+    file is uploaded or the producer's lease expires (in which case the caller may take it over),
+    or after `timeout` seconds (at most Config.lease_max_wait).
+    """
+    timeout = get_timeout()
+    token_id = flask.session['token_id']
+    with timed('storage'):
+        metadata = authorize_access(cache_id, token_id, write=False)
+    if metadata['filename'] == 'placeholder':
+        with timed('wait'):
+            leases.wait(cache_id, timeout)
+        with timed('storage'):
+            metadata = authorize_access(cache_id, token_id, write=False)
+    result = {'status': 'ok', 'metadata': metadata}
+    if metadata['filename'] == 'placeholder':
+        result['lease'] = take_lease(cache_id)
+    return flask.jsonify(result)
+
+
+@api_v1.route('/cache/<cache_id>/lease/<lease_id>', methods=['DELETE'])
+@requires_service_token
+def release_lease(cache_id, lease_id):
+    """Give up a lease without uploading, so that a waiting client can take over right away."""
+    with timed('storage'):
+        authorize_access(cache_id, flask.session['token_id'])
+    leases.release(cache_id, lease_id)
+    return flask.jsonify({'status': 'ok'})
 
 
 @api_v1.route('/cache/<cache_id>', methods=['POST'])
 @requires_service_token
+@admission.transfer
 def upload_cache_file(cache_id):
-    """Upload a file given a cache ID."""
-    if 'file' not in flask.request.files:
+    """
+    Upload a file given a cache ID, adding any tags in the X-Cache-Tags header, and recording the
+    time it took to compute from the X-Compute-Duration header.
+    """
+    tags = get_tags()
+    compute_seconds = get_compute_seconds()
+    with timed('parse'):
+        files = flask.request.files
+    if 'file' not in files:
         return (flask.jsonify({'status': 'error', 'error': 'File field missing'}), 400)
-    f = flask.request.files['file']
+    f = files['file']
     if not f.filename:
         return (flask.jsonify({'status': 'error', 'error': 'Filename missing'}), 400)
-    upload_cache(cache_id, flask.session['token_id'], f)
+    with timed('storage'):
+        upload_cache(cache_id, flask.session['token_id'], f, tags, compute_seconds)
+    return flask.jsonify({'status': 'ok'})
+
+
+@api_v1.route('/cache/<cache_id>', methods=['PUT'])
+@requires_service_token
+@admission.transfer
+def put_cache_file(cache_id):
+    """
+    Upload a file given a cache ID, as the raw request body, with the filename in the
+    X-Cache-Filename header. The body is streamed straight to storage without being parsed.
+    """
+    check_content_type('application/octet-stream')
+    check_header_present('X-Cache-Filename')
+    tags = get_tags()
+    compute_seconds = get_compute_seconds()
+    length = flask.request.content_length
+    # Without a length, the body can only be read if the server has de-chunked it
+    if length is None and not flask.request.environ.get('wsgi.input_terminated'):
+        return (flask.jsonify({'status': 'error', 'error': 'Content-Length required'}), 411)
+    if length is None:
+        admission.add_bytes(stream_part_size)
+    filename = flask.request.headers['X-Cache-Filename']
+    with timed('storage'):
+        upload_stream(cache_id, flask.session['token_id'], filename, flask.request.stream, length, tags,
+                      compute_seconds)
     return flask.jsonify({'status': 'ok'})
 
 
 @api_v1.route('/cache/<cache_id>', methods=['DELETE'])
 @requires_service_token
 def delete(cache_id):
-    delete_cache(cache_id, flask.session['token_id'])
+    with timed('storage'):
+        delete_cache(cache_id, flask.session['token_id'])
+    return flask.jsonify({'status': 'ok'})
+
+
+@api_v1.route('/tags/<path:tag>', methods=['DELETE'])
+@requires_service_token
+def delete_tag(tag):
+    """
+    Delete all of the caller's cache entries that have a tag, or those of the namespace in the
+    X-Cache-Namespace header, which the caller must be a writer of. The response is streamed as
+    newline-delimited JSON, with a line of progress after each batch of entries is deleted, and
+    the final line has a `status` of 'ok'.
+    """
+    if not Config.tags:
+        raise exceptions.InvalidRequest('Tags are not enabled on this server')
+    owner = get_owner()
+    if not namespaces.allows(owner, flask.session['token_id'], write=True):
+        raise exceptions.UnauthorizedAccess('Only writers of a namespace may delete its entries')
+    progress = delete_tagged(owner, tag)
+    return flask.Response(flask.stream_with_context(stream_progress(progress)), mimetype='application/x-ndjson')
+
+
+def stream_progress(progress):
+    """Serialize the progress of a long-running deletion as lines of JSON, ending with its status."""
+    latest = {'total': 0, 'deleted': 0, 'missing': 0, 'errors': 0}
+    try:
+        for latest in progress:
+            yield json.dumps(dict(latest, status='in_progress')) + '\n'
+    except Exception:
+        # The response has started, so the error can only be reported in its body
+        log.log_error()
+        yield json.dumps(dict(latest, status='error', error='Unexpected server error')) + '\n'
+        return
+    yield json.dumps(dict(latest, status='ok')) + '\n'
+
+
+@api_v1.route('/cache/<cache_id>/copy', methods=['POST'])
+@requires_service_token
+def copy_cache_file(cache_id):
+    """
+    Copy a cache file to another cache ID of the same token without re-uploading it. The body is
+    JSON with the `destination` cache ID, and optionally a new `filename`.
+    """
+    check_content_type('application/json')
+    body = get_json()
+    if not isinstance(body, dict) or not isinstance(body.get('destination'), str):
+        raise exceptions.InvalidRequest('The body must have a destination cache ID')
+    if not isinstance(body.get('filename', ''), str):
+        raise exceptions.InvalidRequest('The filename must be a string')
+    with timed('storage'):
+        metadata = copy_cache(cache_id, body['destination'], flask.session['token_id'], body.get('filename'))
+    return flask.jsonify({'status': 'ok', 'metadata': metadata})
+
+
+@api_v1.route('/cache/<cache_id>/uploads', methods=['POST'])
+@requires_service_token
+def create_upload_session(cache_id):
+    """Start a resumable upload; the filename goes in the X-Cache-Filename header."""
+    check_header_present('X-Cache-Filename')
+    filename = flask.request.headers['X-Cache-Filename']
+    with timed('storage'):
+        upload_id = multipart.create_session(cache_id, flask.session['token_id'], filename)
+    return flask.jsonify({'status': 'ok', 'upload_id': upload_id})
+
+
+@api_v1.route('/cache/<cache_id>/uploads/<upload_id>/<int:part_number>', methods=['PUT'])
+@requires_service_token
+@admission.transfer
+def upload_part(cache_id, upload_id, part_number):
+    """
+    Upload one numbered chunk of a resumable upload as the raw request body, which is streamed on to
+    Minio. The body must have a Content-Length.
+    """
+    length = flask.request.content_length
+    if length is None:
+        return (flask.jsonify({'status': 'error', 'error': 'Content-Length header missing'}), 411)
+    if length > Config.max_part_size:
+        error = 'Parts may be at most ' + str(Config.max_part_size) + ' bytes'
+        return (flask.jsonify({'status': 'error', 'error': error}), 413)
+    with timed('storage'):
+        etag = multipart.upload_part(cache_id, flask.session['token_id'], upload_id, part_number,
+                                     flask.request.stream, length)
+    return flask.jsonify({'status': 'ok', 'part_number': part_number, 'etag': etag})
+
+
+@api_v1.route('/cache/<cache_id>/uploads/<upload_id>', methods=['GET'])
+@requires_service_token
+def list_upload_parts(cache_id, upload_id):
+    """List the parts of a resumable upload that have been received so far."""
+    with timed('storage'):
+        parts = multipart.list_parts(cache_id, flask.session['token_id'], upload_id)
+    return flask.jsonify({'status': 'ok', 'parts': parts})
+
+
+@api_v1.route('/cache/<cache_id>/uploads/<upload_id>/complete', methods=['POST'])
+@requires_service_token
+def complete_upload_session(cache_id, upload_id):
+    """Commit a resumable upload, assembling its parts into the cache file."""
+    compute_seconds = get_compute_seconds()
+    with timed('storage'):
+        multipart.complete_session(cache_id, flask.session['token_id'], upload_id, compute_seconds)
+    return flask.jsonify({'status': 'ok'})
+
+
+@api_v1.route('/cache/<cache_id>/uploads/<upload_id>', methods=['DELETE'])
+@requires_service_token
+def abort_upload_session(cache_id, upload_id):
+    """Cancel a resumable upload and discard its parts."""
+    with timed('storage'):
+        multipart.abort_session(cache_id, flask.session['token_id'], upload_id)
     return flask.jsonify({'status': 'ok'})
 
 
@@ -93,13 +540,38 @@ def missing_cache_file(err):
     return (flask.jsonify(result), 404)
 
 
+@api_v1.errorhandler(exceptions.MissingUpload)
+def missing_upload(err):
+    """An upload session was not found; it may have been completed or aborted."""
+    result = {'status': 'error', 'error': str(err)}
+    return (flask.jsonify(result), 404)
+
+
+@api_v1.errorhandler(exceptions.InvalidRequest)
+@api_v1.errorhandler(exceptions.InvalidUpload)
+def invalid_upload(err):
+    """An upload or other request could not be accepted."""
+    result = {'status': 'error', 'error': str(err)}
+    return (flask.jsonify(result), 400)
+
+
 # General, small route helpers
 # ----------------------------
 
+def take_lease(cache_id):
+    """Try to take the lease to produce the file for an empty cache ID, for a response body."""
+    (lease_id, expiration) = leases.acquire(cache_id)
+    return {
+        'state': 'acquired' if lease_id else 'in_progress',
+        'lease_id': lease_id,
+        'expiration': int(expiration)
+    }
+
+
 def check_content_type(correct):
     ct = flask.request.headers.get('Content-Type')
-    if ct != 'application/json':
-        raise exceptions.InvalidContentType(str(ct), 'application/json')
+    if ct != correct:
+        raise exceptions.InvalidContentType(str(ct), correct)
 
 
 def check_header_present(name):
@@ -107,5 +579,65 @@ def check_header_present(name):
         raise exceptions.MissingHeader(name)
 
 
+def get_owner():
+    """
+    Return the owner ID of the entries that the caller asks for: the namespace in the
+    X-Cache-Namespace header, if there is one, and otherwise the caller's own token.
+    """
+    name = flask.request.headers.get('X-Cache-Namespace')
+    return namespaces.owner_id(name) if name else flask.session['token_id']
+
+
+def get_tags():
+    """Read the tags for a cache entry from the X-Cache-Tags header, where they are separated by commas."""
+    header = flask.request.headers.get('X-Cache-Tags', '')
+    tags = sorted({tag.strip() for tag in header.split(',') if tag.strip()})
+    if tags and not Config.tags:
+        raise exceptions.InvalidRequest('Tags are not enabled on this server')
+    if len(tags) > Config.max_tags:
+        raise exceptions.InvalidRequest('At most ' + str(Config.max_tags) + ' tags may be given')
+    if any(len(tag) > Config.max_tag_length for tag in tags):
+        raise exceptions.InvalidRequest('Tags may be at most ' + str(Config.max_tag_length) + ' characters')
+    return tags
+
+
+def get_compute_seconds():
+    """Read the seconds that an uploaded file took to compute from the X-Compute-Duration header, if any."""
+    header = flask.request.headers.get('X-Compute-Duration')
+    if header is None:
+        return None
+    try:
+        seconds = float(header)
+    except ValueError:
+        seconds = -1.0
+    # Also rules out infinity and NaN
+    if not 0 <= seconds < float('inf'):
+        raise exceptions.InvalidRequest('X-Compute-Duration must be a number of seconds')
+    return seconds
+
+
 def get_json():
     return json.loads(flask.request.data)  # Throws a JSONDecodeError
+
+
+def get_timeout():
+    """Read the `timeout` query parameter of a long-poll, capped at Config.lease_max_wait."""
+    try:
+        timeout = float(flask.request.args.get('timeout', Config.lease_max_wait))
+    except ValueError:
+        raise exceptions.InvalidRequest('Timeout must be a number')
+    # Also false for NaN
+    if not timeout >= 0:
+        raise exceptions.InvalidRequest('Timeout must not be negative')
+    return min(timeout, Config.lease_max_wait)
+
+
+def get_limit():
+    """Read the `limit` query parameter of a paginated route."""
+    try:
+        limit = int(flask.request.args.get('limit', 100))
+    except ValueError:
+        raise exceptions.InvalidRequest('The limit must be an integer')
+    if not 0 < limit <= Config.list_page_max:
+        raise exceptions.InvalidRequest('The limit must be between 1 and ' + str(Config.list_page_max))
+    return limit
@@ -0,0 +1,29 @@
+"""Internal routes that replicas of the service use to fetch hot copies from each other."""
+import flask
+
+from .. import exceptions
+from .. import peers
+from ..log import timed
+from ..minio import lookup_cache
+
+peer_api = flask.Blueprint('peer_api', __name__)
+
+
+@peer_api.route('/peer/<cache_id>/<etag>', methods=['GET'])
+def hot_copy(cache_id, etag):
+    """
+    Send the hot copy of a cache file that this replica owns, fetching it from Minio if needed.
+    Requests must carry the secret shared by the replicas rather than a user's token.
+    """
+    if not peers.is_authorized(flask.request.headers.get(peers.secret_header)):
+        return (flask.jsonify({'status': 'error', 'error': 'Unauthorized peer'}), 403)
+    with timed('storage'):
+        try:
+            (metadata, _, current_etag) = lookup_cache(cache_id)
+        except exceptions.MissingCache:
+            current_etag = None
+        # The requesting replica falls back to Minio if it saw a different version of the file
+        if current_etag != etag or metadata['filename'] == 'placeholder':
+            return (flask.jsonify({'status': 'error', 'error': 'Cache ID not found'}), 404)
+        path = peers.hot_copy(cache_id, etag)
+    return flask.send_file(path, mimetype='application/octet-stream')
@@ -0,0 +1,148 @@
+"""
+Streamed tar and zip archives of many cache files, for batch downloads.
+
+Files are fetched from Minio concurrently, with a bounded amount of data read ahead of what has
+been sent, so that a batch of many small files is limited by bandwidth rather than by the latency
+of each request. Files too large to hold in memory are streamed through when their turn comes, with concurrent
+ranged reads.
+"""
+import collections
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import Config
+from . import minio as storage
+
+mimetypes = {'tar': 'application/x-tar', 'zip': 'application/zip'}
+
+
+def stream_archive(files, fmt):
+    """
+    Yield the bytes of a 'tar' or 'zip' archive of cache files, given as dicts from
+    `minio.authorize_many`. Each file is named '<cache_id>/<filename>' in the archive, and counts
+    as downloaded once it has been added.
+    """
+    writer = TarWriter() if fmt == 'tar' else ZipWriter()
+    mtime = time.time()
+    with ThreadPoolExecutor(Config.batch_download_workers) as pool:
+        reader = ReadAhead(pool, Config.batch_read_ahead)
+        for (entry, chunks) in reader.read(files):
+            name = entry['cache_id'] + '/' + entry['filename']
+            yield from writer.add(name, entry['size'], mtime, chunks)
+            storage.record_download(entry['cache_id'], entry['metadata'])
+    yield from writer.close()
+
+
+class ReadAhead:
+    """
+    Fetch cache files with a thread pool, keeping no more than `max_bytes` of them in memory, and
+    hand them back in their original order.
+    """
+
+    def __init__(self, pool, max_bytes):
+        self.pool = pool
+        self.max_bytes = max_bytes
+        self._pending = collections.deque()  # type: collections.deque
+        self._held = 0
+
+    def read(self, files):
+        """Yield (file, chunks) for each file, where chunks is an iterable of its contents."""
+        for entry in files:
+            yield from self._add(entry)
+        while self._pending:
+            yield self._pop()
+
+    def _add(self, entry):
+        """Start fetching a file, first yielding as many earlier files as it takes to make room."""
+        while self._pending and self._held + entry['size'] > self.max_bytes:
+            yield self._pop()
+        if entry['size'] > self.max_bytes:
+            yield (entry, storage.read_ranges(entry['cache_id'], 0, entry['size'], cold=entry['cold']))
+            return
+        self._pending.append((entry, self.pool.submit(_fetch, entry['cache_id'], entry['cold'])))
+        self._held += entry['size']
+
+    def _pop(self):
+        (entry, future) = self._pending.popleft()
+        self._held -= entry['size']
+        return (entry, [future.result()])
+
+
+def _fetch(cache_id, cold):
+    return storage.read_stream(storage.open_cold(cache_id) if cold else storage.open_cache(cache_id))
+
+
+class TarWriter:
+    """Write a tar archive as a sequence of byte strings, for files whose sizes are known up front."""
+
+    def __init__(self):
+        self._offset = 0
+
+    def add(self, name, size, mtime, chunks):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        # Cache IDs alone are longer than the 100 characters allowed in a plain tar header
+        yield self._emit(info.tobuf(tarfile.PAX_FORMAT))
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            yield self._emit(chunk)
+        if written != size:
+            raise RuntimeError('Cache file ' + name + ' changed size while it was being archived')
+        yield self._emit(self._padding(tarfile.BLOCKSIZE))
+
+    def close(self):
+        yield self._emit(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        yield self._emit(self._padding(tarfile.RECORDSIZE))
+
+    def _emit(self, data):
+        self._offset += len(data)
+        return data
+
+    def _padding(self, size):
+        return tarfile.NUL * (-self._offset % size)
+
+
+class ZipWriter:
+    """Write an uncompressed zip archive as a sequence of byte strings."""
+
+    def __init__(self):
+        self._buf = _Buffer()
+        # The buffer cannot seek, so zipfile writes sizes after the data rather than going back
+        self._zip = zipfile.ZipFile(self._buf, 'w', zipfile.ZIP_STORED)
+
+    def add(self, name, size, mtime, chunks):
+        info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+        # A known size lets zipfile decide up front whether the entry needs ZIP64
+        info.file_size = size
+        with self._zip.open(info, 'w') as fd:
+            for chunk in chunks:
+                fd.write(chunk)
+                yield self._buf.take()
+        yield self._buf.take()
+
+    def close(self):
+        self._zip.close()
+        yield self._buf.take()
+
+
+class _Buffer:
+    """A write-only file that hands back what has been written to it since the last `take`."""
+
+    def __init__(self):
+        self._chunks = []  # type: list
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        (data, self._chunks) = (b''.join(self._chunks), [])
+        return data
@@ -0,0 +1,35 @@
+"""
+Shared cache namespaces.
+
+A cache ID in a namespace is generated from the namespace rather than from the caller's token, so
+every token that asks for the same data in it gets the same cache ID. Its entry is owned by the
+namespace: the `token_id` in its metadata is 'namespace:<name>'. Access is then decided from that
+metadata and the configured readers and writers of the namespace (see Config.namespaces), so
+checking it takes no more lookups than for an entry that a token owns.
+"""
+from ..config import Config
+from ..exceptions import InvalidRequest
+
+# Prefix of the owner ID of a namespace's entries. Token IDs start with the auth URL instead
+prefix = 'namespace:'
+
+
+def owner_id(name):
+    """Return the owner ID of the entries in a namespace, raising InvalidRequest if there is no such namespace."""
+    if name not in Config.namespaces:
+        raise InvalidRequest('There is no namespace named "{}"'.format(name))
+    return prefix + name
+
+
+def allows(owner, token_id, write=False):
+    """
+    Whether a token may read, or if `write` is set, write the entries of an owner, which is either
+    the token itself or a namespace.
+    """
+    if token_id == owner:
+        return True
+    if not owner.startswith(prefix) or owner[len(prefix):] not in Config.namespaces:
+        return False
+    access = Config.namespaces[owner[len(prefix):]]
+    users = access['write'] if write else access['read'] | access['write']
+    return '*' in users or token_id in {Config.kbase_auth_url + ':' + user for user in users}
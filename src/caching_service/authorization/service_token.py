@@ -1,10 +1,20 @@
 """User authorization utilities."""
+import collections
 import flask
 import functools
 import requests
+import time
 
+from ..breaker import auth_breaker
 from ..config import Config
-from ..exceptions import MissingHeader, UnauthorizedAccess
+from ..exceptions import BackendUnavailable, MissingHeader, UnauthorizedAccess
+from ..hash import bhash
+from ..log import timed
+
+# Hash of a token -> (token ID, time that the auth service accepted it), least recently used first
+_token_ids = collections.OrderedDict()  # type: collections.OrderedDict
+# Most tokens to remember in each worker
+_max_tokens = 10000
 
 
 def requires_service_token(fn):
@@ -19,20 +29,64 @@ def requires_service_token(fn):
         token = flask.request.headers.get('Authorization')
         if not token:
             raise MissingHeader('Authorization')
-        headers = {'Authorization': token}
-        url = Config.kbase_auth_url + '/api/V2/token'
-        auth_resp = requests.get(url, headers=headers)
-        auth_json = auth_resp.json()
-        if 'error' in auth_json:
-            raise UnauthorizedAccess(auth_json['error']['message'])
-            resp = {
-                'error': auth_json['error']['message'],
-                'status': 'error',
-                'auth_endpoint': Config.kbase_auth_url
-            }
-            return (flask.jsonify(resp), 403)
-        else:
-            token_id = ':'.join([Config.kbase_auth_url, auth_json['user']])
-            flask.session['token_id'] = token_id
-            return fn(*args, **kwargs)
+        with timed('auth'):
+            flask.session['token_id'] = get_token_id(token)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def requires_admin_token(fn):
+    """
+    Authorize that the requester is one of Config.admin_users. Apply it after
+    requires_service_token, which sets the session's token ID.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        admins = [Config.kbase_auth_url + ':' + user for user in Config.admin_users]
+        if flask.session['token_id'] not in admins:
+            raise UnauthorizedAccess('You do not have administrative access')
+        return fn(*args, **kwargs)
     return wrapper
+
+
+def get_token_id(token):
+    """
+    Return the 'auth_url:username' identity of a token, remembering it for Config.auth_cache_ttl
+    seconds. While the auth service is unavailable, a token that it recently accepted is still
+    accepted, for up to Config.auth_stale_ttl seconds.
+    """
+    key = bhash(token)
+    cached = _token_ids.get(key)
+    now = time.time()
+    if cached and now - cached[1] < Config.auth_cache_ttl:
+        _token_ids.move_to_end(key)
+        return cached[0]
+    try:
+        token_id = fetch_token_id(token)
+    except BackendUnavailable:
+        if cached and now - cached[1] < Config.auth_stale_ttl:
+            return cached[0]
+        raise
+    _token_ids[key] = (token_id, now)
+    _token_ids.move_to_end(key)
+    while len(_token_ids) > _max_tokens:
+        _token_ids.popitem(last=False)
+    return token_id
+
+
+def fetch_token_id(token):
+    """Look up the identity of a token with the auth service, through its circuit breaker."""
+    auth_breaker.before()
+    try:
+        auth_resp = requests.get(Config.kbase_auth_url + '/api/V2/token', headers={'Authorization': token},
+                                 timeout=Config.auth_timeout)
+    except requests.exceptions.RequestException:
+        auth_breaker.record(False)
+        raise BackendUnavailable(auth_breaker.name, auth_breaker.retry_after())
+    auth_breaker.record(auth_resp.status_code < 500)
+    if auth_resp.status_code >= 500:
+        raise BackendUnavailable(auth_breaker.name, auth_breaker.retry_after())
+    auth_json = auth_resp.json()
+    if 'error' in auth_json:
+        raise UnauthorizedAccess(auth_json['error']['message'])
+    return ':'.join([Config.kbase_auth_url, auth_json['user']])
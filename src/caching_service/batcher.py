@@ -0,0 +1,56 @@
+"""Buffer writes in memory and flush them in batches from a background thread."""
+import atexit
+import os
+import threading
+import time
+
+from . import log
+
+
+class Batcher:
+    """
+    Collect keyed updates in memory and pass them to `flush_fn` as a dict every `interval` seconds,
+    so that request handlers never wait on the write.
+
+    Repeated updates to the same key are combined with `merge(old_value, new_value)`; by default the
+    newest value wins.
+    """
+
+    def __init__(self, flush_fn, interval, merge=None):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.merge = merge or (lambda old, new: new)
+        self._pending = {}  # type: dict
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def add(self, key, value):
+        """Queue an update for `key`."""
+        with self._lock:
+            if key in self._pending:
+                value = self.merge(self._pending[key], value)
+            self._pending[key] = value
+        self._start()
+
+    def flush(self):
+        """Write out everything that is pending right now."""
+        with self._lock:
+            (batch, self._pending) = (self._pending, {})
+        if batch:
+            self.flush_fn(batch)
+
+    def _start(self):
+        """Start the flushing thread. Threads do not survive a fork, so each worker starts its own."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                log.logger.exception('Batch flush failed')
@@ -0,0 +1,137 @@
+"""
+Circuit breakers for the backends that the service depends on: Minio (with the cold tier, if any,
+on a breaker of its own) and the KBase auth service.
+
+Each worker keeps a breaker per backend, which counts the outcomes of the requests made to it in
+a window of time. Once too many of them fail, the breaker opens, and requests fail fast with a
+503 rather than piling up while they wait on the backend. After a while, a single request is let
+through to probe the backend: the breaker closes again if it succeeds, and stays open for another
+period if it fails.
+"""
+import math
+import threading
+import time
+import urllib3
+
+from .config import Config
+from . import exceptions
+from . import metrics
+
+# Breaker states, in the order of their metric values
+states = ['closed', 'half_open', 'open']
+
+
+class CircuitBreaker:
+    """
+    A breaker for one backend. Call `before` ahead of each request to the backend, which raises
+    BackendUnavailable while the breaker is open, and then `record` with whether it succeeded.
+    """
+
+    def __init__(self, name, failure_ratio, min_requests, window, reset_timeout, clock=time.monotonic):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.opened_count = 0
+        self.rejected_count = 0
+        self._lock = threading.Lock()
+        self._opened = 0.0
+        self._probing = False
+        self._reset_window(clock())
+
+    def before(self):
+        """Raise BackendUnavailable if requests to the backend should not be made right now."""
+        with self._lock:
+            if self.state == 'open' and self.clock() >= self._opened + self.reset_timeout:
+                self.state = 'half_open'
+                self._probing = False
+            # Only one probe at a time is let through while half open
+            if self.state == 'open' or (self.state == 'half_open' and self._probing):
+                self.rejected_count += 1
+                raise exceptions.BackendUnavailable(self.name, self.retry_after())
+            if self.state == 'half_open':
+                self._probing = True
+
+    def record(self, success):
+        """Record the outcome of a request to the backend."""
+        with self._lock:
+            now = self.clock()
+            if self.state == 'half_open':
+                self._probing = False
+                if success:
+                    self.state = 'closed'
+                    self._reset_window(now)
+                else:
+                    self._open(now)
+                return
+            if now - self._window_start > self.window:
+                self._reset_window(now)
+            self._requests += 1
+            self._failures += 0 if success else 1
+            if self._requests >= self.min_requests and self._failures >= self.failure_ratio * self._requests:
+                self._open(now)
+
+    def retry_after(self):
+        """Whole seconds until the backend gets probed again."""
+        if self.state != 'open':
+            return 1
+        return max(1, math.ceil(self._opened + self.reset_timeout - self.clock()))
+
+    def _open(self, now):
+        self.state = 'open'
+        self._opened = now
+        self.opened_count += 1
+        self._reset_window(now)
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._requests = 0
+        self._failures = 0
+
+
+def _new_breaker(name):
+    return CircuitBreaker(name, Config.breaker_failure_ratio, Config.breaker_min_requests,
+                          Config.breaker_window, Config.breaker_reset_timeout)
+
+
+minio_breaker = _new_breaker('minio')
+cold_breaker = _new_breaker('minio_cold')
+auth_breaker = _new_breaker('auth')
+
+
+class BreakerPoolManager(urllib3.PoolManager):
+    """
+    A urllib3 pool manager that sends its requests through a circuit breaker. Connection errors,
+    timeouts, and server errors count as failures, and are raised as BackendUnavailable.
+    """
+
+    def __init__(self, breaker, **kwargs):
+        super().__init__(**kwargs)
+        self.breaker = breaker
+
+    def urlopen(self, method, url, redirect=True, **kwargs):
+        self.breaker.before()
+        try:
+            response = super().urlopen(method, url, redirect=redirect, **kwargs)
+        except urllib3.exceptions.HTTPError as err:
+            self.breaker.record(False)
+            raise exceptions.BackendUnavailable(self.breaker.name, self.breaker.retry_after()) from err
+        self.breaker.record(response.status < 500)
+        return response
+
+
+@metrics.collector
+def collect_metrics():
+    breakers = [minio_breaker, cold_breaker, auth_breaker]
+    return [
+        ('cache_breaker_state', 'gauge',
+         'State of the circuit breaker of a backend in this worker (0 closed, 1 half open, 2 open).',
+         [({'backend': brk.name}, states.index(brk.state)) for brk in breakers]),
+        ('cache_breaker_opened_total', 'counter', 'Times that the circuit breaker of a backend has opened.',
+         [({'backend': brk.name}, brk.opened_count) for brk in breakers]),
+        ('cache_breaker_rejected_total', 'counter', 'Requests failed fast by the circuit breaker of a backend.',
+         [({'backend': brk.name}, brk.rejected_count) for brk in breakers]),
+    ]
@@ -1,6 +1,32 @@
 """Global, static application configuration data stored in an object."""
 from uuid import uuid4
 import os
+import tempfile
+
+
+def _parse_size_ttls(text):
+    """Parse a string of 'max_bytes:ttl_seconds' pairs, separated by commas, sorted by size."""
+    pairs = [item.split(':') for item in text.split(',') if item.strip()]
+    return sorted((int(size), int(ttl)) for (size, ttl) in pairs)
+
+
+def _parse_namespaces(text):
+    """
+    Parse a string of 'name:readers:writers' triples, separated by commas, into a dict of name ->
+    {'read': set of users, 'write': set of users}. Users are separated by '|', and '*' is anyone.
+    """
+    triples = [item.strip().split(':') for item in text.split(',') if item.strip()]
+    return {
+        name: {'read': set(filter(None, readers.split('|'))), 'write': set(filter(None, writers.split('|')))}
+        for (name, readers, writers) in triples
+    }
+
+
+def _parse_flag(text, default):
+    """Parse an on/off setting, which is on unless it is empty, '0', 'false', or 'no'."""
+    if text is None:
+        return default
+    return text.strip().lower() not in ('', '0', 'false', 'no')
 
 
 class Config:
@@ -16,3 +42,194 @@ class Config:
     minio_https = os.environ.get('MINIO_SECURE', False)
     # KBase authentication URL
     kbase_auth_url = os.environ.get('KBASE_AUTH_URL', 'http://auth:5000')
+    # Retention policy
+    # Seconds that a generated cache ID lives without an upload
+    placeholder_ttl = int(os.environ.get('PLACEHOLDER_TTL', 604800))
+    # Seconds that a cache file lives after being uploaded (or last downloaded, if sliding)
+    cache_ttl = int(os.environ.get('CACHE_TTL', 2592000))
+    # Optional TTLs by size class, such as '1048576:7776000,1073741824:604800'. A file gets the TTL
+    # of the smallest class it fits in, or `cache_ttl` if it is larger than all of them
+    cache_ttl_by_size = _parse_size_ttls(os.environ.get('CACHE_TTL_BY_SIZE', ''))
+    # Refresh the expiration of a cache file whenever it gets downloaded
+    sliding_expiration = bool(os.environ.get('SLIDING_EXPIRATION'))
+    # Evict the least recently used files when the bucket grows past this many bytes (0 to disable)
+    max_bucket_bytes = int(os.environ.get('MAX_BUCKET_BYTES', 0))
+    # Seconds between batched writes of download times to the cache metadata
+    access_flush_interval = int(os.environ.get('ACCESS_FLUSH_INTERVAL', 60))
+    # Seconds that a cache file's recorded download time (and sliding expiration) may lag behind,
+    # so that a popular file's metadata is rewritten at most this often
+    access_refresh_interval = int(os.environ.get('ACCESS_REFRESH_INTERVAL', 3600))
+    # Path of the local SQLite index shared by all workers on this host
+    index_path = os.environ.get('INDEX_PATH', os.path.join(tempfile.gettempdir(), 'caching_service', 'index.db'))
+    # Keep placeholders for generated cache IDs in the index rather than as empty Minio objects
+    placeholder_index = bool(os.environ.get('PLACEHOLDER_INDEX'))
+    # Fraction of successful requests to write to the access log (errors are always logged)
+    log_sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', 1))
+    # Log records waiting to be written beyond this many get dropped rather than block a request
+    log_queue_size = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    # Largest chunk, in bytes, accepted for one part of a resumable upload
+    max_part_size = int(os.environ.get('MAX_PART_SIZE', 134217728))
+    # Seconds that the first client to register an empty cache ID has to upload its file, before
+    # another client may take over
+    lease_ttl = int(os.environ.get('LEASE_TTL', 600))
+    # Longest time, in seconds, that a request may wait on another client's lease
+    lease_max_wait = int(os.environ.get('LEASE_MAX_WAIT', 60))
+    # Seconds between checks for leases that were released by other workers or have expired
+    lease_poll_interval = float(os.environ.get('LEASE_POLL_INTERVAL', 0.5))
+    # Cache files smaller than this many bytes get moved into shared pack objects by the `pack`
+    # admin command (0 to disable). Packed files are recorded in the index
+    pack_threshold = int(os.environ.get('PACK_THRESHOLD', 0))
+    # Target size, in bytes, of each pack object
+    pack_size = int(os.environ.get('PACK_SIZE', 67108864))
+    # Packs are rewritten by the `compact_packs` admin command once this fraction of them is expired
+    pack_compact_ratio = float(os.environ.get('PACK_COMPACT_RATIO', 0.5))
+    # Most cache IDs that can be fetched with one batch download
+    batch_download_max = int(os.environ.get('BATCH_DOWNLOAD_MAX', 1000))
+    # Number of cache files that a batch download fetches from Minio at the same time
+    batch_download_workers = int(os.environ.get('BATCH_DOWNLOAD_WORKERS', 16))
+    # Bytes of file data that a batch download may fetch ahead of what it has sent
+    batch_read_ahead = int(os.environ.get('BATCH_READ_AHEAD', 67108864))
+    # Run a background sweeper in one of the workers to remove expired files continuously. The worker
+    # is elected through the local index, so this only works with every worker on one host
+    sweeper = bool(os.environ.get('SWEEPER'))
+    # Most Minio requests per second that the sweeper may make
+    sweeper_ops_per_second = float(os.environ.get('SWEEPER_OPS_PER_SECOND', 20))
+    # The sweeper slows down while the average response time of requests rises above this many seconds
+    sweeper_latency_target = float(os.environ.get('SWEEPER_LATENCY_TARGET', 1))
+    # Number of objects that the sweeper lists at a time
+    sweeper_page_size = int(os.environ.get('SWEEPER_PAGE_SIZE', 1000))
+    # Seconds after which another worker may take over from a sweeper that has stopped
+    sweeper_lock_ttl = int(os.environ.get('SWEEPER_LOCK_TTL', 60))
+    # Base URLs of all of the replicas of the service, including this one, separated by commas. Each
+    # cache file is owned by one of them, which fetches it from Minio and keeps a hot copy on disk
+    peers = [url.strip().rstrip('/') for url in os.environ.get('PEERS', '').split(',') if url.strip()]
+    # Base URL of this replica, as it appears in `peers`
+    self_url = os.environ.get('SELF_URL', '').rstrip('/')
+    # Secret that replicas send each other with requests for hot copies
+    peer_secret = os.environ.get('PEER_SECRET', '')
+    # Points that each replica gets on the consistent-hash ring
+    peer_vnodes = int(os.environ.get('PEER_VNODES', 100))
+    # Seconds to wait on another replica before falling back to Minio
+    peer_timeout = float(os.environ.get('PEER_TIMEOUT', 5))
+    # Seconds to skip a replica for after a request to it fails
+    peer_retry_after = int(os.environ.get('PEER_RETRY_AFTER', 30))
+    # Compute-once leases, tags, and hit analytics keep their records in the local index, so they
+    # are off unless turned on, which the service refuses with several replicas (see check_replicas)
+    leases = _parse_flag(os.environ.get('LEASES'), False)
+    tags = _parse_flag(os.environ.get('TAGS'), False)
+    analytics = _parse_flag(os.environ.get('ANALYTICS'), False)
+    # Directory for the hot copies of the files that this replica owns, and its size limit in bytes
+    hot_cache_dir = os.environ.get('HOT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'caching_service', 'hot'))
+    hot_cache_bytes = int(os.environ.get('HOT_CACHE_BYTES', 10737418240))
+    # Watermarks for admission control, beyond which new uploads and downloads are turned away with
+    # a 503 (0 to disable each one): the number of transfers in flight in each worker and on the
+    # whole host, and the bytes that they hold in memory or on temporary disk
+    max_worker_transfers = int(os.environ.get('MAX_WORKER_TRANSFERS', 0))
+    max_transfers = int(os.environ.get('MAX_TRANSFERS', 0))
+    max_worker_transfer_bytes = int(os.environ.get('MAX_WORKER_TRANSFER_BYTES', 0))
+    max_transfer_bytes = int(os.environ.get('MAX_TRANSFER_BYTES', 0))
+    # Seconds that a transfer over a watermark may queue for others to finish before it is rejected
+    admission_wait = float(os.environ.get('ADMISSION_WAIT', 0))
+    # Seconds that rejected clients are told to wait before trying again
+    admission_retry_after = int(os.environ.get('ADMISSION_RETRY_AFTER', 10))
+    # Seconds between reads of the other workers' transfers from the index
+    admission_refresh_interval = float(os.environ.get('ADMISSION_REFRESH_INTERVAL', 0.5))
+    # Seconds to wait on Minio to accept a connection, and for each read of a response from it
+    minio_connect_timeout = float(os.environ.get('MINIO_CONNECT_TIMEOUT', 5))
+    minio_read_timeout = float(os.environ.get('MINIO_READ_TIMEOUT', 60))
+    # Seconds to wait on the KBase auth service
+    auth_timeout = float(os.environ.get('AUTH_TIMEOUT', 10))
+    # Seconds that the identity of a token is remembered for. While the auth service is unavailable,
+    # tokens that it accepted within the last `auth_stale_ttl` seconds are still accepted
+    auth_cache_ttl = int(os.environ.get('AUTH_CACHE_TTL', 60))
+    auth_stale_ttl = int(os.environ.get('AUTH_STALE_TTL', 3600))
+    # Circuit breakers: requests to a backend fail fast once this fraction of at least
+    # `breaker_min_requests` requests to it within `breaker_window` seconds have failed. After
+    # `breaker_reset_timeout` seconds, a single request is let through to probe the backend
+    breaker_failure_ratio = float(os.environ.get('BREAKER_FAILURE_RATIO', 0.5))
+    breaker_min_requests = int(os.environ.get('BREAKER_MIN_REQUESTS', 10))
+    breaker_window = float(os.environ.get('BREAKER_WINDOW', 30))
+    breaker_reset_timeout = float(os.environ.get('BREAKER_RESET_TIMEOUT', 15))
+    # Seconds that each worker keeps the result of a Minio health check for its readiness endpoint
+    health_check_interval = float(os.environ.get('HEALTH_CHECK_INTERVAL', 5))
+    # Record the token that owns each cache entry in the index, so that tokens can list their entries
+    owner_index = bool(os.environ.get('OWNER_INDEX'))
+    # Most entries returned by one page of a listing
+    list_page_max = int(os.environ.get('LIST_PAGE_MAX', 1000))
+    # Usernames whose tokens may use the admin endpoints, separated by commas
+    admin_users = [user.strip() for user in os.environ.get('ADMIN_USERS', '').split(',') if user.strip()]
+    # Concurrent bucket listings made when reconciling the usage totals of each token
+    usage_scan_workers = int(os.environ.get('USAGE_SCAN_WORKERS', 8))
+    # Most tags that a cache entry may be given at once, and the longest that a tag may be
+    max_tags = int(os.environ.get('MAX_TAGS', 20))
+    max_tag_length = int(os.environ.get('MAX_TAG_LENGTH', 256))
+    # Invalidating a tag deletes its entries in batches of this many, each looked up by this many
+    # concurrent requests to Minio and then removed with a single bulk delete
+    tag_delete_batch = int(os.environ.get('TAG_DELETE_BATCH', 500))
+    tag_delete_workers = int(os.environ.get('TAG_DELETE_WORKERS', 8))
+    # Longest that a profiling window may be opened for, in seconds
+    profile_max_seconds = float(os.environ.get('PROFILE_MAX_SECONDS', 600))
+    # Seconds between samples of the stacks of profiled requests
+    profile_interval = float(os.environ.get('PROFILE_INTERVAL', 0.01))
+    # Seconds between each worker's reads of the profiling window, and between its writes of samples
+    profile_poll_interval = float(os.environ.get('PROFILE_POLL_INTERVAL', 1))
+    profile_flush_interval = float(os.environ.get('PROFILE_FLUSH_INTERVAL', 5))
+    # Files of at least this many bytes are streamed to the client as they are read from Minio, in
+    # chunks of `download_chunk_size` bytes with `download_connections` ranged reads at a time
+    ranged_download_min = int(os.environ.get('RANGED_DOWNLOAD_MIN', 67108864))
+    download_chunk_size = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 8388608))
+    download_connections = int(os.environ.get('DOWNLOAD_CONNECTIONS', 4))
+    # Connections to Minio that each worker keeps open for re-use
+    minio_pool_size = int(os.environ.get('MINIO_POOL_SIZE', 32))
+    # Bucket of the cold tier, which cache files of at least `cold_min_size` bytes that have not been
+    # downloaded for `cold_after` seconds are moved to. Unset to keep every file in the hot tier
+    cold_bucket = os.environ.get('COLD_BUCKET', '')
+    cold_after = int(os.environ.get('COLD_AFTER', 604800))
+    cold_min_size = int(os.environ.get('COLD_MIN_SIZE', 1048576))
+    # The cold tier may be on another Minio server, such as one on cheaper disks
+    cold_minio_host = os.environ.get('COLD_MINIO_HOST', minio_host)
+    cold_minio_access_key = os.environ.get('COLD_MINIO_ACCESS_KEY', minio_access_key)
+    cold_minio_secret_key = os.environ.get('COLD_MINIO_SECRET_KEY', minio_secret_key)
+    cold_minio_https = os.environ.get('COLD_MINIO_SECURE', minio_https)
+    # Most bytes per second that the background mover copies between the tiers
+    tiering_bytes_per_second = float(os.environ.get('TIERING_BYTES_PER_SECOND', 52428800))
+    # Move cache files back to the hot tier once they are downloaded from the cold tier
+    cold_promote = bool(os.environ.get('COLD_PROMOTE'))
+    # Seconds after it was written that an object in the cold tier may be removed, once no cache
+    # file refers to it any longer
+    cold_grace = int(os.environ.get('COLD_GRACE', 3600))
+    # Cache entries copied at a time by the `export` and `import` admin commands
+    migration_workers = int(os.environ.get('MIGRATION_WORKERS', 8))
+    # Shared namespaces, whose cache IDs do not depend on the token, so that different tokens can
+    # reuse each other's results. Their readers may look up and download entries, and their writers
+    # may also create and upload them
+    namespaces = _parse_namespaces(os.environ.get('NAMESPACES', ''))
+    # Seconds between each worker's writes of hit and miss counts to the index
+    analytics_flush_interval = int(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 60))
+    # Seconds after a cache entry expires that its hit and miss counts are kept for reports
+    analytics_retention = int(os.environ.get('ANALYTICS_RETENTION', 2592000))
+
+
+def local_index_features():
+    """Return the settings of the enabled features that keep their records, or their lock, only in the local index."""
+    features = {
+        'PLACEHOLDER_INDEX': Config.placeholder_index,
+        'OWNER_INDEX': Config.owner_index,
+        'PACK_THRESHOLD': Config.pack_threshold,
+        'LEASES': Config.leases,
+        'TAGS': Config.tags,
+        'ANALYTICS': Config.analytics,
+        'SWEEPER': Config.sweeper,
+    }
+    return [name for (name, enabled) in features.items() if enabled]
+
+
+def check_replicas():
+    """
+    Refuse to run several replicas (Config.peers) with any feature that keeps its records only in
+    the local index of one host, as the other replicas would not see them.
+    """
+    features = local_index_features()
+    if Config.peers and features:
+        raise RuntimeError('PEERS cannot be combined with ' + ', '.join(features) +
+                           ', which are kept in the local index of each host')
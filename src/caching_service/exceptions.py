@@ -39,3 +39,55 @@ class UnauthorizedAccess(Exception):
 
     def __str__(self):
         return self.msg
+
+
+class MissingUpload(Exception):
+    """An upload session with upload_id does not exist (or was already completed or aborted)."""
+
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+
+    def __str__(self):
+        return "Unknown upload ID: " + self.upload_id
+
+
+class InvalidUpload(Exception):
+    """An upload request was malformed or could not be completed."""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class InvalidRequest(Exception):
+    """The body of a request was well-formed JSON, but not valid for the route."""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class Overloaded(Exception):
+    """The server has too many transfers in flight to take on another one right now."""
+
+    def __init__(self, msg, retry_after):
+        self.msg = msg
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.msg
+
+
+class BackendUnavailable(Exception):
+    """A backend service, such as Minio or the KBase auth service, is failing or cut off."""
+
+    def __init__(self, backend, retry_after):
+        self.backend = backend
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return "The " + self.backend + " service is unavailable, try again later"
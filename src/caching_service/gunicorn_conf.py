@@ -0,0 +1,36 @@
+"""
+Gunicorn settings and hooks, loaded by scripts/start_server.sh.
+
+Outside of development the app is preloaded: it is imported once in the master, and the workers
+are forked from it, rather than each worker importing it again. gevent then has to patch the
+standard library before the app is imported, instead of in each worker as it normally would, so
+that the locks created while importing the app cooperate with greenlets.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import time  # noqa: E402
+
+_boot_time = time.time()
+_fork_time = None
+
+
+def when_ready(server):
+    """The master has loaded the app, if preloading, and is about to fork the workers."""
+    from src.caching_service import health
+    health.startup['master'] = time.time() - _boot_time
+    server.log.info('Master ready in %.3f seconds', health.startup['master'])
+
+
+def post_fork(server, worker):
+    global _fork_time
+    _fork_time = time.time()
+
+
+def post_worker_init(worker):
+    """Warm up each worker's connection to Minio before it accepts any requests."""
+    from src.caching_service import health
+    health.startup['import'] = time.time() - _fork_time
+    health.warm_up()
+    health.startup['worker'] = time.time() - _fork_time
+    worker.log.info('Worker ready in %.3f seconds', health.startup['worker'])
@@ -0,0 +1,60 @@
+"""
+Liveness and readiness of a worker, for load balancers and rollouts.
+
+A worker is ready once it has reached Minio. The result of each check is kept for
+Config.health_check_interval seconds, so that frequent probes do not each make a Minio request,
+and a worker whose Minio circuit breaker is open is reported as not ready without any request.
+"""
+import time
+
+from .breaker import auth_breaker, cold_breaker, minio_breaker
+from .config import Config
+from . import metrics
+from . import minio as storage
+
+# Result of the latest Minio check in this worker, and when it was made
+_minio = {'healthy': False, 'error': None, 'checked': 0.0}
+# Stage of startup -> seconds it took. Set by the gunicorn hooks
+startup = {}  # type: dict
+
+
+def warm_up():
+    """Open this worker's connection to Minio ahead of its first request, and check its health."""
+    start = time.time()
+    check_minio(force=True)
+    startup['warm_up'] = time.time() - start
+
+
+def check_minio(force=False):
+    """Return whether Minio is reachable, checking again if the last result is too old."""
+    now = time.time()
+    if not force and now - _minio['checked'] < Config.health_check_interval:
+        return _minio['healthy']
+    try:
+        storage.minio_client.bucket_exists(storage.bucket_name)
+        (_minio['healthy'], _minio['error']) = (True, None)
+    except Exception as err:
+        (_minio['healthy'], _minio['error']) = (False, str(err) or type(err).__name__)
+    _minio['checked'] = now
+    return _minio['healthy']
+
+
+def readiness():
+    """Return whether this worker is ready for traffic, along with the details of its checks."""
+    # While the breaker is open, checks fail fast, until one of them is let through as its probe
+    ready = check_minio() and minio_breaker.state != 'open'
+    details = {
+        'minio': {'healthy': _minio['healthy'], 'error': _minio['error'], 'checked': round(_minio['checked'], 3)},
+        'breakers': {brk.name: brk.state for brk in [minio_breaker, cold_breaker, auth_breaker]}
+    }
+    return (ready, details)
+
+
+@metrics.collector
+def collect_metrics():
+    return [
+        ('cache_startup_seconds', 'gauge', 'Seconds taken by each stage of starting up this worker.',
+         [({'stage': stage}, round(secs, 4)) for (stage, secs) in sorted(startup.items())]),
+        ('cache_minio_healthy', 'gauge', 'Whether the latest Minio health check of this worker succeeded.',
+         [({}, int(_minio['healthy']))]),
+    ]
@@ -0,0 +1,661 @@
+"""
+An embedded index of cache records, kept in a local SQLite database that all of the workers on a
+host share. It holds records that would be too costly to keep as Minio objects or metadata.
+"""
+import contextlib
+import os
+import sqlite3
+import threading
+
+from .config import Config
+
+_schema = [
+    # Placeholders for cache IDs that have no uploaded file yet (see Config.placeholder_index)
+    """CREATE TABLE IF NOT EXISTS placeholders (
+        cache_id TEXT PRIMARY KEY,
+        token_id TEXT NOT NULL,
+        expiration INTEGER NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS placeholders_expiration ON placeholders (expiration)',
+    # Leases held by the clients that are producing the file for an empty cache ID
+    """CREATE TABLE IF NOT EXISTS leases (
+        cache_id TEXT PRIMARY KEY,
+        lease_id TEXT NOT NULL,
+        expiration REAL NOT NULL
+    )""",
+    # Small cache files waiting to be moved into a pack (see Config.pack_threshold)
+    """CREATE TABLE IF NOT EXISTS unpacked (
+        cache_id TEXT PRIMARY KEY,
+        size INTEGER NOT NULL
+    )""",
+    # Pack objects, each holding many small cache files end to end
+    """CREATE TABLE IF NOT EXISTS packs (
+        pack TEXT PRIMARY KEY,
+        size INTEGER NOT NULL
+    )""",
+    # Where each packed cache file sits in its pack, along with its metadata
+    """CREATE TABLE IF NOT EXISTS packed (
+        cache_id TEXT PRIMARY KEY,
+        pack TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        etag TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        token_id TEXT NOT NULL,
+        expiration INTEGER NOT NULL,
+        accessed INTEGER NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS packed_pack ON packed (pack)',
+    'CREATE INDEX IF NOT EXISTS packed_expiration ON packed (expiration)',
+    # Locks that elect a single worker to run a background job
+    """CREATE TABLE IF NOT EXISTS locks (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expiration REAL NOT NULL
+    )""",
+    # Small pieces of shared state, such as the progress of background jobs
+    """CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )""",
+    # The token that owns each cache entry, for listing a token's entries (see Config.owner_index)
+    """CREATE TABLE IF NOT EXISTS owners (
+        cache_id TEXT PRIMARY KEY,
+        token_id TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        expiration INTEGER NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS owners_token ON owners (token_id, cache_id)',
+    'CREATE INDEX IF NOT EXISTS owners_expiration ON owners (expiration)',
+    # Running totals of the files in the owner index for each token, kept up to date along with it
+    """CREATE TABLE IF NOT EXISTS usage (
+        token_id TEXT PRIMARY KEY,
+        objects INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )""",
+    # Tags that clients attach to their cache entries, for invalidating them together
+    """CREATE TABLE IF NOT EXISTS tags (
+        token_id TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        cache_id TEXT NOT NULL,
+        expiration INTEGER NOT NULL,
+        PRIMARY KEY (token_id, tag, cache_id)
+    )""",
+    'CREATE INDEX IF NOT EXISTS tags_cache ON tags (cache_id)',
+    'CREATE INDEX IF NOT EXISTS tags_expiration ON tags (expiration)',
+    # Samples of request stacks taken by the profiler, summed over all of the workers
+    """CREATE TABLE IF NOT EXISTS profile (
+        stack TEXT PRIMARY KEY,
+        samples INTEGER NOT NULL
+    )""",
+    # File transfers in flight in each worker process, for admission control
+    """CREATE TABLE IF NOT EXISTS transfers (
+        pid INTEGER PRIMARY KEY,
+        bytes INTEGER NOT NULL,
+        transfers INTEGER NOT NULL,
+        rejected INTEGER NOT NULL
+    )""",
+    # Cache files downloaded from the cold tier, waiting to be moved back to the hot tier
+    """CREATE TABLE IF NOT EXISTS promotions (
+        cache_id TEXT PRIMARY KEY,
+        queued INTEGER NOT NULL
+    )""",
+    # Hits and misses of each cache entry, and how long its file took to compute (see analytics.py)
+    """CREATE TABLE IF NOT EXISTS stats (
+        cache_id TEXT PRIMARY KEY,
+        token_id TEXT NOT NULL,
+        hits INTEGER NOT NULL,
+        misses INTEGER NOT NULL,
+        compute_seconds REAL,
+        expiration INTEGER NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS stats_token ON stats (token_id)',
+    'CREATE INDEX IF NOT EXISTS stats_expiration ON stats (expiration)',
+]
+_packed_columns = ['cache_id', 'pack', 'offset', 'length', 'etag', 'filename', 'token_id', 'expiration', 'accessed']
+_insert_packed = (
+    'INSERT OR REPLACE INTO packed (' + ', '.join(_packed_columns) + ') '  # nosec
+    'VALUES (' + ', '.join('?' * len(_packed_columns)) + ')'
+)
+
+_lock = threading.Lock()
+_conn = None
+_pid = None
+
+
+def execute(sql, params=()):
+    """Run a single SQL statement against the index and return all of its result rows."""
+    with _lock:
+        return _connect().execute(sql, params).fetchall()
+
+
+def execute_many(sql, param_rows):
+    """Run a SQL statement for each of a list of parameter rows, in a single transaction."""
+    if not param_rows:
+        return
+    with transaction() as conn:
+        conn.executemany(sql, param_rows)
+
+
+@contextlib.contextmanager
+def transaction():
+    """Run several statements atomically, with the connection that is yielded."""
+    with _lock:
+        conn = _connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def _connect():
+    """Open the database, creating it if needed. Each worker process gets its own connection."""
+    global _conn, _pid
+    if _conn is not None and _pid == os.getpid():
+        return _conn
+    dirname = os.path.dirname(Config.index_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    # Autocommit mode; write-ahead logging lets workers read while another one writes
+    _conn = sqlite3.connect(Config.index_path, timeout=30, isolation_level=None, check_same_thread=False)
+    _conn.execute('PRAGMA journal_mode=WAL')
+    # With WAL, commits are still safe from corruption without syncing the disk on each one
+    _conn.execute('PRAGMA synchronous=NORMAL')
+    for statement in _schema:
+        _conn.execute(statement)
+    _pid = os.getpid()
+    return _conn
+
+
+# Placeholders
+# ------------
+
+def get_placeholder(cache_id, now):
+    """Return (token_id, expiration) for an unexpired placeholder, or None."""
+    rows = execute(
+        'SELECT token_id, expiration FROM placeholders WHERE cache_id = ? AND expiration > ?',
+        (cache_id, int(now))
+    )
+    return rows[0] if rows else None
+
+
+def add_placeholder(cache_id, token_id, expiration):
+    execute(
+        'INSERT OR REPLACE INTO placeholders (cache_id, token_id, expiration) VALUES (?, ?, ?)',
+        (cache_id, token_id, int(expiration))
+    )
+
+
+def remove_placeholder(cache_id):
+    execute('DELETE FROM placeholders WHERE cache_id = ?', (cache_id,))
+
+
+def remove_placeholders_expiring_before(timestamp):
+    """Remove all placeholders that expire before a timestamp. Returns the number removed."""
+    with _lock:
+        return _connect().execute('DELETE FROM placeholders WHERE expiration < ?', (int(timestamp),)).rowcount
+
+
+# Leases
+# ------
+
+def acquire_lease(cache_id, lease_id, expiration, now):
+    """
+    Take the lease on a cache ID, unless someone else holds one that has not expired. This is a
+    single atomic statement, so only one worker can win. Returns (lease_id, expiration) of the
+    lease in effect afterwards.
+    """
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            'INSERT INTO leases (cache_id, lease_id, expiration) VALUES (?, ?, ?) '
+            'ON CONFLICT (cache_id) DO UPDATE SET lease_id = excluded.lease_id, expiration = excluded.expiration '
+            'WHERE leases.expiration <= ?',
+            (cache_id, lease_id, expiration, now)
+        )
+        return conn.execute('SELECT lease_id, expiration FROM leases WHERE cache_id = ?', (cache_id,)).fetchone()
+
+
+def get_lease(cache_id, now):
+    """Return (lease_id, expiration) for an unexpired lease, or None."""
+    rows = execute(
+        'SELECT lease_id, expiration FROM leases WHERE cache_id = ? AND expiration > ?',
+        (cache_id, now)
+    )
+    return rows[0] if rows else None
+
+
+def get_leased(cache_ids, now):
+    """Return the set of the given cache IDs that have an unexpired lease."""
+    cache_ids = list(cache_ids)
+    leased = set()
+    # Stay well under SQLite's limit on the number of query parameters
+    for start in range(0, len(cache_ids), 500):
+        batch = cache_ids[start:start + 500]
+        placeholders = ','.join('?' * len(batch))
+        sql = 'SELECT cache_id FROM leases WHERE expiration > ? AND cache_id IN (' + placeholders + ')'  # nosec
+        rows = execute(sql, [now] + batch)
+        leased.update(row[0] for row in rows)
+    return leased
+
+
+def remove_lease(cache_id, lease_id=None):
+    """Remove the lease on a cache ID; if `lease_id` is given, only if that lease is the one held."""
+    if lease_id is None:
+        execute('DELETE FROM leases WHERE cache_id = ?', (cache_id,))
+    else:
+        execute('DELETE FROM leases WHERE cache_id = ? AND lease_id = ?', (cache_id, lease_id))
+
+
+def remove_leases_expiring_before(timestamp):
+    """Remove all leases that expire before a timestamp. Returns the number removed."""
+    with _lock:
+        return _connect().execute('DELETE FROM leases WHERE expiration < ?', (timestamp,)).rowcount
+
+
+# Packs
+# -----
+
+def add_unpacked(cache_id, size):
+    execute('INSERT OR REPLACE INTO unpacked (cache_id, size) VALUES (?, ?)', (cache_id, size))
+
+
+def get_unpacked():
+    """Return (cache_id, size) for every small cache file that is waiting to be packed."""
+    return execute('SELECT cache_id, size FROM unpacked ORDER BY cache_id')
+
+
+def remove_unpacked(cache_ids):
+    execute_many('DELETE FROM unpacked WHERE cache_id = ?', [(cache_id,) for cache_id in cache_ids])
+
+
+def add_pack(pack, size, entries):
+    """
+    Record a new pack object along with the cache files in it, given as dicts with the keys of
+    `_packed_columns` (other than `pack`). The cache files are no longer waiting to be packed.
+    """
+    rows = [tuple(dict(entry, pack=pack)[col] for col in _packed_columns) for entry in entries]
+    with transaction() as conn:
+        conn.execute('INSERT INTO packs (pack, size) VALUES (?, ?)', (pack, size))
+        conn.executemany(_insert_packed, rows)
+        conn.executemany('DELETE FROM unpacked WHERE cache_id = ?', [(row[0],) for row in rows])
+
+
+def restore_pack(pack, size, entries):
+    """
+    Record an existing pack object again, along with cache files in it, as for add_pack. Cache
+    files that are already recorded are pointed at this pack instead.
+    """
+    rows = [tuple(dict(entry, pack=pack)[col] for col in _packed_columns) for entry in entries]
+    with transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO packs (pack, size) VALUES (?, ?)', (pack, size))
+        conn.executemany(_insert_packed, rows)
+
+
+def get_packed(cache_id, now):
+    """Return a dict of the `_packed_columns` for an unexpired packed cache file, or None."""
+    rows = execute(
+        'SELECT ' + ', '.join(_packed_columns) + ' FROM packed WHERE cache_id = ? AND expiration > ?',  # nosec
+        (cache_id, int(now))
+    )
+    return dict(zip(_packed_columns, rows[0])) if rows else None
+
+
+def get_all_packed(now):
+    """Return (accessed, cache_id, length) for every unexpired packed cache file."""
+    return execute('SELECT accessed, cache_id, length FROM packed WHERE expiration > ?', (int(now),))
+
+
+def get_pack_entries(pack, now):
+    """Return a dict of the `_packed_columns` for every unexpired cache file in a pack."""
+    rows = execute(
+        'SELECT ' + ', '.join(_packed_columns) + ' FROM packed WHERE pack = ? AND expiration > ?',  # nosec
+        (pack, int(now))
+    )
+    return [dict(zip(_packed_columns, row)) for row in rows]
+
+
+def touch_packed(cache_id, accessed, expiration=None):
+    """Record the latest download time of a packed cache file, and optionally a new expiration."""
+    execute(
+        'UPDATE packed SET accessed = ?, expiration = COALESCE(?, expiration) WHERE cache_id = ?',
+        (int(accessed), expiration and int(expiration), cache_id)
+    )
+
+
+def remove_packed(cache_ids):
+    """Drop packed cache files from the index. The space in their packs is reclaimed by compaction."""
+    execute_many('DELETE FROM packed WHERE cache_id = ?', [(cache_id,) for cache_id in cache_ids])
+
+
+def remove_packed_expiring_before(timestamp):
+    """Remove all packed cache files that expire before a timestamp. Returns the number removed."""
+    with _lock:
+        return _connect().execute('DELETE FROM packed WHERE expiration < ?', (int(timestamp),)).rowcount
+
+
+def get_pack_usage(now):
+    """Return (pack, size, live_bytes) for every pack, where live bytes are in unexpired files."""
+    return execute(
+        'SELECT packs.pack, packs.size, COALESCE(SUM(packed.length), 0) FROM packs '
+        'LEFT JOIN packed ON packed.pack = packs.pack AND packed.expiration > ? '
+        'GROUP BY packs.pack',
+        (int(now),)
+    )
+
+
+def move_packed(pack, size, entries):
+    """
+    Record a pack object that was written by compaction, given the cache files that were copied
+    into it as dicts with their old `pack` and their new `offset`.
+    """
+    with transaction() as conn:
+        conn.execute('INSERT INTO packs (pack, size) VALUES (?, ?)', (pack, size))
+        conn.executemany(
+            'UPDATE packed SET pack = ?, offset = ? WHERE cache_id = ? AND pack = ?',
+            [(pack, entry['offset'], entry['cache_id'], entry['pack']) for entry in entries]
+        )
+
+
+def remove_pack(pack):
+    """Forget a pack object, along with any packed cache files that still point into it."""
+    with transaction() as conn:
+        conn.execute('DELETE FROM packed WHERE pack = ?', (pack,))
+        conn.execute('DELETE FROM packs WHERE pack = ?', (pack,))
+
+
+# Locks
+# -----
+
+def acquire_lock(name, holder, expiration, now):
+    """
+    Take or renew a lock, unless another holder has it and it has not expired. Returns whether
+    `holder` now has the lock.
+    """
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            'INSERT INTO locks (name, holder, expiration) VALUES (?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expiration = excluded.expiration '
+            'WHERE locks.expiration <= ? OR locks.holder = excluded.holder',
+            (name, holder, expiration, now)
+        )
+        row = conn.execute('SELECT holder FROM locks WHERE name = ?', (name,)).fetchone()
+    return row[0] == holder
+
+
+# Key-value state
+# ---------------
+
+def get_values(prefix):
+    """Return a dict of all of the stored values whose keys start with a prefix."""
+    rows = execute('SELECT key, value FROM kv WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+    return dict(rows)
+
+
+def set_values(values):
+    """Store a dict of keys and values, all at once."""
+    rows = [(key, str(val)) for (key, val) in values.items()]
+    execute_many('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', rows)
+
+
+# Owners
+# ------
+
+def set_owners(rows):
+    """Record the owner of cache entries, given a list of (cache_id, token_id, filename, size, expiration)."""
+    with transaction() as conn:
+        deltas = [(token_id, -1, -size) for (token_id, size) in _owned_files(conn, [row[0] for row in rows])]
+        conn.executemany(
+            'INSERT OR REPLACE INTO owners (cache_id, token_id, filename, size, expiration) VALUES (?, ?, ?, ?, ?)',
+            [(cache_id, token_id, filename, size, int(expiration))
+             for (cache_id, token_id, filename, size, expiration) in rows]
+        )
+        deltas.extend((token_id, 1, size) for (_, token_id, filename, size, _) in rows if filename != 'placeholder')
+        _add_usage(conn, deltas)
+
+
+def set_owner_expiration(cache_id, expiration):
+    execute('UPDATE owners SET expiration = ? WHERE cache_id = ?', (int(expiration), cache_id))
+
+
+def get_owned(token_id, after, limit, now):
+    """
+    Return up to `limit` unexpired entries of a token, as (cache_id, filename, size, expiration),
+    sorted by cache ID and starting after the cache ID `after`.
+    """
+    return execute(
+        'SELECT cache_id, filename, size, expiration FROM owners '
+        'WHERE token_id = ? AND cache_id > ? AND expiration > ? ORDER BY cache_id LIMIT ?',
+        (token_id, after, int(now), limit)
+    )
+
+
+def get_owner_ids():
+    """Return the set of all cache IDs in the owner index."""
+    return {cache_id for (cache_id,) in execute('SELECT cache_id FROM owners')}
+
+
+def remove_owners(cache_ids):
+    with transaction() as conn:
+        deltas = [(token_id, -1, -size) for (token_id, size) in _owned_files(conn, cache_ids)]
+        conn.executemany('DELETE FROM owners WHERE cache_id = ?', [(cache_id,) for cache_id in cache_ids])
+        _add_usage(conn, deltas)
+
+
+def remove_owners_expiring_before(timestamp, placeholders_only=False):
+    """Forget the owners of all entries (or only placeholders) that expire before a timestamp."""
+    if placeholders_only:
+        execute("DELETE FROM owners WHERE expiration < ? AND filename = 'placeholder'", (int(timestamp),))
+        return
+    with transaction() as conn:
+        deltas = conn.execute(
+            'SELECT token_id, -COUNT(*), -SUM(size) FROM owners '
+            "WHERE expiration < ? AND filename != 'placeholder' GROUP BY token_id",
+            (int(timestamp),)
+        ).fetchall()
+        conn.execute('DELETE FROM owners WHERE expiration < ?', (int(timestamp),))
+        _add_usage(conn, deltas)
+
+
+def index_owners():
+    """Record the owners of all of the placeholders and packed files that are kept in the index."""
+    with transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO owners (cache_id, token_id, filename, size, expiration) '
+            'SELECT cache_id, token_id, filename, length, expiration FROM packed'
+        )
+        conn.execute(
+            'INSERT OR REPLACE INTO owners (cache_id, token_id, filename, size, expiration) '
+            "SELECT cache_id, token_id, 'placeholder', 0, expiration FROM placeholders"
+        )
+        _recount_usage(conn)
+
+
+def get_usage(limit=-1):
+    """Return the `limit` tokens that store the most bytes (or all of them), as (token_id, objects, bytes)."""
+    return execute('SELECT token_id, objects, bytes FROM usage ORDER BY bytes DESC, token_id LIMIT ?', (limit,))
+
+
+def get_total_usage():
+    """Return (tokens, objects, bytes) for all tokens together."""
+    return execute('SELECT COUNT(*), IFNULL(SUM(objects), 0), IFNULL(SUM(bytes), 0) FROM usage')[0]
+
+
+def recount_usage():
+    """Rebuild the usage totals of every token from the owner index."""
+    with transaction() as conn:
+        _recount_usage(conn)
+
+
+def _owned_files(conn, cache_ids):
+    """Return (token_id, size) for each of the cache IDs that is a file in the owner index."""
+    rows = []
+    for cache_id in cache_ids:
+        rows.extend(conn.execute(
+            "SELECT token_id, size FROM owners WHERE cache_id = ? AND filename != 'placeholder'", (cache_id,)
+        ))
+    return rows
+
+
+def _add_usage(conn, deltas):
+    """Add a list of (token_id, objects, bytes) changes to the usage totals."""
+    totals = {}  # type: dict
+    for (token_id, objects, num_bytes) in deltas:
+        (prev_objects, prev_bytes) = totals.get(token_id, (0, 0))
+        totals[token_id] = (prev_objects + objects, prev_bytes + num_bytes)
+    conn.executemany(
+        'INSERT INTO usage (token_id, objects, bytes) VALUES (?, ?, ?) '
+        'ON CONFLICT (token_id) DO UPDATE SET objects = objects + excluded.objects, bytes = bytes + excluded.bytes',
+        [(token_id, objects, num_bytes) for (token_id, (objects, num_bytes)) in totals.items()]
+    )
+    conn.execute('DELETE FROM usage WHERE objects <= 0')
+
+
+def _recount_usage(conn):
+    conn.execute('DELETE FROM usage')
+    conn.execute(
+        'INSERT INTO usage (token_id, objects, bytes) '
+        "SELECT token_id, COUNT(*), SUM(size) FROM owners WHERE filename != 'placeholder' GROUP BY token_id"
+    )
+
+
+# Tags
+# ----
+
+def set_tags(cache_id, token_id, tags, expiration):
+    """Add tags to a cache entry, and set the expiration of all of its tags to that of the entry."""
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO tags (token_id, tag, cache_id, expiration) VALUES (?, ?, ?, ?)',
+            [(token_id, tag, cache_id, int(expiration)) for tag in tags]
+        )
+        conn.execute('UPDATE tags SET expiration = ? WHERE cache_id = ?', (int(expiration), cache_id))
+
+
+def set_tag_expiration(cache_id, expiration):
+    execute('UPDATE tags SET expiration = ? WHERE cache_id = ?', (int(expiration), cache_id))
+
+
+def has_tags(cache_id):
+    return bool(execute('SELECT 1 FROM tags WHERE cache_id = ? LIMIT 1', (cache_id,)))
+
+
+def get_tagged(token_id, tag):
+    """Return the IDs of all of a token's cache entries that have a tag, sorted."""
+    rows = execute('SELECT cache_id FROM tags WHERE token_id = ? AND tag = ? ORDER BY cache_id', (token_id, tag))
+    return [cache_id for (cache_id,) in rows]
+
+
+def remove_tags(cache_ids):
+    """Remove all of the tags of cache entries."""
+    execute_many('DELETE FROM tags WHERE cache_id = ?', [(cache_id,) for cache_id in cache_ids])
+
+
+def remove_tags_expiring_before(timestamp):
+    execute('DELETE FROM tags WHERE expiration < ?', (int(timestamp),))
+
+
+# Profile
+# -------
+
+def add_profile_samples(samples):
+    """Add a dict of stack -> number of samples to the profile."""
+    execute_many(
+        'INSERT INTO profile (stack, samples) VALUES (?, ?) '
+        'ON CONFLICT (stack) DO UPDATE SET samples = samples + excluded.samples',
+        list(samples.items())
+    )
+
+
+def get_profile():
+    """Return a list of (stack, samples) for all stacks, the most sampled first."""
+    return execute('SELECT stack, samples FROM profile ORDER BY samples DESC, stack')
+
+
+def clear_profile():
+    execute('DELETE FROM profile')
+
+
+# Transfers
+# ---------
+
+def set_transfers(pid, num_bytes, transfers, rejected):
+    """Record the transfers in flight in a worker process, and how many it has rejected."""
+    execute(
+        'INSERT OR REPLACE INTO transfers (pid, bytes, transfers, rejected) VALUES (?, ?, ?, ?)',
+        (pid, num_bytes, transfers, rejected)
+    )
+
+
+def get_transfers():
+    """Return a list of (pid, bytes, transfers, rejected) for every worker process."""
+    return execute('SELECT pid, bytes, transfers, rejected FROM transfers')
+
+
+def remove_transfers(pids):
+    """Forget the transfers of worker processes that have exited."""
+    execute_many('DELETE FROM transfers WHERE pid = ?', [(pid,) for pid in pids])
+
+
+# Promotions
+# ----------
+
+def add_promotion(cache_id, queued):
+    execute('INSERT OR IGNORE INTO promotions (cache_id, queued) VALUES (?, ?)', (cache_id, int(queued)))
+
+
+def get_promotions(limit):
+    """Return the cache IDs of up to `limit` cache files waiting to be promoted, the earliest queued first."""
+    return [row[0] for row in execute('SELECT cache_id FROM promotions ORDER BY queued, cache_id LIMIT ?', (limit,))]
+
+
+def remove_promotions(cache_ids):
+    execute_many('DELETE FROM promotions WHERE cache_id = ?', [(cache_id,) for cache_id in cache_ids])
+
+
+# Stats
+# -----
+
+def add_stats(counts):
+    """
+    Add a dict of cache_id -> (token_id, hits, misses, compute_seconds, expiration) to the stats of
+    cache entries. A compute time of None leaves the recorded one in place.
+    """
+    execute_many(
+        'INSERT INTO stats (cache_id, token_id, hits, misses, compute_seconds, expiration) VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (cache_id) DO UPDATE SET token_id = excluded.token_id, hits = hits + excluded.hits, '
+        'misses = misses + excluded.misses, compute_seconds = IFNULL(excluded.compute_seconds, compute_seconds), '
+        'expiration = MAX(expiration, excluded.expiration)',
+        [(cache_id,) + tuple(values) for (cache_id, values) in counts.items()]
+    )
+
+
+def get_total_stats():
+    """Return (hits, misses, saved_seconds) for all cache entries together."""
+    return execute('SELECT IFNULL(SUM(hits), 0), IFNULL(SUM(misses), 0), '
+                   'IFNULL(SUM(hits * compute_seconds), 0) FROM stats')[0]
+
+
+def get_token_stats(limit=-1):
+    """Return the `limit` tokens with the most hits (or all of them), as (token_id, hits, misses, saved_seconds)."""
+    return execute(
+        'SELECT token_id, SUM(hits), SUM(misses), IFNULL(SUM(hits * compute_seconds), 0) FROM stats '
+        'GROUP BY token_id ORDER BY SUM(hits) DESC, token_id LIMIT ?', (limit,)
+    )
+
+
+def get_entry_stats(limit=-1):
+    """Return the `limit` cache entries with the most hits, as (cache_id, token_id, hits, misses, saved_seconds)."""
+    return execute(
+        'SELECT cache_id, token_id, hits, misses, IFNULL(hits * compute_seconds, 0) FROM stats '
+        'ORDER BY hits DESC, cache_id LIMIT ?', (limit,)
+    )
+
+
+def remove_stats_expiring_before(timestamp):
+    execute('DELETE FROM stats WHERE expiration < ?', (int(timestamp),))
@@ -0,0 +1,100 @@
+"""
+Compute-once leases for cache IDs that have no file yet.
+
+The first client to register an empty cache ID gets a time-limited lease to produce its file, and
+later clients are told that it is in progress so that they can wait for the file instead of
+computing it again. Leases are rows in the local index, so all of the workers on a host agree on
+who holds one. Without Config.leases, such as with several replicas, every client gets a lease of
+its own, and nobody waits.
+
+Waiting requests are parked on an Event, which the gevent workers turn into a cheap greenlet wait.
+An upload in the same worker wakes them right away; otherwise a single thread per worker polls the
+index for all of its waiters at once, so waiting never touches Minio.
+"""
+import os
+import threading
+import time
+import uuid
+
+from .config import Config
+from . import index
+from . import log
+
+# Cache ID -> Event that is set once its lease is over
+_waiters = {}  # type: dict
+_lock = threading.Lock()
+_pid = None
+
+
+def acquire(cache_id):
+    """
+    Try to take the lease to produce the file for a cache ID. Returns (lease_id, expiration),
+    where lease_id is None if another client already holds an unexpired lease.
+    """
+    lease_id = uuid.uuid4().hex
+    now = time.time()
+    if not Config.leases:
+        return (lease_id, now + Config.lease_ttl)
+    (holder, expiration) = index.acquire_lease(cache_id, lease_id, now + Config.lease_ttl, now)
+    return (lease_id if holder == lease_id else None, expiration)
+
+
+def release(cache_id, lease_id=None):
+    """
+    End the lease on a cache ID, such as when its file has been uploaded, and wake its waiters in
+    this worker. If `lease_id` is given, the lease is only ended if it is the one held.
+    """
+    if Config.leases:
+        index.remove_lease(cache_id, lease_id)
+        _wake(cache_id)
+
+
+def wait(cache_id, timeout):
+    """
+    Block until the lease on a cache ID is released or expires, or until `timeout` seconds have
+    passed. Returns True if the lease is over.
+    """
+    if not Config.leases or not index.get_lease(cache_id, time.time()):
+        return True
+    with _lock:
+        event = _waiters.setdefault(cache_id, threading.Event())
+    _start_poller()
+    return event.wait(timeout)
+
+
+def _wake(cache_id):
+    with _lock:
+        event = _waiters.pop(cache_id, None)
+    if event is not None:
+        event.set()
+
+
+def _start_poller():
+    """Start the polling thread. Threads do not survive a fork, so each worker starts its own."""
+    global _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+    threading.Thread(target=_poll, daemon=True).start()
+
+
+def _poll():
+    while True:
+        time.sleep(Config.lease_poll_interval)
+        try:
+            _wake_finished()
+        except Exception:
+            log.logger.exception('Lease poller failed')
+
+
+def _wake_finished():
+    """Wake the waiters of any lease that was released by another worker or has expired."""
+    with _lock:
+        cache_ids = list(_waiters)
+    if not cache_ids:
+        return
+    leased = index.get_leased(cache_ids, time.time())
+    for cache_id in cache_ids:
+        if cache_id not in leased:
+            _wake(cache_id)
@@ -0,0 +1,170 @@
+"""
+Structured (JSON) request and error logging.
+
+Log records are put on a bounded in-memory queue and written to stdout by a background thread, so
+a slow stdout never blocks a request. If the queue fills up, records are dropped and counted.
+"""
+import _thread
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+import flask
+
+from .config import Config
+from .hash import bhash
+
+try:
+    # Under gevent, the writer has to be a native thread, as a greenlet blocked on stdout would stall
+    # the whole worker, and the queue has to use native locks to wake it
+    from gevent.monkey import get_original
+    (_start_thread, _allocate_lock) = get_original('_thread', ['start_new_thread', 'allocate_lock'])
+    _SimpleQueue = get_original('queue', 'SimpleQueue')
+except ImportError:
+    (_start_thread, _allocate_lock, _SimpleQueue) = (_thread.start_new_thread, _thread.allocate_lock, queue.SimpleQueue)
+
+logger = logging.getLogger('caching_service')
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a log record as one line of JSON, including any fields passed in `extra`."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['traceback'] = record.exc_text
+        return json.dumps(entry)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on a bounded queue without ever waiting, dropping them if it is full. The thread
+    that writes out the queue is started lazily, since threads do not survive a fork, and is
+    stopped at exit once it has written out what is left.
+    """
+
+    def __init__(self, handler, maxsize):
+        super().__init__(_SimpleQueue())
+        self.handler = handler
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._pid = None
+
+    def prepare(self, record):
+        """Render the traceback now, while it exists, but leave the rest for the JSON formatter."""
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._stopped = _allocate_lock()
+            self._stopped.acquire()
+            _start_thread(self._write_records, ())
+            atexit.register(self.stop)
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+    def stop(self, timeout=1.0):
+        """Stop the writer thread, waiting up to `timeout` seconds for it to write out the queue."""
+        # Forked processes inherit the exit hook, but not the thread
+        if self._pid != os.getpid():
+            return
+        self._pid = None
+        self.queue.put_nowait(None)
+        self._stopped.acquire(timeout=timeout)
+
+    def _write_records(self):
+        for record in iter(self.queue.get, None):
+            self.handler.handle(record)
+        self._stopped.release()
+
+
+def init_logging():
+    """Send all caching_service logs through a non-blocking JSON handler on stdout."""
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter())
+    logger.addHandler(DroppingQueueHandler(stream_handler, Config.log_queue_size))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def start_request():
+    """Set up timing and a request ID for the current request."""
+    flask.g.request_id = flask.request.headers.get('X-Request-Id') or uuid.uuid4().hex
+    flask.g.start_time = time.time()
+    flask.g.stages = {}
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Add the time spent in a block to the duration of a stage of the current request."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        if flask.has_request_context() and 'stages' in flask.g:
+            flask.g.stages[stage] = flask.g.stages.get(stage, 0) + time.time() - start
+
+
+def log_response(response):
+    """
+    Log a response once it has been completely sent, so that the duration includes any streamed
+    file data. Successful responses are only logged for a sample of Config.log_sample_rate.
+    """
+    if 'request_id' not in flask.g:
+        return response
+    response.headers['X-Request-Id'] = flask.g.request_id
+    if response.status_code < 400 and random.random() >= Config.log_sample_rate:  # nosec
+        return response
+    fields = request_fields()
+    fields.update({
+        'status': response.status_code,
+        'bytes_in': flask.request.content_length or 0,
+        'bytes_out': response.content_length or 0,
+        'stages': {name: round(secs, 4) for (name, secs) in flask.g.stages.items()}
+    })
+    start_time = flask.g.start_time
+
+    def write():
+        fields['duration'] = round(time.time() - start_time, 4)
+        logger.info('request', extra={'fields': fields})
+    response.call_on_close(write)
+    return response
+
+
+def log_error():
+    """Log the exception being handled, along with the details of the current request."""
+    logger.exception('Unexpected server error', extra={'fields': request_fields()})
+
+
+def request_fields():
+    """Identifying details of the current request."""
+    token_id = flask.session.get('token_id')
+    rule = flask.request.url_rule
+    return {
+        'request_id': flask.g.get('request_id'),
+        'method': flask.request.method,
+        'route': rule.rule if rule else flask.request.path,
+        'cache_id': (flask.request.view_args or {}).get('cache_id'),
+        # Log a hash rather than the token's identity itself
+        'token_id': bhash(token_id)[:16] if token_id else None
+    }
@@ -0,0 +1,56 @@
+"""
+Service metrics, served in the Prometheus text format.
+
+Modules register a collector function, which returns the current samples of their metrics when
+the metrics are scraped. State that is shared by all workers has to be kept in the index, since
+a scrape is answered by whichever worker receives it.
+"""
+import time
+
+# Functions that each return a list of (name, type, help, samples), where samples is a list of
+# (labels dict, value)
+_collectors = []  # type: list
+
+# Moving average of the response times in this worker, and when it was last updated
+_latency = {'average': 0.0, 'updated': 0.0}
+# Weight of each new response time in the moving average
+_latency_weight = 0.1
+# Seconds without any requests after which the average no longer counts
+_latency_stale = 60
+
+
+def collector(fn):
+    """Register a function that collects metrics when they are scraped."""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """Return all of the metrics in the Prometheus text format."""
+    lines = []
+    for collect in _collectors:
+        for (name, kind, help_text, samples) in collect():
+            lines.append('# HELP ' + name + ' ' + help_text)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            lines.extend(name + _labels(labels) + ' ' + str(value) for (labels, value) in samples)
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = (key + '="' + str(val).replace('\\', '\\\\').replace('"', '\\"') + '"' for (key, val) in labels.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+def observe_request(duration):
+    """Record how long a request in this worker took to respond."""
+    _latency['average'] += _latency_weight * (duration - _latency['average'])
+    _latency['updated'] = time.time()
+
+
+def recent_request_latency():
+    """The moving average of response times in this worker, or 0 if it has been idle for a while."""
+    if time.time() - _latency['updated'] > _latency_stale:
+        return 0.0
+    return _latency['average']
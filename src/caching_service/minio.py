@@ -1,40 +1,124 @@
 from minio import Minio
+from minio.commonconfig import CopySource, REPLACE
+from minio.deleteobjects import DeleteObject
+from minio.helpers import MAX_PART_SIZE
+from concurrent.futures import ThreadPoolExecutor
 import minio.error
+import collections
 import time
+import itertools
 import tempfile
 import os
 import io
 import requests
 import shutil
+import certifi
+import urllib3
 from werkzeug.utils import secure_filename
 
+from .authorization import namespaces
 from .config import Config
+from .batcher import Batcher
+from .breaker import BreakerPoolManager, cold_breaker, minio_breaker
+from . import analytics
 from . import exceptions
+from . import index
+from . import leases
+from . import log
+from . import retention
 
 
-# Initialize the Minio client object using the app's configuration
-minio_client = Minio(
-    Config.minio_host,
-    access_key=Config.minio_access_key,
-    secret_key=Config.minio_secret_key,
-    secure=Config.minio_https
-)
+def new_client():
+    """
+    Create a Minio client using the app's configuration. Its requests have explicit timeouts and
+    few retries, and go through a circuit breaker so that a Minio outage fails fast.
+    """
+    return _new_client(Config.minio_host, Config.minio_access_key, Config.minio_secret_key, Config.minio_https,
+                       minio_breaker)
+
+
+def new_cold_client():
+    """Create a Minio client for the cold tier, which goes through a circuit breaker of its own."""
+    return _new_client(Config.cold_minio_host, Config.cold_minio_access_key, Config.cold_minio_secret_key,
+                       Config.cold_minio_https, cold_breaker)
+
+
+def _new_client(host, access_key, secret_key, secure, breaker):
+    return Minio(host, access_key=access_key, secret_key=secret_key, secure=secure,
+                 http_client=new_pool_manager(breaker))
+
+
+def new_pool_manager(breaker=minio_breaker):
+    """Create a pool of connections to Minio, with the same timeouts, retries, and breaker as the client."""
+    return BreakerPoolManager(
+        breaker,
+        timeout=urllib3.util.Timeout(connect=Config.minio_connect_timeout, read=Config.minio_read_timeout),
+        maxsize=Config.minio_pool_size,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=urllib3.Retry(total=2, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+    )
+
+
+class WorkerClient:
+    """
+    Stands in for the Minio client of the current process, which is created on first use in each
+    worker. An app that is preloaded before the workers fork then never shares a connection pool
+    between them.
+    """
+
+    def __init__(self, factory=new_client):
+        self.factory = factory
+        self._client = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def get(self):
+        if self._pid != os.getpid():
+            self._client = self.factory()
+            self._pid = os.getpid()
+        return self._client
+
+
+minio_client = WorkerClient()
+# For requests that minio-py cannot make, such as streaming the body of a part (see multipart.py)
+minio_pool = WorkerClient(new_pool_manager)
 bucket_name = Config.minio_bucket_name
+# Cache files that have not been downloaded for a while are moved to the cold tier (see tiering.py)
+cold_client = WorkerClient(new_cold_client)
+cold_bucket_name = Config.cold_bucket
+# Metadata keys that are not set on every cache file. Those of a cache file in the cold tier are
+# kept on an empty stub in the hot tier, along with the size and ETag of its contents
+_optional_metadata = ['accessed', 'tier', 'cold_size', 'cold_etag']
+# Objects under this prefix are packs of small cache files, rather than cache files themselves
+pack_prefix = '_packs/'
+# Cache IDs are hex digests, so the bucket can be listed in parallel, a leading digit at a time
+listing_prefixes = '0123456789abcdef'
+# Size of the parts that streamed uploads of unknown length are sent to Minio in
+stream_part_size = 16 * 1024 * 1024
 
 
 def initialize_bucket():
     """
-    Create the default bucket if it does not exist
+    Create the default bucket if it does not exist, along with the bucket of the cold tier, if any
     """
-    print(f"Making bucket with name '{bucket_name}'")
+    make_bucket(minio_client, bucket_name)
+    if cold_bucket_name:
+        make_bucket(cold_client, cold_bucket_name)
+
+
+def make_bucket(client, name):
+    print(f"Making bucket with name '{name}'")
     try:
-        minio_client.make_bucket(bucket_name)
+        client.make_bucket(name)
     except minio.error.S3Error as err:
         # Acceptable errors
         errs = ["BucketAlreadyExists", "BucketAlreadyOwnedByYou"]
         if err.code not in errs:
             raise err
-    print(f"Done making bucket '{bucket_name}'")
+    print(f"Done making bucket '{name}'")
 
 
 def wait_for_service():
@@ -46,7 +130,7 @@ def wait_for_service():
     start = time.time()
     while True:
         try:
-            requests.get(url).raise_for_status()
+            requests.get(url, timeout=Config.minio_connect_timeout).raise_for_status()
             print("Minio is healthy! Continuing.")
             break
         except Exception as err:
@@ -54,9 +138,10 @@ def wait_for_service():
                 raise RuntimeError("Timed out waiting for Minio")
             print(f"Still waiting for Minio at {url} to be healthy:")
             print(err)
+            time.sleep(1)
 
 
-def create_placeholder(cache_id, token_id):
+def create_placeholder(cache_id, token_id, tags=()):
     """
     Create a placeholder file for a generated cache_id using a token_id. The metadata on this
     placeholder file can be used for later validating uploads and checking expirations.
@@ -69,63 +154,175 @@ def create_placeholder(cache_id, token_id):
     cache_id should be generated from caching_service.cache_id.generate_cache_id
     token_id hould be in the form of 'user:id'.
 
+    If Config.placeholder_index is set, the placeholder is saved in the local index instead of Minio.
+    Any `tags` are added to the cache entry, whether or not it already existed. An entry that has
+    no file yet is counted as a miss.
+
     Returns one of "file_exists" or "empty", indicating whether that cache_id holds a saved file or is empty.
     """
     try:
-        return get_metadata(cache_id)
+        metadata = get_metadata(cache_id)
     except exceptions.MissingCache:
         # Create the cache key
-        seven_days = 604800  # in seconds
-        expiration = str(int(time.time() + seven_days))
         metadata = {
-            'expiration': expiration,
+            'expiration': retention.expiration(Config.placeholder_ttl),
             'filename': 'placeholder',
             'token_id': token_id
         }
-        data = io.BytesIO()  # Empty contents for placeholder cache
-        minio_client.put_object(bucket_name, cache_id, data, 0, metadata=metadata)
-        return metadata
+        if Config.placeholder_index:
+            index.add_placeholder(cache_id, token_id, metadata['expiration'])
+        else:
+            data = io.BytesIO()  # Empty contents for placeholder cache
+            minio_client.put_object(bucket_name, cache_id, data, 0, metadata=metadata)
+        record_owner(cache_id, metadata, 0)
+    record_tags(cache_id, metadata, tags)
+    if metadata['filename'] == 'placeholder':
+        analytics.record_miss(cache_id, metadata)
+    return metadata
 
 
-def authorize_access(cache_id, token_id):
+def authorize_access(cache_id, token_id, write=True):
     """
-    Given a cache ID and token ID, authorize that the token has permission to access the cache.
+    Given a cache ID and token ID, authorize that the token has permission to access the cache:
+    to write to it, such as to upload or delete its file, or only to read it if `write` is False.
+
+    Returns the metadata for the cache, so callers don't have to fetch it again. Its `token_id` is
+    that of the owner, which is not the given token for an entry in a shared namespace.
 
     Raises:
         - caching_service.exceptions.UnauthorizedAccess if it is unauthorized.
         - exceptions.MissingCache if the cache ID does not exist.
     """
     metadata = get_metadata(cache_id)
-    existing_token_id = metadata['token_id']
-    if token_id != existing_token_id:
+    check_token(metadata, token_id, write)
+    return metadata
+
+
+def check_token(metadata, token_id, write=False):
+    """
+    Raise UnauthorizedAccess unless the token owns the cache with the given metadata, or the cache
+    is in a shared namespace that the token may read (or write, if `write` is set).
+    """
+    if not namespaces.allows(metadata['token_id'], token_id, write):
         raise exceptions.UnauthorizedAccess('You do not have access to that cache')
 
 
-def upload_cache(cache_id, token_id, file_storage):
+def upload_cache(cache_id, token_id, file_storage, tags=(), compute_seconds=None):
     """
-    Given a cache ID, file name, and file path, save all to minio.
+    Given a cache ID, file name, and file path, save all to minio, adding any `tags` to the entry.
+    `compute_seconds` is how long the file took to compute, if known (see analytics.py).
 
     `file_storage` should be a flask FileStorage object (such as the one found in a flask file
     upload handler).
     """
-    authorize_access(cache_id, token_id)
+    owner = authorize_access(cache_id, token_id)['token_id']
     tmp_dir = tempfile.mkdtemp()
     filename = secure_filename(file_storage.filename)
     path = os.path.join(tmp_dir, filename)
     file_storage.save(path)
-    # Save the cache metadata to leveldb
-    thirty_days = 2592000  # in seconds
-    # An int is better for serializing than a float
-    expiration = str(int(time.time() + thirty_days))
-    metadata = {
-        'filename': filename,
-        'expiration': expiration,
-        'token_id': token_id
-    }
+    size = os.path.getsize(path)
+    metadata = _upload_metadata(filename, owner, retention.cache_ttl(size))
     try:
         minio_client.fput_object(bucket_name, cache_id, path, metadata=metadata)
     finally:
         shutil.rmtree(tmp_dir)
+    finish_upload(cache_id, size, metadata, tags, compute_seconds)
+
+
+def upload_stream(cache_id, token_id, filename, stream, length=None, tags=(), compute_seconds=None):
+    """
+    Save a file to minio straight from a stream, such as a raw request body, without writing it to
+    disk first. If the `length` is unknown, the stream is sent to Minio in parts of
+    `stream_part_size` bytes, and the file gets the default TTL. The other arguments are as for
+    upload_cache.
+    """
+    owner = authorize_access(cache_id, token_id)['token_id']
+    filename = secure_filename(filename)
+    if not filename:
+        raise exceptions.InvalidUpload('Filename missing')
+    ttl = Config.cache_ttl if length is None else retention.cache_ttl(length)
+    counted = _CountingReader(stream)
+    metadata = _upload_metadata(filename, owner, ttl)
+    minio_client.put_object(
+        bucket_name, cache_id, counted, -1 if length is None else length,
+        metadata=metadata,
+        part_size=stream_part_size if length is None else 0
+    )
+    finish_upload(cache_id, counted.count, metadata, tags, compute_seconds)
+
+
+def _upload_metadata(filename, token_id, ttl):
+    return {
+        'filename': filename,
+        'expiration': retention.expiration(ttl),
+        'token_id': token_id
+    }
+
+
+def finish_upload(cache_id, size, metadata=None, tags=(), compute_seconds=None):
+    """
+    Update the indexes for a newly uploaded file, given its metadata if it is at hand, and record
+    how long it took to compute, if known.
+    """
+    if Config.placeholder_index:
+        index.remove_placeholder(cache_id)
+    track_upload(cache_id, size)
+    record_owner(cache_id, metadata, size)
+    record_tags(cache_id, metadata, tags)
+    if compute_seconds is not None:
+        analytics.record_compute(cache_id, metadata or get_metadata(cache_id), compute_seconds)
+    # Wake up anyone waiting on this file
+    leases.release(cache_id)
+
+
+def record_owner(cache_id, metadata, size):
+    """Record the owner of a cache entry in the owner index, if enabled, looking up its metadata if needed."""
+    if not Config.owner_index:
+        return
+    if metadata is None:
+        metadata = get_metadata(cache_id)
+    index.set_owners([(cache_id, metadata['token_id'], metadata['filename'], size, metadata['expiration'])])
+
+
+def record_tags(cache_id, metadata, tags):
+    """
+    Add tags to a cache entry, and keep the expiration of all of its tags in step with the entry,
+    looking up its metadata if needed.
+    """
+    if not Config.tags or (not tags and not index.has_tags(cache_id)):
+        return
+    if metadata is None:
+        metadata = get_metadata(cache_id)
+    index.set_tags(cache_id, metadata['token_id'], tags, metadata['expiration'])
+
+
+class _CountingReader:
+    """Wrap a stream to count the bytes read from it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def track_upload(cache_id, size):
+    """
+    Update the pack index for a newly uploaded file: it replaces any packed file with the same
+    cache ID, and if it is small enough it is queued up to be moved into a pack.
+    """
+    if not Config.pack_threshold:
+        return
+    index.remove_packed([cache_id])
+    if 0 < size < Config.pack_threshold:
+        index.add_unpacked(cache_id, size)
+
+
+def is_pack(object_name):
+    return object_name.startswith(pack_prefix)
 
 
 def expire_entries():
@@ -134,7 +331,7 @@ def expire_entries():
     """
     print('Checking the expiration of all stored objects..')
     now = time.time()
-    objects = minio_client.list_objects(bucket_name)
+    objects = (obj for obj in minio_client.list_objects(bucket_name) if not is_pack(obj.object_name))
     removed_count = 0
     total_count = 0
     for obj in objects:
@@ -151,35 +348,372 @@ def expire_entries():
             if now > expiry:
                 minio_client.remove_object(bucket_name, obj.object_name)
                 removed_count += 1
+    removed_count += expire_index_entries(now)
     print('... Finished running. Total objects: {}. Removed {} objects'.format(total_count, removed_count))
     return (removed_count, total_count)
 
 
+def expire_index_entries(now):
+    """Remove the expired records in the local index. Returns the number of cache entries removed."""
+    removed_count = 0
+    if Config.placeholder_index:
+        removed_count += index.remove_placeholders_expiring_before(now)
+    if Config.pack_threshold:
+        # Their space in the packs is reclaimed by compaction
+        removed_count += index.remove_packed_expiring_before(now)
+    if Config.owner_index:
+        index.remove_owners_expiring_before(now)
+    index.remove_tags_expiring_before(now)
+    index.remove_leases_expiring_before(now)
+    analytics.remove_expired(now)
+    return removed_count
+
+
+def reap_placeholders(max_age):
+    """
+    Remove all placeholders that were created more than `max_age` seconds ago and never had a file
+    uploaded, whether they are stored in Minio or in the placeholder index.
+
+    Placeholders are spotted from a single listing of the bucket (with Minio's user metadata
+    extension) and removed with bulk deletes, rather than with a stat and a delete per object.
+
+    Returns the number of placeholders removed.
+    """
+    print('Removing placeholders older than {} seconds..'.format(max_age))
+    cutoff = time.time() - max_age
+    objects = minio_client.list_objects(bucket_name, include_user_meta=True)
+    orphans = (obj.object_name for obj in objects if _is_orphan(obj, cutoff))
+    removed_count = 0
+    for names in batches(orphans, 1000):
+        failed = set(remove_many(names))
+        names = [name for name in names if name not in failed]
+        removed_count += len(names)
+        if Config.owner_index:
+            index.remove_owners(names)
+        index.remove_tags(names)
+    if Config.placeholder_index:
+        # Index placeholders only store their expiration, which is a fixed time after creation
+        removed_count += index.remove_placeholders_expiring_before(cutoff + Config.placeholder_ttl)
+        if Config.owner_index:
+            index.remove_owners_expiring_before(cutoff + Config.placeholder_ttl, placeholders_only=True)
+    print('... Finished running. Removed {} placeholders'.format(removed_count))
+    return removed_count
+
+
+def index_owners():
+    """
+    Fill the owner index from the metadata of every existing cache entry, such as after turning on
+    Config.owner_index. Minio objects are read from a single listing of the bucket, with Minio's
+    user metadata extension. Returns the number of entries indexed.
+    """
+    print('Indexing the owners of all cache entries..')
+    indexed_count = len(_index_listing(''))
+    # Packed files are indexed after their leftover objects, so that the index entries take precedence
+    index.index_owners()
+    print('... Finished running. Indexed {} objects'.format(indexed_count))
+    return indexed_count
+
+
+def reconcile_usage(workers=None):
+    """
+    Rebuild the usage totals of every token, for when they have drifted from what is stored, such
+    as after files were removed from Minio behind the service's back. The owner index is refreshed
+    from listings of the bucket, made in parallel for each leading digit of the cache IDs; entries
+    whose files are gone are dropped from it, and the totals are recounted from it.
+
+    Returns the totals that had drifted, as a list of (token_id, old objects, old bytes, objects, bytes).
+    """
+    print('Reconciling the storage usage of each token..')
+    old_usage = {token_id: totals for (token_id, *totals) in index.get_usage()}
+    before = index.get_owner_ids()
+    with ThreadPoolExecutor(workers or Config.usage_scan_workers) as pool:
+        listed = set().union(*pool.map(_index_listing, listing_prefixes))
+    index.index_owners()
+    gone = [cache_id for cache_id in before - listed if not _exists(cache_id)]
+    index.remove_owners(gone)
+    index.recount_usage()
+    usage = {token_id: totals for (token_id, *totals) in index.get_usage()}
+    drifted = [(token_id, *old_usage.get(token_id, [0, 0]), *usage.get(token_id, [0, 0]))
+               for token_id in sorted(set(old_usage) | set(usage)) if old_usage.get(token_id) != usage.get(token_id)]
+    for (token_id, old_objects, old_bytes, objects, num_bytes) in drifted:
+        print('{}: {} objects, {} bytes (was {} objects, {} bytes)'.format(
+            token_id, objects, num_bytes, old_objects, old_bytes))
+    print('... Finished running. Listed {} objects. Corrected the usage of {} tokens'.format(len(listed), len(drifted)))
+    return drifted
+
+
+def _index_listing(prefix):
+    """Record the owners of the objects whose names start with a prefix. Returns the set of their names."""
+    objects = (obj for obj in minio_client.list_objects(bucket_name, prefix=prefix, include_user_meta=True)
+               if not is_pack(obj.object_name))
+    names = set()
+    for objs in batches(objects, 1000):
+        index.set_owners([row for row in map(_owner_row, objs) if row])
+        names.update(obj.object_name for obj in objs)
+    return names
+
+
+def _exists(cache_id):
+    try:
+        lookup_cache(cache_id)
+        return True
+    except exceptions.MissingCache:
+        return False
+
+
+def _owner_row(obj):
+    """Return (cache_id, token_id, filename, size, expiration) for an object from list_objects."""
+    try:
+        metadata = parse_metadata(obj.metadata or {})
+    except KeyError:
+        # Backends other than Minio do not list user metadata
+        try:
+            metadata = get_metadata(obj.object_name)
+        except (exceptions.MissingCache, KeyError):
+            return None
+    size = int(metadata.get('cold_size', obj.size))
+    return (obj.object_name, metadata['token_id'], metadata['filename'], size, metadata['expiration'])
+
+
+def remove_many(names):
+    """Remove a batch of objects with a single bulk delete. Returns the names of those that could not be removed."""
+    failed = []
+    for err in minio_client.remove_objects(bucket_name, [DeleteObject(name) for name in names]):
+        log.logger.error('Failed to remove an object', extra={'fields': {'object': err.name, 'error': err.message}})
+        failed.append(err.name)
+    return failed
+
+
+def batches(iterable, size):
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def _is_orphan(obj, cutoff):
+    """Whether an object from list_objects is a placeholder created before the cutoff time."""
+    # Prefixes, such as that of the packs, are listed without a size or modification time
+    if obj.is_dir or obj.size or obj.last_modified.timestamp() >= cutoff:
+        return False
+    filename = (obj.metadata or {}).get('X-Amz-Meta-Filename')
+    if filename is None:
+        # Backends other than Minio do not list user metadata
+        try:
+            filename = get_metadata(obj.object_name)['filename']
+        except (exceptions.MissingCache, KeyError):
+            return False
+    return filename == 'placeholder'
+
+
+def copy_cache(cache_id, dest_id, token_id, filename=None):
+    """
+    Copy a cache file to another cache ID that the token may write to, without the file passing
+    through the service. A Minio object is copied server-side, while a packed file is read from
+    its pack and saved as an object of its own. The copy gets fresh metadata, keeping the original
+    filename unless another one is given.
+
+    Raises the same exceptions as authorize_access, for either cache ID.
+    Returns the metadata of the copy.
+    """
+    (source, size, etag) = lookup_cache(cache_id)
+    check_token(source, token_id)
+    if source['filename'] == 'placeholder':
+        raise exceptions.MissingCache(cache_id)
+    dest = authorize_access(dest_id, token_id)
+    metadata = {
+        'filename': secure_filename(filename) if filename else source['filename'],
+        'expiration': retention.expiration(retention.cache_ttl(size)),
+        'token_id': dest['token_id']
+    }
+    packed = get_packed(cache_id)
+    if packed:
+        copy_packed(packed, dest_id, metadata)
+    elif is_cold(source):
+        copy_cold(cache_id, dest_id, metadata, source)
+    else:
+        minio_client.copy_object(bucket_name, dest_id, CopySource(bucket_name, cache_id), metadata=metadata,
+                                 metadata_directive=REPLACE)
+        track_upload(dest_id, size)
+    if Config.placeholder_index:
+        index.remove_placeholder(dest_id)
+    record_owner(dest_id, metadata, size)
+    # Tags given when the destination's cache ID was made now expire with the copy
+    record_tags(dest_id, metadata, ())
+    leases.release(dest_id)
+    return metadata
+
+
+def copy_packed(packed, dest_id, metadata):
+    """
+    Save the bytes of a packed file as an object of its own under another cache ID. Copies never
+    point into packs, so that compaction only has to follow the files that were packed.
+    """
+    data = read_stream(open_packed(packed))
+    minio_client.put_object(bucket_name, dest_id, io.BytesIO(data), len(data), metadata=metadata)
+    track_upload(dest_id, len(data))
+
+
+def copy_cold(cache_id, dest_id, metadata, source):
+    """Copy a cache file in the cold tier server-side, and point a stub in the hot tier at the copy."""
+    copy = CopySource(cold_bucket_name, cache_id, match_etag=source['cold_etag'])
+    result = cold_client.copy_object(cold_bucket_name, dest_id, copy, metadata=metadata, metadata_directive=REPLACE)
+    put_cold_stub(dest_id, metadata, source['cold_size'], result.etag)
+    # The stub replaces any packed file
+    track_upload(dest_id, 0)
+
+
 def delete_cache(cache_id, token_id):
     """Delete a cache entry in both leveldb and minio."""
     authorize_access(cache_id, token_id)
     minio_client.remove_object(bucket_name, cache_id)
+    forget_entries([cache_id])
+
+
+def delete_tagged(token_id, tag):
+    """
+    Delete all of a token's cache entries that have a tag. They are deleted in batches of
+    Config.tag_delete_batch, whose entries are looked up concurrently and then removed from Minio
+    with a single bulk delete.
+
+    Yields the progress after each batch, as a dict of the `total` number of tagged entries, and
+    how many of them have been `deleted` so far, were already `missing`, or could not be removed
+    (`errors`). Entries that could not be removed keep their tags, so deleting the tag again
+    retries them.
+    """
+    cache_ids = index.get_tagged(token_id, tag)
+    progress = {'total': len(cache_ids), 'deleted': 0, 'missing': 0, 'errors': 0}
+    with ThreadPoolExecutor(Config.tag_delete_workers) as pool:
+        for batch in batches(cache_ids, Config.tag_delete_batch):
+            found = pool.map(_lookup_or_none, batch)
+            owned = [cache_id for (cache_id, entry) in zip(batch, found) if entry and entry[0]['token_id'] == token_id]
+            failed = set(remove_many(owned)) if owned else set()
+            forget_entries([cache_id for cache_id in owned if cache_id not in failed])
+            # Tags of entries that are already gone are stale
+            index.remove_tags([cache_id for cache_id in batch if cache_id not in failed])
+            progress['deleted'] += len(owned) - len(failed)
+            progress['missing'] += len(batch) - len(owned)
+            progress['errors'] += len(failed)
+            yield dict(progress)
+
+
+def _lookup_or_none(cache_id):
+    try:
+        return lookup_cache(cache_id)
+    except exceptions.MissingCache:
+        return None
+
+
+def forget_entries(cache_ids):
+    """Remove the index records of cache entries that have been deleted, and wake up anyone waiting on them."""
+    if Config.placeholder_index:
+        for cache_id in cache_ids:
+            index.remove_placeholder(cache_id)
+    if Config.pack_threshold:
+        index.remove_packed(cache_ids)
+    if Config.owner_index:
+        index.remove_owners(cache_ids)
+    index.remove_tags(cache_ids)
+    for cache_id in cache_ids:
+        leases.release(cache_id)
 
 
 def get_metadata(cache_id):
-    """Return the Minio metadata dict for a cache file."""
+    """Return the metadata dict for a cache file, whether it is in Minio or a pack, or for an indexed placeholder."""
+    return lookup_cache(cache_id)[0]
+
+
+def lookup_cache(cache_id):
+    """
+    Return (metadata, size, etag) for a cache file, or for a placeholder (with a size of 0 and an
+    empty ETag). Raises MissingCache if there is neither. The size and ETag of a file in the cold
+    tier are those of its contents there.
+    """
+    packed = get_packed(cache_id)
+    if packed:
+        return (packed_metadata(packed), packed['length'], packed['etag'])
+    try:
+        stat = stat_cache(cache_id)
+    except exceptions.MissingCache:
+        return (get_indexed_placeholder(cache_id), 0, '')
+    metadata = parse_metadata(stat.metadata)
+    if is_cold(metadata):
+        return (metadata, int(metadata['cold_size']), metadata['cold_etag'])
+    return (metadata, stat.size, stat.etag)
+
+
+def get_packed(cache_id):
+    """Return the pack index entry of a cache file that has been moved into a pack, or None."""
+    if not Config.pack_threshold:
+        return None
+    return index.get_packed(cache_id, time.time())
+
+
+def packed_metadata(packed):
+    """Convert the pack index entry of a cache file into our metadata dict."""
+    return {key: str(packed[key]) for key in ['expiration', 'filename', 'token_id', 'accessed']}
+
+
+def get_indexed_placeholder(cache_id):
+    """Return the metadata for a placeholder in the index, raising MissingCache if there is none."""
+    row = index.get_placeholder(cache_id, time.time()) if Config.placeholder_index else None
+    if not row:
+        raise exceptions.MissingCache(cache_id)
+    (token_id, expiration) = row
+    return {'expiration': str(expiration), 'filename': 'placeholder', 'token_id': token_id}
+
+
+def get_cache_info(cache_id, token_id):
+    """
+    Return the metadata for a cache file along with its size, ETag, and whether it is only a
+    placeholder. This takes a single metadata lookup and never touches the file contents.
+
+    Raises the same exceptions as authorize_access.
+    """
+    (info, size, etag) = lookup_cache(cache_id)
+    check_token(info, token_id)
+    info['size'] = size
+    info['etag'] = etag
+    info['placeholder'] = info['filename'] == 'placeholder'
+    return info
+
+
+def stat_cache(cache_id):
+    """Fetch the Minio object info for a cache file, raising MissingCache if it does not exist."""
     try:
-        orig_metadata = minio_client.stat_object(bucket_name, cache_id).metadata
+        return minio_client.stat_object(bucket_name, cache_id)
     except minio.error.S3Error as err:
         # Catch NoSuchKey errors and raise MissingCache
         if err.code != "NoSuchKey":
             raise err
         raise exceptions.MissingCache(cache_id)
+
+
+def parse_metadata(orig_metadata):
+    """Convert the user metadata headers of a Minio object into our metadata dict."""
     # The below keys are how metadata gets stored in minio files for 'expiration', 'filename', etc
     # For example if you set the metadata 'xyz_abc', then minio will store it as 'X-Amz-Meta-Xyz_abc'
-    return {
+    metadata = {
         'expiration': orig_metadata['X-Amz-Meta-Expiration'],
         'filename': orig_metadata['X-Amz-Meta-Filename'],
         'token_id': orig_metadata['X-Amz-Meta-Token_id']
     }
+    # Metadata that only some cache files have
+    for key in _optional_metadata:
+        value = orig_metadata.get('X-Amz-Meta-' + key.capitalize())
+        if value is not None:
+            metadata[key] = value
+    return metadata
+
 
+def is_cold(metadata):
+    """Whether the contents of a cache file with the given metadata are in the cold tier."""
+    return metadata.get('tier') == 'cold'
 
-def download_cache(cache_id, token_id, save_dir):
+
+def download_cache(cache_id, token_id, save_dir, fetch=None):
     """
     Download a file from a cache ID to a temp directory and path.
 
@@ -189,14 +723,364 @@ def download_cache(cache_id, token_id, save_dir):
     Note that this does not clean up the temp directory if the download succeeds; remove the temp
     directory after you are done with the file.
 
+    The file contents are saved with `fetch(cache_id, etag, save_path)`, which is `fetch_cache`
+    (straight from Minio) by default.
+
     This may raise an UnauthorizedCacheAccess or NoSuchKey (missing cache). If any unexpected error
     occurs, all temporary files will get cleaned up.
     """
-    authorize_access(cache_id, token_id)
-    metadata = get_metadata(cache_id)
-    filename = metadata['filename']
-    if not filename or filename == 'placeholder':
+    found = authorize_download(cache_id, token_id)
+    return save_download(cache_id, found, save_dir, fetch)
+
+
+def authorize_download(cache_id, token_id):
+    """
+    Return (metadata, size, etag) for a cache file that a token may download. Raises the same
+    exceptions as authorize_access, and MissingCache if there is only a placeholder.
+    """
+    (metadata, size, etag) = lookup_cache(cache_id)
+    check_token(metadata, token_id)
+    if not metadata['filename'] or metadata['filename'] == 'placeholder':
         raise exceptions.MissingCache(cache_id)
-    save_path = os.path.join(save_dir, filename)
-    minio_client.fget_object(Config.minio_bucket_name, cache_id, save_path)
+    return (metadata, size, etag)
+
+
+def save_download(cache_id, found, save_dir, fetch=None):
+    """
+    Save a cache file that was found with authorize_download, as for download_cache. A file in the
+    cold tier is always recalled from there, rather than with `fetch`.
+    """
+    (metadata, _, etag) = found
+    save_path = os.path.join(save_dir, metadata['filename'])
+    if is_cold(metadata):
+        recall_cache(cache_id, etag, save_path)
+    else:
+        (fetch or fetch_cache)(cache_id, etag, save_path)
+    record_download(cache_id, metadata)
     return save_path
+
+
+def record_download(cache_id, metadata):
+    """
+    Record a download of a cache file, counting it as a hit, and queueing it up for promotion if
+    it is in the cold tier.
+    """
+    analytics.record_hit(cache_id, metadata)
+    if retention.tracks_access():
+        access_log.add(cache_id, time.time())
+    if Config.cold_promote and is_cold(metadata):
+        index.add_promotion(cache_id, time.time())
+
+
+def fetch_cache(cache_id, etag, save_path):
+    """Save the contents of a cache file from Minio, whether it is its own object or packed."""
+    if get_packed(cache_id):
+        save_stream(open_cache(cache_id), save_path)
+    else:
+        minio_client.fget_object(Config.minio_bucket_name, cache_id, save_path)
+
+
+def recall_cache(cache_id, etag, save_path):
+    """Save the contents of a cache file from the cold tier, failing if they have changed since the lookup."""
+    cold_client.fget_object(cold_bucket_name, cache_id, save_path, request_headers=_if_match(etag))
+
+
+def open_cache(cache_id):
+    """
+    Start a streaming read of the contents of a cache file, with a ranged read of its pack if it
+    is packed. If compaction has replaced the pack in the meantime, the file is looked up again.
+
+    The caller must close and release the returned response.
+    """
+    packed = get_packed(cache_id)
+    if not packed:
+        return minio_client.get_object(bucket_name, cache_id)
+    try:
+        return open_packed(packed)
+    except minio.error.S3Error as err:
+        if err.code != "NoSuchKey":
+            raise err
+        packed = get_packed(cache_id)
+        if not packed:
+            raise exceptions.MissingCache(cache_id)
+        return open_packed(packed)
+
+
+def read_ranges(cache_id, start, stop, etag=None, cold=False):
+    """
+    Yield the bytes of a cache file from `start` up to `stop`, in order. They are fetched in chunks
+    of Config.download_chunk_size bytes, with up to Config.download_connections ranged reads from
+    Minio at a time, so that a large file is not limited to the throughput of one connection. No
+    more chunks than that are held in memory, however slowly they are consumed. If `cold` is set,
+    they are read from the cold tier.
+
+    If an `etag` is given, the reads fail if the file is replaced partway through.
+    """
+    packed = None if cold else get_packed(cache_id)
+    (name, base) = (packed['pack'], packed['offset']) if packed else (cache_id, 0)
+    headers = _if_match(etag) if etag and not packed else None
+    pending = collections.deque()  # type: collections.deque
+    with ThreadPoolExecutor(Config.download_connections) as pool:
+        try:
+            for offset in range(start, stop, Config.download_chunk_size):
+                if len(pending) >= Config.download_connections:
+                    yield pending.popleft().result()
+                length = min(Config.download_chunk_size, stop - offset)
+                pending.append(pool.submit(_read_range, name, base + offset, length, headers, cold))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # The reader may have gone away
+            for future in pending:
+                future.cancel()
+
+
+def _read_range(name, offset, length, headers, cold=False):
+    (client, bucket) = (cold_client, cold_bucket_name) if cold else (minio_client, bucket_name)
+    resp = client.get_object(bucket, name, offset=offset, length=length, request_headers=headers)
+    return read_stream(resp)
+
+
+def _if_match(etag):
+    return {'If-Match': '"' + etag + '"'}
+
+
+def open_cold(cache_id):
+    """Start a streaming read of the contents of a cache file in the cold tier, as for `open_cache`."""
+    return cold_client.get_object(cold_bucket_name, cache_id)
+
+
+def open_packed(packed):
+    return minio_client.get_object(bucket_name, packed['pack'], offset=packed['offset'], length=packed['length'])
+
+
+def save_stream(resp, save_path):
+    """Write the contents of a response from `open_cache` to a file, then release it."""
+    try:
+        with open(save_path, 'wb') as fd:
+            for chunk in resp.stream(1024 * 1024):
+                fd.write(chunk)
+    finally:
+        resp.close()
+        resp.release_conn()
+
+
+def read_stream(resp):
+    """Read all of the contents of a response from `open_cache`, then release it."""
+    try:
+        return resp.read()
+    finally:
+        resp.close()
+        resp.release_conn()
+
+
+def authorize_many(cache_ids, token_id, workers):
+    """
+    Authorize access to several cache files at once, looking them up concurrently. Returns a list
+    of dicts with the `cache_id`, `filename`, `size`, and `metadata` of each file, and whether it
+    is in the `cold` tier, in the same order.
+
+    Raises UnauthorizedAccess, or MissingCache if any of them has no uploaded file.
+    """
+    with ThreadPoolExecutor(workers) as pool:
+        found = list(pool.map(lookup_cache, cache_ids))
+    files = []
+    for (cache_id, (metadata, size, _)) in zip(cache_ids, found):
+        check_token(metadata, token_id)
+        if metadata['filename'] == 'placeholder':
+            raise exceptions.MissingCache(cache_id)
+        files.append({'cache_id': cache_id, 'filename': metadata['filename'], 'size': size,
+                      'metadata': metadata, 'cold': is_cold(metadata)})
+    return files
+
+
+def refresh_access(accesses):
+    """
+    Record the latest download time of cache files, given a dict of cache_id -> access timestamp.
+    With sliding expiration, this also pushes back their expiration.
+
+    This is called in batches by `access_log` rather than on every download, and skips files that
+    were refreshed within the last Config.access_refresh_interval seconds.
+    """
+    for (cache_id, accessed) in accesses.items():
+        packed = get_packed(cache_id)
+        if packed:
+            refresh_packed(packed, accessed)
+        else:
+            refresh_object(cache_id, accessed)
+
+
+def refresh_object(cache_id, accessed):
+    """
+    Record the download time of a cache file in its Minio metadata. Minio rewrites the metadata of
+    an object in place, keeping its ETag, but minio-py copies the data of objects larger than 5GiB
+    into a new object with a new ETag instead, so their download times are not recorded.
+    """
+    try:
+        stat = stat_cache(cache_id)
+    except exceptions.MissingCache:
+        return
+    metadata = parse_metadata(stat.metadata)
+    if int(metadata.get('accessed', 0)) >= accessed - Config.access_refresh_interval or stat.size > MAX_PART_SIZE:
+        return
+    metadata['accessed'] = str(int(accessed))
+    if Config.sliding_expiration:
+        size = int(metadata.get('cold_size', stat.size))
+        metadata['expiration'] = retention.expiration(retention.cache_ttl(size), accessed)
+    # Only rewrite the metadata if the file has not been replaced in the meantime
+    source = CopySource(bucket_name, cache_id, match_etag=stat.etag)
+    minio_client.copy_object(bucket_name, cache_id, source, metadata=metadata,
+                             metadata_directive=REPLACE)
+    if Config.sliding_expiration:
+        update_expiration(cache_id, metadata['expiration'])
+
+
+def refresh_packed(packed, accessed):
+    """Record the download time of a packed cache file in the pack index."""
+    expiration = None
+    if Config.sliding_expiration:
+        expiration = retention.expiration(retention.cache_ttl(packed['length']), accessed)
+    index.touch_packed(packed['cache_id'], accessed, expiration)
+    if expiration is not None:
+        update_expiration(packed['cache_id'], expiration)
+
+
+def update_expiration(cache_id, expiration):
+    """Update the expiration of a cache entry in the indexes that record it."""
+    if Config.owner_index:
+        index.set_owner_expiration(cache_id, expiration)
+    index.set_tag_expiration(cache_id, expiration)
+
+
+def demote_cache(cache_id, cutoff):
+    """
+    Move the contents of a cache file that has not been downloaded since `cutoff` to the cold
+    tier, and replace it in the hot tier with an empty stub that keeps its metadata. Returns the
+    number of bytes moved, which is 0 if the file was downloaded or replaced in the meantime.
+
+    Raises MissingCache if the file has been removed.
+    """
+    stat = stat_cache(cache_id)
+    metadata = parse_metadata(stat.metadata)
+    if is_cold(metadata) or int(metadata.get('accessed', stat.last_modified.timestamp())) >= cutoff:
+        return 0
+    resp = minio_client.get_object(bucket_name, cache_id, request_headers=_if_match(stat.etag))
+    try:
+        result = cold_client.put_object(cold_bucket_name, cache_id, resp, stat.size, metadata=metadata)
+    finally:
+        resp.close()
+        resp.release_conn()
+    # Leave alone a file that was replaced while it was copied. Its copy is collected later
+    if not put_cold_stub(cache_id, metadata, stat.size, result.etag, match_etag=stat.etag):
+        return 0
+    return stat.size
+
+
+def promote_cache(cache_id):
+    """
+    Move the contents of a cache file from the cold tier back into the hot tier. Returns the
+    number of bytes moved, which is 0 if it is no longer in the cold tier. Its copy in the cold
+    tier is left for `is_cold_orphan` to find.
+
+    Raises MissingCache if the file has been removed.
+    """
+    stat = stat_cache(cache_id)
+    metadata = parse_metadata(stat.metadata)
+    if not is_cold(metadata):
+        return 0
+    size = int(metadata.pop('cold_size'))
+    resp = cold_client.get_object(cold_bucket_name, cache_id, request_headers=_if_match(metadata.pop('cold_etag')))
+    del metadata['tier']
+    try:
+        minio_client.put_object(bucket_name, cache_id, resp, size, metadata=metadata)
+    finally:
+        resp.close()
+        resp.release_conn()
+    return size
+
+
+def put_cold_stub(cache_id, metadata, size, etag, match_etag=None):
+    """Save an empty stub in the hot tier for a cache file whose contents are in the cold tier, as for put_stub."""
+    return put_stub(cache_id, dict(metadata, tier='cold', cold_size=str(size), cold_etag=etag), match_etag)
+
+
+def put_stub(cache_id, metadata, match_etag=None):
+    """
+    Save an empty object with the given metadata, for a cache file whose contents are elsewhere.
+    With `match_etag`, the stub only replaces an object that still has that ETag, and False is
+    returned if it does not.
+
+    minio-py passes no extra headers on with put_object, hence its lower-level _put_object.
+    """
+    headers = {'x-amz-meta-' + key: val for (key, val) in metadata.items()}
+    if match_etag:
+        headers.update(_if_match(match_etag))
+    try:
+        minio_client._put_object(bucket_name, cache_id, b'', headers)
+    except minio.error.S3Error as err:
+        if err.code not in ('PreconditionFailed', 'NoSuchKey'):
+            raise err
+        return False
+    return True
+
+
+def is_cold_orphan(obj, cutoff):
+    """
+    Whether an object in the cold tier, from list_objects, was written before the cutoff time and
+    is no longer the contents of any cache file.
+    """
+    if obj.last_modified.timestamp() >= cutoff:
+        return False
+    try:
+        metadata = get_metadata(obj.object_name)
+    except exceptions.MissingCache:
+        return True
+    return not is_cold(metadata) or metadata['cold_etag'] != obj.etag
+
+
+def evict_entries(max_bytes=None):
+    """
+    Remove the least recently downloaded cache files until the bucket holds no more than
+    `max_bytes` (Config.max_bucket_bytes by default). Files that were never downloaded count as
+    accessed when they were uploaded. Packed files are removed from the pack index, but their space
+    is only reclaimed by the next compaction, so removing them counts as freeing nothing.
+
+    Returns (removed_count, remaining_bytes).
+    """
+    if max_bytes is None:
+        max_bytes = Config.max_bucket_bytes
+    print('Checking the total size of all stored objects..')
+    # Listed recursively, so that the space taken by packs is counted too
+    objects = list(minio_client.list_objects(bucket_name, recursive=True))
+    total_bytes = sum(obj.size for obj in objects)
+    if total_bytes <= max_bytes:
+        print('... Finished running. Total bytes: {}. Removed 0 objects'.format(total_bytes))
+        return (0, total_bytes)
+    # Placeholders take up no space, so there is no need to look them up
+    entries = [_access_entry(obj) for obj in objects if obj.size and not is_pack(obj.object_name)]
+    packed = index.get_all_packed(time.time()) if Config.pack_threshold else []
+    entries.extend((accessed, cache_id, 0) for (accessed, cache_id, _) in packed)
+    packed_ids = {cache_id for (_, cache_id, _) in packed}
+    sizes = {cache_id: size for (_, cache_id, size) in entries}
+    evicted = retention.least_recently_used(entries, total_bytes, max_bytes)
+    for cache_id in evicted:
+        if cache_id not in packed_ids:
+            minio_client.remove_object(bucket_name, cache_id)
+        total_bytes -= sizes[cache_id]
+    forget_entries(evicted)
+    print('... Finished running. Total bytes: {}. Removed {} objects'.format(total_bytes, len(evicted)))
+    return (len(evicted), total_bytes)
+
+
+def _access_entry(obj):
+    """Return (last access time, cache_id, size) for an object from list_objects."""
+    accessed = obj.last_modified.timestamp()
+    try:
+        accessed = int(get_metadata(obj.object_name).get('accessed', accessed))
+    except (exceptions.MissingCache, KeyError):
+        pass
+    return (accessed, obj.object_name, obj.size)
+
+
+# Download times get buffered here and written to the metadata in batches
+access_log = Batcher(refresh_access, Config.access_flush_interval, merge=max)
@@ -0,0 +1,156 @@
+"""
+Resumable upload sessions for large cache files.
+
+A session is a Minio multipart upload of the cache object: each numbered chunk that a client sends
+is streamed straight on to Minio as a part, with nothing staged on the server's disk or held in
+memory. Minio keeps track of which parts it has received, so an interrupted upload can pick up
+where it left off, and the parts are only assembled into the cache file when the session is
+committed.
+
+minio-py has no public API for multipart uploads that outlive a request, so sessions use its
+private methods, and minio is pinned to an exact version in requirements.txt. A part is sent with a
+presigned URL instead, as minio-py needs the whole body of a part in memory to sign it.
+"""
+import contextlib
+import datetime
+import time
+import minio.error
+from minio.datatypes import Part
+from werkzeug.utils import secure_filename
+
+from .config import Config
+from . import exceptions
+from . import retention
+from . import minio as storage
+
+# S3 limits on multipart uploads
+max_part_number = 10000
+# How long the presigned URL that a part is sent to stays valid for
+part_url_ttl = datetime.timedelta(hours=1)
+
+
+def create_session(cache_id, token_id, filename):
+    """Start a resumable upload of a file to a cache ID. Returns the new session's upload ID."""
+    owner = storage.authorize_access(cache_id, token_id)['token_id']
+    filename = secure_filename(filename)
+    if not filename:
+        raise exceptions.InvalidUpload('Filename missing')
+    # The size is unknown until the upload is committed, so the default TTL is used
+    metadata = {
+        'filename': filename,
+        'expiration': retention.expiration(Config.cache_ttl),
+        'token_id': owner
+    }
+    headers = {'x-amz-meta-' + key: val for (key, val) in metadata.items()}
+    return storage.minio_client._create_multipart_upload(storage.bucket_name, cache_id, headers)
+
+
+def upload_part(cache_id, token_id, upload_id, part_number, stream, length):
+    """
+    Save one numbered chunk of a session, read from a file-like `stream` of `length` bytes. Parts
+    may arrive in any order. Returns its ETag.
+    """
+    storage.authorize_access(cache_id, token_id)
+    if part_number < 1 or part_number > max_part_number:
+        raise exceptions.InvalidUpload('Part number must be between 1 and ' + str(max_part_number))
+    url = storage.minio_client.get_presigned_url(
+        'PUT', storage.bucket_name, cache_id, expires=part_url_ttl,
+        extra_query_params={'partNumber': str(part_number), 'uploadId': upload_id}
+    )
+    # The body can only be read once, so failed requests are not retried
+    response = storage.minio_pool.urlopen('PUT', url, body=stream, headers={'Content-Length': str(length)},
+                                          retries=False)
+    with _upload_errors(upload_id):
+        if response.status != 200:
+            raise minio.error.S3Error.fromxml(response)
+    return response.getheader('ETag').replace('"', '')
+
+
+def list_parts(cache_id, token_id, upload_id):
+    """List the parts of a session that have been received, as dicts of number, size, and ETag."""
+    storage.authorize_access(cache_id, token_id)
+    return [
+        {'part_number': part.part_number, 'size': part.size, 'etag': part.etag}
+        for part in _all_parts(cache_id, upload_id)
+    ]
+
+
+def complete_session(cache_id, token_id, upload_id, compute_seconds=None):
+    """
+    Assemble all received parts, in order, into the cache file. `compute_seconds` is as for
+    storage.upload_cache.
+    """
+    storage.authorize_access(cache_id, token_id)
+    received = list(_all_parts(cache_id, upload_id))
+    if not received:
+        raise exceptions.InvalidUpload('No parts have been uploaded')
+    parts = [Part(part.part_number, part.etag) for part in received]
+    with _upload_errors(upload_id):
+        storage.minio_client._complete_multipart_upload(storage.bucket_name, cache_id, upload_id, parts)
+    storage.finish_upload(cache_id, sum(part.size for part in received), compute_seconds=compute_seconds)
+
+
+def abort_session(cache_id, token_id, upload_id):
+    """Cancel a session and discard all of its parts."""
+    storage.authorize_access(cache_id, token_id)
+    with _upload_errors(upload_id):
+        storage.minio_client._abort_multipart_upload(storage.bucket_name, cache_id, upload_id)
+
+
+def abort_stale_sessions(max_age):
+    """
+    Abort every session that was started more than `max_age` seconds ago, to reclaim the space
+    taken by the parts of abandoned uploads. Returns the number of sessions aborted.
+    """
+    print('Aborting upload sessions older than {} seconds..'.format(max_age))
+    cutoff = time.time() - max_age
+    aborted_count = 0
+    for upload in _all_uploads():
+        if upload.initiated_time.timestamp() < cutoff:
+            storage.minio_client._abort_multipart_upload(
+                storage.bucket_name, upload.object_name, upload.upload_id
+            )
+            aborted_count += 1
+    print('... Finished running. Aborted {} sessions'.format(aborted_count))
+    return aborted_count
+
+
+def _all_parts(cache_id, upload_id):
+    """Iterate over every part of a session, sorted by part number."""
+    marker = None
+    while True:
+        with _upload_errors(upload_id):
+            result = storage.minio_client._list_parts(
+                storage.bucket_name, cache_id, upload_id, part_number_marker=marker
+            )
+        for part in result.parts:
+            yield Part(int(part.part_number), part.etag, part.last_modified, part.size)
+        if not result.is_truncated:
+            break
+        marker = result.next_part_number_marker
+
+
+def _all_uploads():
+    """Iterate over every upload session in the bucket."""
+    (key_marker, upload_id_marker) = (None, None)
+    while True:
+        result = storage.minio_client._list_multipart_uploads(
+            storage.bucket_name, key_marker=key_marker, upload_id_marker=upload_id_marker
+        )
+        yield from result.uploads
+        if not result.is_truncated:
+            break
+        (key_marker, upload_id_marker) = (result.next_key_marker, result.next_upload_id_marker)
+
+
+@contextlib.contextmanager
+def _upload_errors(upload_id):
+    """Convert Minio's errors about sessions into our own exceptions."""
+    try:
+        yield
+    except minio.error.S3Error as err:
+        if err.code == 'NoSuchUpload':
+            raise exceptions.MissingUpload(upload_id)
+        if err.code in ('EntityTooSmall', 'InvalidPart', 'InvalidPartOrder'):
+            raise exceptions.InvalidUpload(err.message)
+        raise err
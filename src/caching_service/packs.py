@@ -0,0 +1,196 @@
+"""
+Packing of small cache files into shared pack objects.
+
+Small files are first uploaded as their own Minio objects, so that uploads stay simple, and are
+queued in the local index. The `pack` admin command then copies the queued files end to end into
+pack objects of about Config.pack_size bytes, records the (pack, offset, length) and metadata of
+each file in the index, and removes the original objects. Packed files are served with ranged
+reads of their pack, and expire from the index without any Minio requests.
+
+Each pack ends with a manifest of the files in it, one JSON object per line, which starts at the
+offset in its `manifest_offset` metadata. If the index is lost, the `restore_packs` admin command
+rebuilds the pack index from the manifests.
+
+Files that expire or get replaced leave dead space behind in their packs. The `compact_packs`
+admin command rewrites the packs that are mostly dead space.
+"""
+import io
+import json
+import time
+import uuid
+
+from .config import Config
+from . import exceptions
+from . import index
+from . import minio as storage
+
+# The details of each file that are kept in the manifest of its pack
+_manifest_keys = ['cache_id', 'offset', 'length', 'etag', 'filename', 'token_id', 'expiration', 'accessed']
+
+
+class PackWriter:
+    """
+    Collect cache files into a buffer, writing it out as a new pack object whenever it fills up.
+    After each pack is written, `on_write(pack, size, entries)` is called to record it, where each
+    entry is a dict of packed file details with its `offset` in the new pack, and `size` leaves out
+    the manifest.
+    """
+
+    def __init__(self, on_write):
+        self.on_write = on_write
+        self.written = 0
+        self._buf = io.BytesIO()
+        self._entries = []  # type: list
+
+    def add(self, entry, data):
+        if self._entries and self._buf.tell() + len(data) > Config.pack_size:
+            self.flush()
+        self._entries.append(dict(entry, offset=self._buf.tell()))
+        self._buf.write(data)
+
+    def flush(self):
+        if not self._entries:
+            return
+        pack = storage.pack_prefix + uuid.uuid4().hex
+        size = self._buf.tell()
+        for entry in self._entries:
+            line = {key: entry[key] for key in _manifest_keys}
+            self._buf.write(json.dumps(line).encode() + b'\n')
+        length = self._buf.tell()
+        self._buf.seek(0)
+        metadata = {'manifest_offset': str(size)}
+        storage.minio_client.put_object(storage.bucket_name, pack, self._buf, length, metadata=metadata)
+        self.on_write(pack, size, self._entries)
+        self.written += len(self._entries)
+        (self._buf, self._entries) = (io.BytesIO(), [])
+
+
+def pack_entries():
+    """Move every queued small cache file into pack objects. Returns the number of files packed."""
+    print('Packing small cache files..')
+    writer = PackWriter(_record_pack)
+    skipped = []
+    queued = index.get_unpacked()
+    for (cache_id, _) in queued:
+        item = _read_small_file(cache_id)
+        if item is None:
+            skipped.append(cache_id)
+            continue
+        writer.add(*item)
+    writer.flush()
+    index.remove_unpacked(skipped)
+    print('... Finished running. Packed {} of {} queued files'.format(writer.written, len(queued)))
+    return writer.written
+
+
+def compact_packs(min_dead_ratio=None):
+    """
+    Rewrite every pack where at least `min_dead_ratio` (Config.pack_compact_ratio by default) of
+    the bytes belong to files that have expired or been removed. The live files of those packs
+    are copied together into new packs, and the old packs are deleted.
+
+    Returns the number of packs that were removed.
+    """
+    if min_dead_ratio is None:
+        min_dead_ratio = Config.pack_compact_ratio
+    print('Compacting packs that are at least {:.0%} expired..'.format(min_dead_ratio))
+    now = time.time()
+    sparse = [pack for (pack, size, live) in index.get_pack_usage(now) if size - live >= size * min_dead_ratio]
+    writer = PackWriter(index.move_packed)
+    for pack in sparse:
+        entries = index.get_pack_entries(pack, now)
+        data = _read_object(pack) if entries else b''
+        for entry in entries:
+            writer.add(entry, data[entry['offset']:entry['offset'] + entry['length']])
+    writer.flush()
+    # An old pack that has gained live files since it was read, such as by a `restore_packs` run,
+    # is kept until the next compaction. Anything else still pointing into it is dead
+    removed = [pack for pack in sparse if not index.get_pack_entries(pack, time.time())]
+    for pack in removed:
+        index.remove_pack(pack)
+        storage.minio_client.remove_object(storage.bucket_name, pack)
+    print('... Finished running. Rewrote {} packs, keeping {} files. Removed {} old packs'.format(
+        len(sparse), writer.written, len(removed)
+    ))
+    return len(removed)
+
+
+def restore_packs():
+    """
+    Rebuild the pack index from the manifests of every pack, such as after the index was lost.
+    Files that have expired, or that have an object of their own because they were uploaded again,
+    are left out. Where a file is listed in more than one pack, the newest pack wins.
+
+    Files that were deleted after they were packed come back until they expire, so this is only
+    meant for recovering a lost index. Returns the number of files restored.
+    """
+    print('Restoring the pack index from the pack manifests..')
+    listing = storage.minio_client.list_objects(storage.bucket_name, prefix=storage.pack_prefix, recursive=True)
+    restored = 0
+    for obj in sorted(listing, key=lambda obj: obj.last_modified):
+        (size, entries) = _read_manifest(obj.object_name)
+        now = time.time()
+        entries = [entry for entry in entries if entry['expiration'] > now and not _has_object(entry['cache_id'])]
+        index.restore_pack(obj.object_name, size, entries)
+        restored += len(entries)
+    print('... Finished running. Restored {} files'.format(restored))
+    return restored
+
+
+def _read_small_file(cache_id):
+    """Return (entry, data) for a queued cache file, or None if it is gone or no longer small."""
+    try:
+        stat = storage.stat_cache(cache_id)
+    except exceptions.MissingCache:
+        return None
+    if not 0 < stat.size < Config.pack_threshold:
+        return None
+    metadata = storage.parse_metadata(stat.metadata)
+    data = _read_object(cache_id)
+    # If the file was replaced since the stat, its ETag will not match and it is left unpacked
+    entry = {
+        'cache_id': cache_id,
+        'length': len(data),
+        'etag': stat.etag,
+        'filename': metadata['filename'],
+        'token_id': metadata['token_id'],
+        'expiration': int(metadata['expiration']),
+        'accessed': int(metadata.get('accessed', stat.last_modified.timestamp()))
+    }
+    return (entry, data)
+
+
+def _read_object(name, offset=0):
+    return storage.read_stream(storage.minio_client.get_object(storage.bucket_name, name, offset=offset))
+
+
+def _read_manifest(pack):
+    """Return the size of the files in a pack, and the manifest entries of those files."""
+    stat = storage.stat_cache(pack)
+    size = int(stat.metadata['X-Amz-Meta-Manifest_offset'])
+    lines = _read_object(pack, size).splitlines()
+    return (size, [json.loads(line) for line in lines])
+
+
+def _has_object(cache_id):
+    try:
+        storage.stat_cache(cache_id)
+    except exceptions.MissingCache:
+        return False
+    return True
+
+
+def _record_pack(pack, size, entries):
+    """Point the index at a newly written pack, then remove the original objects of its files."""
+    index.add_pack(pack, size, entries)
+    (unchanged, stale) = ([], [])
+    for entry in entries:
+        try:
+            etag = storage.stat_cache(entry['cache_id']).etag
+        except exceptions.MissingCache:
+            etag = None
+        (unchanged if etag == entry['etag'] else stale).append(entry['cache_id'])
+    # A file that was replaced or deleted while it was being packed keeps its new state
+    index.remove_packed(stale)
+    for names in storage.batches(unchanged, 1000):
+        storage.remove_many(names)
@@ -0,0 +1,153 @@
+"""
+Cache fill between replicas of the service.
+
+The replicas in Config.peers form a consistent-hash ring, which gives every cache ID an owner.
+The owner is the only replica that fetches the file from Minio, and it keeps a hot copy on local
+disk. Other replicas fetch the file from the owner instead, and fall back to Minio if the owner
+cannot be reached. A replica that fails is skipped for Config.peer_retry_after seconds.
+
+Hot copies are named by cache ID and ETag, so that a replaced file is never served stale.
+"""
+import bisect
+import hmac
+import os
+import shutil
+import time
+import urllib.parse
+import uuid
+import requests
+
+from .config import Config
+from .hash import bhash
+from . import log
+from . import minio as storage
+
+# Header holding Config.peer_secret on requests between replicas
+secret_header = 'X-Peer-Secret'  # nosec
+# Replica URL -> time until which it is skipped
+_down_until = {}  # type: dict
+_session = requests.Session()
+
+
+class HashRing:
+    """A consistent-hash ring of nodes, each with `vnodes` points on the ring."""
+
+    def __init__(self, nodes, vnodes):
+        points = sorted((_position(node + '#' + str(num)), node) for node in nodes for num in range(vnodes))
+        self._positions = [position for (position, _) in points]
+        self._nodes = [node for (_, node) in points]
+
+    def owner(self, key):
+        """Return the node that owns a key: the first one at or after the key on the ring."""
+        if not self._nodes:
+            return None
+        idx = bisect.bisect_left(self._positions, _position(key)) % len(self._nodes)
+        return self._nodes[idx]
+
+
+def _position(key):
+    return int(bhash(key)[:16], 16)
+
+
+ring = HashRing(Config.peers, Config.peer_vnodes)
+
+
+def fetch(cache_id, etag, save_path):
+    """
+    Save the contents of a cache file, from the hot copy of its owner if there are peers, and
+    otherwise from Minio. This can be passed as the `fetch` of `minio.download_cache`.
+    """
+    owner = ring.owner(cache_id)
+    if owner is None:
+        storage.fetch_cache(cache_id, etag, save_path)
+    elif owner == Config.self_url:
+        _link_or_copy(hot_copy(cache_id, etag), save_path)
+    elif not fetch_from_peer(owner, cache_id, etag, save_path):
+        storage.fetch_cache(cache_id, etag, save_path)
+
+
+def fetch_from_peer(peer, cache_id, etag, save_path):
+    """Save a cache file from another replica's hot copy. Returns False if the replica failed."""
+    if _down_until.get(peer, 0) > time.time():
+        return False
+    url = peer + '/internal/peer/' + cache_id + '/' + urllib.parse.quote(etag, safe='')
+    try:
+        with _session.get(url, headers={secret_header: Config.peer_secret}, stream=True,
+                          timeout=Config.peer_timeout) as resp:
+            if resp.status_code == 404:
+                # The owner sees a different version of the file
+                return False
+            resp.raise_for_status()
+            with open(save_path, 'wb') as fd:
+                for chunk in resp.iter_content(1024 * 1024):
+                    fd.write(chunk)
+    except requests.exceptions.RequestException as err:
+        log.logger.warning('Peer failed, falling back to Minio', extra={'fields': {'peer': peer, 'error': str(err)}})
+        _down_until[peer] = time.time() + Config.peer_retry_after
+        return False
+    return True
+
+
+def hot_copy(cache_id, etag):
+    """Return the path of the hot copy of a cache file, fetching it from Minio first if needed."""
+    path = os.path.join(Config.hot_cache_dir, cache_id + '-' + _safe(etag))
+    if os.path.exists(path):
+        try:
+            # Recently used copies are the last to be trimmed
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+    os.makedirs(Config.hot_cache_dir, exist_ok=True)
+    tmp_path = path + '.' + uuid.uuid4().hex + '.tmp'
+    try:
+        storage.fetch_cache(cache_id, etag, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    trim_hot_copies(Config.hot_cache_dir, Config.hot_cache_bytes)
+    return path
+
+
+def trim_hot_copies(directory, max_bytes):
+    """Remove the least recently used hot copies until the directory holds no more than `max_bytes`."""
+    files = sorted(_hot_copy_stats(directory))
+    total = sum(size for (_, _, size) in files)
+    for (_, path, size) in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _hot_copy_stats(directory):
+    """Yield (last used time, path, size) for each finished hot copy in a directory."""
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        yield (stat.st_mtime, entry.path, stat.st_size)
+
+
+def is_authorized(secret):
+    """Whether a request from another replica carries the shared secret."""
+    return bool(Config.peer_secret) and hmac.compare_digest(secret or '', Config.peer_secret)
+
+
+def _link_or_copy(path, dest):
+    """Hard link a hot copy to its destination, or copy it if they are on different filesystems."""
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copyfile(path, dest)
+
+
+def _safe(etag):
+    return ''.join(char for char in etag if char.isalnum() or char == '-')
@@ -0,0 +1,146 @@
+"""
+On-demand sampling profiler for live workers.
+
+An admin opens a profiling window of a number of seconds, for a fraction of requests and
+optionally for only one route. The window is kept in the local index, where each worker reads it
+at most every Config.profile_poll_interval seconds, so while no window is open a request costs
+only a comparison of timestamps. While one is open, a native thread in each worker samples the
+stacks of the picked requests every Config.profile_interval seconds, including the time that they
+spend waiting on Minio or the client, and the samples of all of the workers on the host are summed
+in the index as folded stacks, ready to be rendered as a flame graph.
+"""
+import _thread
+import collections
+import os
+import random
+import sys
+import time
+import flask
+
+from .config import Config
+from . import index
+
+try:
+    # Under gevent, the sampler has to be a native thread to run while a greenlet holds the CPU,
+    # and the requests being sampled are found by their greenlets
+    from gevent.monkey import get_original
+    from greenlet import getcurrent
+    (_start_thread, _get_ident) = get_original('_thread', ['start_new_thread', 'get_ident'])
+    _sleep = get_original('time', 'sleep')
+except ImportError:
+    (_start_thread, _get_ident, _sleep) = (_thread.start_new_thread, _thread.get_ident, time.sleep)
+
+    def getcurrent():
+        return None
+
+_window_prefix = 'profile.'
+# The profiling window, as last read from the index
+_window = {'until': 0.0, 'rate': 0.0, 'route': '', 'read': 0.0}
+# Requests being sampled in this worker: key -> (thread ID, greenlet)
+_tasks = {}  # type: dict
+# Folded stack -> samples, since they were last flushed to the index
+_samples = collections.Counter()  # type: collections.Counter
+_flushed = {'time': 0.0}
+# The process whose sampler thread is running, if any
+_sampler = {'pid': None}
+
+
+def open_window(seconds, rate=1.0, route=''):
+    """Start profiling `rate` of the requests, or of those to one route, for a number of seconds."""
+    index.clear_profile()
+    values = {'until': time.time() + seconds, 'rate': rate, 'route': route}
+    index.set_values({_window_prefix + key: val for (key, val) in values.items()})
+    _window['read'] = 0.0
+    return values
+
+
+def close_window():
+    """Stop profiling new requests. The samples taken so far are kept."""
+    index.set_values({_window_prefix + 'until': 0})
+    _window['read'] = 0.0
+
+
+def get_window():
+    """Return the profiling window, reading it from the index if it is too old."""
+    now = time.time()
+    if now - _window['read'] >= Config.profile_poll_interval:
+        values = index.get_values(_window_prefix)
+        _window['until'] = float(values.get(_window_prefix + 'until', 0))
+        _window['rate'] = float(values.get(_window_prefix + 'rate', 0))
+        _window['route'] = values.get(_window_prefix + 'route', '')
+        _window['read'] = now
+    return _window
+
+
+def start_request():
+    """Start sampling the current request, if it is picked for the profiling window."""
+    window = get_window()
+    if time.time() >= window['until']:
+        return
+    rule = flask.request.url_rule
+    if window['route'] and window['route'] not in (flask.request.endpoint, rule and rule.rule):
+        return
+    if random.random() >= window['rate']:  # nosec
+        return
+    flask.g.profile_key = track()
+
+
+def finish_request(response):
+    """Stop sampling the current request once its response, including any streamed data, is sent."""
+    key = flask.g.get('profile_key')
+    if key is not None:
+        response.call_on_close(lambda: untrack(key))
+    return response
+
+
+def track():
+    """Sample the stack of the calling thread or greenlet until `untrack` is called. Returns its key."""
+    key = object()
+    _tasks[key] = (_get_ident(), getcurrent())
+    if _sampler['pid'] != os.getpid():
+        _sampler['pid'] = os.getpid()
+        _start_thread(_run, ())
+    return key
+
+
+def untrack(key):
+    _tasks.pop(key, None)
+    if not _tasks or time.time() - _flushed['time'] >= Config.profile_flush_interval:
+        flush()
+
+
+def flush():
+    """Add the samples taken in this worker to the index."""
+    global _samples
+    (samples, _samples) = (_samples, collections.Counter())
+    _flushed['time'] = time.time()
+    index.add_profile_samples(samples)
+
+
+def render():
+    """Return the samples of all workers as folded stacks, one `frame;frame;frame count` per line."""
+    return ''.join('{} {}\n'.format(stack, count) for (stack, count) in index.get_profile())
+
+
+def fold(frame):
+    """Name the functions on a stack, from the outermost to the innermost, separated by semicolons."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        path = os.path.join(*code.co_filename.split(os.sep)[-2:])
+        names.append('{} ({})'.format(code.co_name, path))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _run():
+    """Sample the stacks of the tracked requests, until they are done and the window has closed."""
+    while _tasks or time.time() < _window['until']:
+        _sleep(Config.profile_interval)
+        frames = sys._current_frames()
+        for (thread_id, glet) in list(_tasks.values()):
+            # A greenlet has a frame of its own while it is switched out, and otherwise is running
+            frame = getattr(glet, 'gr_frame', None) or frames.get(thread_id)
+            if frame is not None:
+                _samples[fold(frame)] += 1
+    _sampler['pid'] = None
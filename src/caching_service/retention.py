@@ -0,0 +1,39 @@
+"""Retention policies that decide how long cache entries live."""
+import time
+
+from .config import Config
+
+
+def cache_ttl(size):
+    """Return the number of seconds that a cache file of `size` bytes should be kept."""
+    for (max_size, ttl) in Config.cache_ttl_by_size:
+        if size <= max_size:
+            return ttl
+    return Config.cache_ttl
+
+
+def expiration(ttl, start=None):
+    """Return an expiration timestamp `ttl` seconds from `start` (or now) as a string."""
+    if start is None:
+        start = time.time()
+    # An int is better for serializing than a float
+    return str(int(start + ttl))
+
+
+def tracks_access():
+    """Whether download times need to be recorded for the configured policies."""
+    return bool(Config.sliding_expiration or Config.max_bucket_bytes or Config.cold_bucket)
+
+
+def least_recently_used(entries, total_bytes, max_bytes):
+    """
+    Given a list of (accessed, cache_id, size) for every cache file, pick the least recently used
+    files to remove so that no more than `max_bytes` remain. Returns a list of cache IDs.
+    """
+    evicted = []
+    for (accessed, cache_id, size) in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        evicted.append(cache_id)
+        total_bytes -= size
+    return evicted
@@ -1,20 +1,30 @@
 """The main entrypoint for running the Flask server."""
 import flask
 import os
-import traceback
+import time
 from werkzeug.exceptions import MethodNotAllowed
 from json.decoder import JSONDecodeError
 
 from .api.api_v1 import api_v1
-from .exceptions import MissingHeader, InvalidContentType, UnauthorizedAccess
-from .config import Config
+from .api.peer import peer_api
+from .exceptions import MissingHeader, InvalidContentType, UnauthorizedAccess, Overloaded, BackendUnavailable
+from .config import Config, check_replicas
+from . import health
+from . import log
+from . import metrics
+from . import profiler
+from . import sweeper
+from . import tiering
 
 # Initialize the server
+check_replicas()
 app = flask.Flask(__name__)
 app.config['DEBUG'] = os.environ.get('DEVELOPMENT')
 app.config['SECRET_KEY'] = Config.secret_key
 app.url_map.strict_slashes = False  # allow both `get /v1/` and `get /v1`
 app.register_blueprint(api_v1, url_prefix='/v1')
+app.register_blueprint(peer_api, url_prefix='/internal')
+log.init_logging()
 
 
 @app.route('/', methods=['GET'])
@@ -31,6 +41,26 @@ def root():
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Service metrics in the Prometheus text format."""
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the worker is up and serving requests. This never touches a backend."""
+    return flask.jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the worker can reach Minio, judging by a recent, cached check."""
+    (ready, details) = health.readiness()
+    details['status'] = 'ok' if ready else 'error'
+    return (flask.jsonify(details), 200 if ready else 503)
+
+
 @app.errorhandler(404)
 def page_not_found(err):
     return (flask.jsonify({'status': 'error'}), 404)
@@ -39,11 +69,7 @@ def page_not_found(err):
 @app.errorhandler(Exception)
 def general_exception_handler(err):
     """General exception handler; catch any exception from anywhere."""
-    print('=' * 80)
-    print('500 Unexpected Server Error')
-    print('-' * 80)
-    traceback.print_exc()
-    print('=' * 80)
+    log.log_error()
     result = {'status': 'error', 'error': 'Unexpected server error'}
     return (flask.jsonify(result), 500)
 
@@ -54,6 +80,14 @@ def unauthorized_access(err):
     return (flask.jsonify(result), 403)
 
 
+@app.errorhandler(Overloaded)
+@app.errorhandler(BackendUnavailable)
+def overloaded(err):
+    """There is no room for another transfer, or a backend is down; the client should retry later."""
+    result = {'status': 'error', 'error': str(err)}
+    return (flask.jsonify(result), 503, {'Retry-After': str(err.retry_after)})
+
+
 @app.errorhandler(MethodNotAllowed)
 def method_not_allowed(err):
     """A request has been made to a valid path with an invalid method."""
@@ -76,8 +110,67 @@ def missing_header(err):
     return (flask.jsonify(result), 400)
 
 
+@app.before_request
+def start_request():
+    """Start timing each request and give it an ID."""
+    log.start_request()
+    sweeper.start()
+    tiering.start()
+    profiler.start_request()
+
+
+@app.after_request
+def close_file_responses(response):
+    """
+    Werkzeug hands the file of a send_file response straight to the server, which closes the file
+    but never the response, so that its close callbacks would not run. Closing the file now also
+    closes the response. This is registered first so that it runs after the other hooks.
+    """
+    status = response.status_code
+    passthrough = flask.request.method != 'HEAD' and status >= 200 and status not in (204, 304)
+    if response.direct_passthrough and passthrough:
+        wrapper = response.response
+        attr = 'filelike' if hasattr(wrapper, 'filelike') else 'file'
+        if hasattr(wrapper, attr):
+            setattr(wrapper, attr, _ClosingFile(getattr(wrapper, attr), response))
+    return response
+
+
+class _ClosingFile:
+    """A file that closes the response sending it once it is closed itself."""
+
+    def __init__(self, fd, response):
+        self._fd = fd
+        self._response = response
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._fd, name)
+
+    def close(self):
+        # Closing the response closes its file wrapper, and so this file, again
+        if self._closed:
+            return
+        self._closed = True
+        self._fd.close()
+        self._response.close()
+
+
 @app.after_request
 def log_response(response):
-    """Simple log of each request's response."""
-    print(' '.join([flask.request.method, flask.request.path, '->', response.status]))
+    """Structured log of each request's response."""
+    return log.log_response(response)
+
+
+@app.after_request
+def finish_profile(response):
+    return profiler.finish_request(response)
+
+
+@app.after_request
+def observe_latency(response):
+    """Track response times, including any streamed data, which the background sweeper backs off on."""
+    start_time = flask.g.get('start_time')
+    if start_time is not None:
+        response.call_on_close(lambda: metrics.observe_request(time.time() - start_time))
     return response
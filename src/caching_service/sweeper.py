@@ -0,0 +1,183 @@
+"""
+Continuous background expiry of cache files, as an alternative to running `admin.py expire_all`
+from cron.
+
+When Config.sweeper is set, every worker starts a sweeper thread, but only the one that holds the
+'sweeper' lock in the index does any work; the others stand by in case it stops. The sweeper walks
+the bucket in key order, a page at a time, and removes expired files as it goes. Its cursor is
+kept in the index, so that it carries on where it left off after a restart or a change of worker.
+
+Minio requests are spaced out to stay within Config.sweeper_ops_per_second. While the average
+response time of requests in the worker is above Config.sweeper_latency_target, the rate is cut,
+and it climbs back up once they recover.
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+
+from .config import Config
+from . import exceptions
+from . import index
+from . import log
+from . import metrics
+from . import minio as storage
+
+_lock_name = 'sweeper'
+# Prefix of the sweeper's progress in the key-value store of the index
+_state_prefix = 'sweeper.'
+_counters = ['examined', 'removed', 'passes']
+_pid = None
+
+
+class RateLimiter:
+    """
+    Space out operations to stay within `max_rate` per second. The rate is halved while the
+    latency reported by `latency_fn` is above `target`, and otherwise steps back up.
+    """
+
+    def __init__(self, max_rate, target, latency_fn):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.target = target
+        self.latency_fn = latency_fn
+        self._next = 0.0
+
+    def wait(self, amount=1):
+        """Block until the next operation is allowed, which uses up `amount` of the rate."""
+        if self.latency_fn() > self.target:
+            self.rate = max(self.rate / 2, self.max_rate / 64)
+        else:
+            self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+        now = time.time()
+        if self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(self._next, now) + amount / self.rate
+
+
+def start():
+    """Start the sweeper thread, if enabled. Threads do not survive a fork, so each worker starts its own."""
+    global _pid
+    if not Config.sweeper or _pid == os.getpid():
+        return
+    _pid = os.getpid()
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def _run():
+    holder = uuid.uuid4().hex
+    limiter = RateLimiter(Config.sweeper_ops_per_second, Config.sweeper_latency_target,
+                          metrics.recent_request_latency)
+    while True:
+        try:
+            now = time.time()
+            if index.acquire_lock(_lock_name, holder, now + Config.sweeper_lock_ttl, now):
+                sweep_page(limiter)
+                continue
+        except Exception:
+            log.logger.exception('Sweeper failed')
+        time.sleep(Config.sweeper_lock_ttl / 2)
+
+
+def sweep_page(limiter):
+    """
+    Examine the next page of objects after the saved cursor, removing any that have expired, and
+    save the progress. A page stops early if it takes more than half of the lock's lifetime, so
+    that the lock gets renewed in time.
+    """
+    state = load_state()
+    deadline = time.time() + Config.sweeper_lock_ttl / 2
+    objects = storage.minio_client.list_objects(
+        storage.bucket_name, start_after=state['cursor'] or None, include_user_meta=True
+    )
+    examined = 0
+    for obj in itertools.islice(objects, Config.sweeper_page_size):
+        limiter.wait()
+        state['removed'] += _sweep_object(obj, limiter)
+        state['cursor'] = obj.object_name
+        examined += 1
+        if time.time() > deadline:
+            break
+    else:
+        if examined < Config.sweeper_page_size:
+            _finish_pass(state)
+    state['examined'] += examined
+    state['rate'] = limiter.rate
+    state['updated'] = time.time()
+    index.set_values({_state_prefix + key: val for (key, val) in state.items()})
+
+
+def load_state():
+    """Return the sweeper's saved progress."""
+    values = index.get_values(_state_prefix)
+    state = {key: int(values.get(_state_prefix + key, 0)) for key in _counters}
+    state['cursor'] = values.get(_state_prefix + 'cursor', '')
+    return state
+
+
+def _finish_pass(state):
+    """Wrap around to the start of the bucket, and clean up the index once per pass."""
+    state['removed'] += storage.expire_index_entries(time.time())
+    state['passes'] += 1
+    state['cursor'] = ''
+
+
+def _sweep_object(obj, limiter):
+    """
+    Remove an object if it has expired. Returns the number of objects removed.
+
+    The metadata in the listing may be out of date by the time the sweeper gets to an object, such
+    as for a file that was replaced or downloaded since, so an object that looks expired is looked
+    up again before it is removed.
+    """
+    if obj.is_dir or storage.is_pack(obj.object_name):
+        return 0
+    # Backends other than Minio do not list user metadata
+    if obj.metadata and not _has_expired(obj.metadata.get('X-Amz-Meta-Expiration')):
+        return 0
+    try:
+        expiration = _expiration(obj.object_name, limiter)
+    except exceptions.MissingCache:
+        return 0
+    if not _has_expired(expiration):
+        return 0
+    limiter.wait()
+    storage.minio_client.remove_object(storage.bucket_name, obj.object_name)
+    return 1
+
+
+def _has_expired(expiration):
+    """Whether an expiration has passed. Objects with none should be removed too."""
+    return expiration is None or int(expiration) <= time.time()
+
+
+def _expiration(cache_id, limiter):
+    """Look up the current expiration of an object, or None if it has none."""
+    limiter.wait()
+    try:
+        return storage.get_metadata(cache_id).get('expiration')
+    except KeyError:
+        return None
+
+
+@metrics.collector
+def collect_metrics():
+    if not Config.sweeper:
+        return []
+    values = index.get_values(_state_prefix)
+
+    def sample(key):
+        return [({}, float(values.get(_state_prefix + key, 0)))]
+    return [
+        ('cache_sweeper_examined_total', 'counter', 'Objects examined by the background sweeper.',
+         sample('examined')),
+        ('cache_sweeper_removed_total', 'counter', 'Expired cache entries removed by the background sweeper.',
+         sample('removed')),
+        ('cache_sweeper_passes_total', 'counter', 'Complete passes of the background sweeper over the bucket.',
+         sample('passes')),
+        ('cache_sweeper_rate', 'gauge', 'Minio requests per second currently allowed to the background sweeper.',
+         sample('rate')),
+        ('cache_sweeper_updated_timestamp_seconds', 'gauge', 'Time when the background sweeper last saved progress.',
+         sample('updated')),
+    ]
@@ -0,0 +1,191 @@
+"""
+Background tiering of cache files between the main bucket and a cheaper cold tier.
+
+When Config.cold_bucket is set, every worker starts a mover thread, but as with the sweeper, only
+the one that holds the 'tiering' lock in the index does any work. The mover walks the main bucket
+in key order, a page at a time, and moves the contents of cache files of at least
+Config.cold_min_size bytes that have not been downloaded for Config.cold_after seconds into the
+cold tier. Each one leaves an empty stub behind that keeps its metadata, so that lookups still
+find it and downloads recall it from the cold tier. With Config.cold_promote, the files that get
+downloaded from the cold tier are queued up, and the mover moves them back.
+
+The mover also walks the cold tier, and removes the copies that no cache file refers to any
+longer, such as those of files that have expired, been deleted, or been promoted.
+
+Copies are spaced out to stay within Config.tiering_bytes_per_second, and lookups within
+Config.sweeper_ops_per_second. Both back off on the response times of requests, like the sweeper.
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+
+from .config import Config
+from . import exceptions
+from . import index
+from . import log
+from . import metrics
+from . import minio as storage
+from .sweeper import RateLimiter
+
+_lock_name = 'tiering'
+# Prefix of the mover's progress in the key-value store of the index
+_state_prefix = 'tiering.'
+_counters = ['examined', 'demoted', 'demoted_bytes', 'promoted', 'promoted_bytes', 'collected', 'passes']
+_pid = None
+
+
+def start():
+    """Start the mover thread, if enabled. Threads do not survive a fork, so each worker starts its own."""
+    global _pid
+    if not Config.cold_bucket or _pid == os.getpid():
+        return
+    _pid = os.getpid()
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def _run():
+    holder = uuid.uuid4().hex
+    copies = RateLimiter(Config.tiering_bytes_per_second, Config.sweeper_latency_target,
+                         metrics.recent_request_latency)
+    lookups = RateLimiter(Config.sweeper_ops_per_second, Config.sweeper_latency_target,
+                          metrics.recent_request_latency)
+    while True:
+        try:
+            now = time.time()
+            if index.acquire_lock(_lock_name, holder, now + Config.sweeper_lock_ttl, now):
+                move_page(copies, lookups)
+                continue
+        except Exception:
+            log.logger.exception('Tiering mover failed')
+        time.sleep(Config.sweeper_lock_ttl / 2)
+
+
+def move_page(copies, lookups):
+    """
+    Promote the cache files that are queued up for it, examine the next page of objects in each
+    tier, and save the progress. A page stops early if it takes more than half of the lock's
+    lifetime, so that the lock gets renewed in time.
+    """
+    state = load_state()
+    deadline = time.time() + Config.sweeper_lock_ttl / 2
+    _promote_queued(state, copies, deadline)
+    _demote_page(state, copies, deadline)
+    _collect_page(state, lookups, deadline)
+    state['rate'] = copies.rate
+    state['updated'] = time.time()
+    index.set_values({_state_prefix + key: val for (key, val) in state.items()})
+
+
+def load_state():
+    """Return the mover's saved progress."""
+    values = index.get_values(_state_prefix)
+    state = {key: int(values.get(_state_prefix + key, 0)) for key in _counters}
+    for key in ['cursor', 'cold_cursor']:
+        state[key] = values.get(_state_prefix + key, '')
+    return state
+
+
+def _promote_queued(state, copies, deadline):
+    for cache_id in index.get_promotions(Config.sweeper_page_size):
+        try:
+            moved = storage.promote_cache(cache_id)
+        except exceptions.MissingCache:
+            moved = 0
+        index.remove_promotions([cache_id])
+        state['promoted'] += bool(moved)
+        state['promoted_bytes'] += moved
+        copies.wait(moved)
+        if time.time() > deadline:
+            break
+
+
+def _demote_page(state, copies, deadline):
+    """Move the cache files in the next page of the main bucket that have gone cold."""
+    cutoff = time.time() - Config.cold_after
+    objects = storage.minio_client.list_objects(
+        storage.bucket_name, start_after=state['cursor'] or None, include_user_meta=True
+    )
+    examined = 0
+    for obj in itertools.islice(objects, Config.sweeper_page_size):
+        if is_candidate(obj, cutoff):
+            copies.wait(obj.size)
+            moved = _demote(obj.object_name, cutoff)
+            state['demoted'] += bool(moved)
+            state['demoted_bytes'] += moved
+        state['cursor'] = obj.object_name
+        examined += 1
+        if time.time() > deadline:
+            break
+    else:
+        if examined < Config.sweeper_page_size:
+            state['passes'] += 1
+            state['cursor'] = ''
+    state['examined'] += examined
+
+
+def is_candidate(obj, cutoff):
+    """
+    Whether an object from list_objects is a cache file that is big enough to move and, going by
+    the listing, has not been downloaded since the cutoff time. Stubs have no size, so they are
+    never candidates.
+    """
+    if obj.is_dir or storage.is_pack(obj.object_name) or not obj.size or obj.size < Config.cold_min_size:
+        return False
+    # Backends other than Minio do not list user metadata, which demote_cache checks again anyway
+    accessed = (obj.metadata or {}).get('X-Amz-Meta-Accessed')
+    return int(accessed or obj.last_modified.timestamp()) < cutoff
+
+
+def _demote(cache_id, cutoff):
+    try:
+        return storage.demote_cache(cache_id, cutoff)
+    except exceptions.MissingCache:
+        return 0
+
+
+def _collect_page(state, lookups, deadline):
+    """Remove the objects in the next page of the cold tier that no cache file refers to."""
+    cutoff = time.time() - Config.cold_grace
+    objects = storage.cold_client.list_objects(storage.cold_bucket_name, start_after=state['cold_cursor'] or None)
+    examined = 0
+    for obj in itertools.islice(objects, Config.sweeper_page_size):
+        lookups.wait()
+        if storage.is_cold_orphan(obj, cutoff):
+            storage.cold_client.remove_object(storage.cold_bucket_name, obj.object_name)
+            state['collected'] += 1
+        state['cold_cursor'] = obj.object_name
+        examined += 1
+        if time.time() > deadline:
+            break
+    else:
+        if examined < Config.sweeper_page_size:
+            state['cold_cursor'] = ''
+
+
+@metrics.collector
+def collect_metrics():
+    if not Config.cold_bucket:
+        return []
+    values = index.get_values(_state_prefix)
+
+    def sample(key):
+        return [({}, float(values.get(_state_prefix + key, 0)))]
+    return [
+        ('cache_tiering_examined_total', 'counter', 'Objects in the main bucket examined by the tiering mover.',
+         sample('examined')),
+        ('cache_tiering_demoted_total', 'counter', 'Cache files moved to the cold tier.', sample('demoted')),
+        ('cache_tiering_demoted_bytes_total', 'counter', 'Bytes moved to the cold tier.', sample('demoted_bytes')),
+        ('cache_tiering_promoted_total', 'counter', 'Cache files moved back from the cold tier.',
+         sample('promoted')),
+        ('cache_tiering_promoted_bytes_total', 'counter', 'Bytes moved back from the cold tier.',
+         sample('promoted_bytes')),
+        ('cache_tiering_collected_total', 'counter', 'Unused objects removed from the cold tier.',
+         sample('collected')),
+        ('cache_tiering_passes_total', 'counter', 'Complete passes of the tiering mover over the main bucket.',
+         sample('passes')),
+        ('cache_tiering_rate', 'gauge', 'Bytes per second currently allowed to the tiering mover.', sample('rate')),
+        ('cache_tiering_updated_timestamp_seconds', 'gauge', 'Time when the tiering mover last saved progress.',
+         sample('updated')),
+    ]
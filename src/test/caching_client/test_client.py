@@ -0,0 +1,169 @@
+"""
+Tests for the python client.
+
+The tests at the bottom make actual requests to the running docker containers.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from uuid import uuid4
+
+from src.caching_client.client import CacheClient, _MultipartFile
+from src.caching_service.generate_cache_id import generate_cache_id
+
+url = 'http://web:5000/v1'
+auth_url = 'http://auth:5000'
+
+
+class TestClientOffline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache_id_matches_server(self):
+        """Cache IDs computed by the client are identical to the server's."""
+        token_id = auth_url + ':username'
+        client = CacheClient(url, 'non_admin_token', auth_url, token_id=token_id)
+        params = {'method': 'xyz', 'params': {'b': 1, 'a': [1, 2]}}
+        self.assertEqual(client.cache_id(params), generate_cache_id(token_id, params))
+
+    def test_multipart_body(self):
+        """The streamed multipart body has a correct length and contains the file."""
+        path = os.path.join(self.tmp_dir, 'test.json')
+        content = os.urandom(100000)
+        with open(path, 'wb') as fd:
+            fd.write(content)
+        body = _MultipartFile(path, 'test.json')
+        data = b''
+        while True:
+            chunk = body.read(8192)
+            if not chunk:
+                break
+            data += chunk
+        body.close()
+        self.assertEqual(len(data), len(body))
+        self.assertTrue(content in data)
+        self.assertTrue(data.endswith(('--' + body.boundary + '--\r\n').encode()))
+
+    def test_local_cache_hit(self):
+        """A result in the local cache is found without contacting the server."""
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        # Nothing listens on this port, so any network request would fail
+        client = CacheClient('http://127.0.0.1:9', 'token', auth_url, token_id='x:y',
+                             local_cache_dir=cache_dir, retries=0)
+        cache_id = client.cache_id({'xyz': 123})
+        with open(os.path.join(cache_dir, cache_id), 'wb') as fd:
+            fd.write(b'contents')
+        self.assertTrue(client.exists(cache_id))
+        dest = os.path.join(self.tmp_dir, 'dest')
+        self.assertEqual(client.download(cache_id, dest), dest)
+        with open(dest, 'rb') as fd:
+            self.assertEqual(fd.read(), b'contents')
+
+    def test_resume_if_range(self):
+        """A resumed download asks for a range only if the file still has the first response's ETag."""
+        client = CacheClient(url, 'token', auth_url, token_id='x:y')
+        client.session = _FakeSession([(200, '"v1"', b'abc'), (206, '"v1"', b'def'), (200, '"v2"', b'new')])
+        partial = os.path.join(self.tmp_dir, 'file.part')
+        validator = {}
+        client._download_range('cid', partial, validator)
+        client._download_range('cid', partial, validator)
+        self.assertEqual(client.session.requests[1], {'Range': 'bytes=3-', 'If-Range': '"v1"'})
+        with open(partial, 'rb') as fd:
+            self.assertEqual(fd.read(), b'abcdef')
+        # The file was replaced, so the server sent all of the new one instead of a range
+        client._download_range('cid', partial, validator)
+        with open(partial, 'rb') as fd:
+            self.assertEqual(fd.read(), b'new')
+
+
+class _FakeSession:
+    """Answers GET requests with a list of (status, etag, body), recording the request headers."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, headers, **kwargs):
+        self.requests.append(headers)
+        (status, etag, body) = self.responses[len(self.requests) - 1]
+        return _FakeResponse(status, etag, body)
+
+
+class _FakeResponse:
+
+    def __init__(self, status, etag, body):
+        self.status_code = status
+        self.headers = {'ETag': etag}
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, size):
+        return [self.body]
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.client = CacheClient(url, 'non_admin_token', auth_url)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_upload_download_delete(self):
+        """Upload, check, download, and delete a file using only its identifying params."""
+        params = {'xyz': str(uuid4())}
+        cache_id = self.client.cache_id(params)
+        self.assertFalse(self.client.exists(cache_id))
+        path = os.path.join(self.tmp_dir, 'test.json')
+        with open(path, 'wb') as fd:
+            fd.write(b'{"hallo": "welt"}')
+        self.client.put(params, path)
+        self.assertTrue(self.client.exists(cache_id))
+        dest = os.path.join(self.tmp_dir, 'dest.json')
+        self.assertEqual(self.client.get(params, dest), dest)
+        with open(dest, 'rb') as fd:
+            self.assertEqual(fd.read(), b'{"hallo": "welt"}')
+        self.client.delete(cache_id)
+        self.assertFalse(self.client.exists(cache_id))
+
+    def test_invalidate(self):
+        """Register cache IDs with a tag, and then delete them all at once."""
+        tag = 'ref:' + str(uuid4())
+        cache_ids = [self.client.register({'xyz': str(uuid4())}, tags=[tag]) for _ in range(2)]
+        seen = []
+        progress = self.client.invalidate(tag, on_progress=seen.append)
+        self.assertEqual(progress, {'status': 'ok', 'total': 2, 'deleted': 2, 'missing': 0, 'errors': 0})
+        self.assertEqual(seen[-1], progress)
+        for cache_id in cache_ids:
+            self.assertEqual(self.client.session.head(url + '/cache/' + cache_id).status_code, 404)
+
+    def test_download_missing(self):
+        """Downloading a missing cache returns None."""
+        cache_id = self.client.cache_id({'xyz': str(uuid4())})
+        self.assertEqual(self.client.download(cache_id, os.path.join(self.tmp_dir, 'x')), None)
+
+    def test_upload_in_parts(self):
+        """Upload a file through a resumable upload session, in two parts."""
+        part_size = 5 * 1024 * 1024
+        params = {'xyz': str(uuid4())}
+        cache_id = self.client.register(params)
+        path = os.path.join(self.tmp_dir, 'large.bin')
+        content = os.urandom(part_size + 100)
+        with open(path, 'wb') as fd:
+            fd.write(content)
+        self.client.upload_in_parts(cache_id, path, part_size=part_size)
+        dest = os.path.join(self.tmp_dir, 'dest.bin')
+        self.client.download(cache_id, dest)
+        with open(dest, 'rb') as fd:
+            self.assertEqual(fd.read(), content)
@@ -0,0 +1,39 @@
+"""Setup shared by the tests of the caching service."""
+import os
+import shutil
+import tempfile
+
+from src.caching_service import index
+from src.caching_service.config import Config
+
+
+class ConfigMixin:
+    """
+    Mix into a TestCase to put back every Config setting that its tests change. With `temp_index`
+    set, each test also gets an empty local index in a temporary directory.
+    """
+
+    temp_index = False
+
+    def setUp(self):
+        super().setUp()
+        self._orig_config = {key: val for (key, val) in vars(Config).items() if not key.startswith('__')}
+        if self.temp_index:
+            self.index_dir = tempfile.mkdtemp()
+            Config.index_path = os.path.join(self.index_dir, 'index.db')
+            _close_index()
+
+    def tearDown(self):
+        for (key, val) in self._orig_config.items():
+            setattr(Config, key, val)
+        if self.temp_index:
+            _close_index()
+            shutil.rmtree(self.index_dir)
+        super().tearDown()
+
+
+def _close_index():
+    """Close this process's connection to the index, so that the next use opens Config.index_path."""
+    if index._conn is not None:
+        index._conn.close()
+    index._conn = None
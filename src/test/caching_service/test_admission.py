@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+import unittest
+import flask
+
+from src.caching_service import admission
+from src.caching_service import exceptions
+from src.caching_service import index
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+app = flask.Flask(__name__)
+
+
+class TestAdmission(ConfigMixin, unittest.TestCase):
+
+    temp_index = True
+
+    def setUp(self):
+        super().setUp()
+        Config.admission_refresh_interval = 0
+
+    def admit(self, size):
+        with app.test_request_context():
+            return admission.admit(size)
+
+    def test_transfer_limit(self):
+        """Transfers beyond the worker's limit are rejected until one finishes."""
+        Config.max_worker_transfers = 2
+        tickets = [self.admit(10), self.admit(10)]
+        with self.assertRaises(exceptions.Overloaded):
+            self.admit(10)
+        admission.release(tickets.pop())
+        tickets.append(self.admit(10))
+        for ticket in tickets:
+            admission.release(ticket)
+
+    def test_byte_limit(self):
+        """Bytes in flight count against the limit, but a single large transfer is let through."""
+        Config.max_worker_transfer_bytes = 100
+        ticket = self.admit(500)
+        with self.assertRaises(exceptions.Overloaded):
+            self.admit(1)
+        admission.release(ticket)
+        ticket = self.admit(60)
+        with self.assertRaises(exceptions.Overloaded):
+            self.admit(50)
+        admission.release(ticket)
+
+    def test_other_workers(self):
+        """Transfers in other running workers count toward the host's limit; exited ones do not."""
+        Config.max_transfers = 2
+        index.set_transfers(os.getppid(), 0, 2, 0)
+        with self.assertRaises(exceptions.Overloaded):
+            self.admit(0)
+        # No process has this ID
+        index.set_transfers(2 ** 22 + 1, 0, 2, 0)
+        index.set_transfers(os.getppid(), 0, 1, 0)
+        admission.release(self.admit(0))
+        self.assertEqual([row[0] for row in index.get_transfers()].count(2 ** 22 + 1), 0)
+
+    def test_queue(self):
+        """A transfer over a limit waits for another one to finish, if allowed to."""
+        Config.max_worker_transfers = 1
+        Config.admission_wait = 5
+        ticket = self.admit(0)
+        timer = threading.Timer(0.2, lambda: admission.release(ticket))
+        timer.start()
+        start = time.time()
+        admission.release(self.admit(0))
+        self.assertTrue(0.1 < time.time() - start < 5)
+
+    def test_publish(self):
+        """A worker's transfers are written to the index in batches, rather than on every change."""
+        Config.max_worker_transfers = 10
+        tickets = [self.admit(10), self.admit(20)]
+        admission._published.flush()
+        self.assertEqual([row[1:3] for row in index.get_transfers() if row[0] == os.getpid()], [(30, 2)])
+        for ticket in tickets:
+            admission.release(ticket)
+        admission._published.flush()
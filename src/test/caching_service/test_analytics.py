@@ -0,0 +1,43 @@
+import time
+import unittest
+
+from src.caching_service import analytics
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class TestAnalytics(ConfigMixin, unittest.TestCase):
+
+    temp_index = True
+
+    def setUp(self):
+        super().setUp()
+        Config.analytics = True
+
+    def test_report(self):
+        """Test counting hits and misses in batches, and reporting hit ratios and the compute time saved."""
+        expiration = int(time.time()) + 100
+        metadata = {'token_id': 'url:a', 'expiration': str(expiration)}
+        analytics.record_miss('cid1', metadata)
+        analytics.record_compute('cid1', metadata, 1800)
+        for _ in range(3):
+            analytics.record_hit('cid1', metadata)
+        analytics.flush()
+        # Later batches add to the counts, and keep the compute time
+        analytics.record_hit('cid1', metadata)
+        analytics.record_miss('cid2', metadata)
+        analytics.record_miss('cid3', {'token_id': 'url:b', 'expiration': str(expiration)})
+        analytics.flush()
+        report = analytics.report(limit=1)
+        self.assertEqual(report['total'], {'hits': 4, 'misses': 3, 'hit_ratio': 0.5714, 'hours_saved': 2.0})
+        self.assertEqual(report['tokens'], [
+            {'token_id': 'url:a', 'hits': 4, 'misses': 2, 'hit_ratio': 0.6667, 'hours_saved': 2.0}
+        ])
+        self.assertEqual(report['entries'], [
+            {'cache_id': 'cid1', 'token_id': 'url:a', 'hits': 4, 'misses': 1, 'hit_ratio': 0.8, 'hours_saved': 2.0}
+        ])
+        # Counts are kept for a while after their entries expire
+        analytics.remove_expired(expiration + 1)
+        self.assertEqual(analytics.report()['total']['misses'], 3)
+        analytics.remove_expired(expiration + Config.analytics_retention + 1)
+        self.assertEqual(analytics.report()['total'], {'hits': 0, 'misses': 0, 'hit_ratio': None, 'hours_saved': 0})
@@ -7,6 +7,10 @@ import unittest
 import requests
 from uuid import uuid4
 import functools
+import io
+import json
+import tarfile
+import time
 
 import src.caching_service.minio as minio
 from src.caching_service.exceptions import MissingCache
@@ -53,6 +57,18 @@ class TestApiV1(unittest.TestCase):
         # Don't particularly feel the need to test the content of this
         self.assertTrue(json['routes'])
 
+    def test_health(self):
+        """The liveness and readiness endpoints respond without a token."""
+        base_url = url.rsplit('/v1', 1)[0]
+        resp = requests.get(base_url + '/healthz')
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(base_url + '/readyz')
+        self.assertEqual(resp.status_code, 200)
+        json = resp.json()
+        self.assertEqual(json['status'], 'ok')
+        self.assertTrue(json['minio']['healthy'])
+        self.assertEqual(json['breakers']['minio'], 'closed')
+
     def test_missing_auth(self):
         """Test the error response for all endpoints that require the Authentication header."""
         endpoints = [
@@ -192,6 +208,51 @@ class TestApiV1(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.content, content)
 
+    def test_download_large_cache_file(self):
+        """
+        Test streaming a file that is large enough to be read from Minio in concurrent ranges,
+        in whole and in part (the server's RANGED_DOWNLOAD_MIN is set to 1MiB for the tests).
+
+        GET /cache/<cache_id>
+        """
+        content = bytes(range(256)) * 8192
+        (cache_id, _) = upload_cache('{"large": "%s"}' % uuid4(), content)
+        headers = {'Authorization': 'non_admin_token'}
+        resp = requests.get(url + '/cache/' + cache_id, headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, content)
+        etag = resp.headers['ETag']
+        ranged = dict(headers, Range='bytes=1000000-', **{'If-Range': etag})
+        resp = requests.get(url + '/cache/' + cache_id, headers=ranged)
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.headers['Content-Range'], 'bytes 1000000-2097151/2097152')
+        self.assertEqual(resp.content, content[1000000:])
+        # Several ranges get the whole file, and only a single unsatisfiable range gets a 416
+        resp = requests.get(url + '/cache/' + cache_id, headers=dict(headers, Range='bytes=0-1,5-9'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, content)
+        resp = requests.get(url + '/cache/' + cache_id, headers=dict(headers, Range='bytes=3000000-'))
+        self.assertEqual(resp.status_code, 416)
+
+    def test_download_etag(self):
+        """
+        Test that small downloads have the file's ETag from HEAD requests, so that they can be
+        resumed with If-Range.
+
+        GET /cache/<cache_id>
+        """
+        (cache_id, content) = upload_cache('{"etag": "%s"}' % uuid4())
+        headers = {'Authorization': 'non_admin_token'}
+        etag = requests.head(url + '/cache/' + cache_id, headers=headers).headers['ETag']
+        for _ in range(2):
+            resp = requests.get(url + '/cache/' + cache_id, headers=headers)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['ETag'], etag)
+        ranged = dict(headers, Range='bytes=5-', **{'If-Range': etag})
+        resp = requests.get(url + '/cache/' + cache_id, headers=ranged)
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, content[5:])
+
     def test_download_cache_file_unauthorized_cache(self):
         """
         Test a call to download a cache file that was made by a different token ID
@@ -225,6 +286,181 @@ class TestApiV1(unittest.TestCase):
         self.assertEqual(json['status'], 'error')
         self.assertTrue('not found' in json['error'])
 
+    def test_head_cache_file_valid(self):
+        """
+        Test a HEAD request on an existing cache file.
+
+        HEAD /cache/<cache_id>
+        """
+        (cache_id, content) = upload_cache('{"head": "%s"}' % uuid4())
+        resp = requests.head(
+            url + '/cache/' + cache_id,
+            headers={'Authorization': 'non_admin_token'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b'')
+        self.assertEqual(resp.headers['Content-Length'], str(len(content)))
+        self.assertEqual(resp.headers['X-Cache-Filename'], 'test.json')
+        self.assertEqual(resp.headers['X-Cache-Placeholder'], 'false')
+        self.assertTrue(resp.headers['ETag'])
+
+    def test_head_cache_file_placeholder(self):
+        """
+        Test a HEAD request on a cache ID that has no file yet.
+
+        HEAD /cache/<cache_id>
+        """
+        cache_id = get_cache_id('{"placeholder": "head"}')
+        resp = requests.head(
+            url + '/cache/' + cache_id,
+            headers={'Authorization': 'non_admin_token'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['X-Cache-Placeholder'], 'true')
+
+    def test_head_cache_file_missing_cache(self):
+        """
+        Test a HEAD request on a cache ID that does not exist.
+
+        HEAD /cache/<cache_id>
+        """
+        resp = requests.head(
+            url + '/cache/' + str(uuid4()),
+            headers={'Authorization': 'non_admin_token'}
+        )
+        self.assertEqual(resp.status_code, 404)
+
+    def test_cache_metadata_valid(self):
+        """
+        Test fetching the metadata of an existing cache file.
+
+        GET /cache/<cache_id>/meta
+        """
+        (cache_id, content) = upload_cache('{"meta": "%s"}' % uuid4())
+        resp = requests.get(
+            url + '/cache/' + cache_id + '/meta',
+            headers={'Authorization': 'non_admin_token'}
+        )
+        json = resp.json()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json['status'], 'ok')
+        self.assertEqual(json['metadata']['size'], len(content))
+        self.assertEqual(json['metadata']['filename'], 'test.json')
+        self.assertEqual(json['metadata']['placeholder'], False)
+        self.assertTrue(json['metadata']['etag'])
+
+    def test_cache_metadata_unauthorized_cache(self):
+        """
+        Test fetching the metadata of a cache file made by a different token ID.
+
+        GET /cache/<cache_id>/meta
+        """
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, 'test_user')
+        resp = requests.get(
+            url + '/cache/' + cache_id + '/meta',
+            headers={'Authorization': 'non_admin_token'}
+        )
+        json = resp.json()
+        self.assertEqual(resp.status_code, 403)
+        self.assertTrue('You do not have access' in json['error'])
+
+    def test_list_caches(self):
+        """
+        Test listing the caller's cache entries a page at a time.
+
+        GET /caches
+        """
+        (cache_id, content) = upload_cache('{"list": "%s"}' % uuid4())
+        headers = {'Authorization': 'non_admin_token'}
+        (found, cursor) = ({}, None)
+        while True:
+            resp = requests.get(url + '/caches', headers=headers, params={'limit': 50, 'cursor': cursor or ''})
+            self.assertEqual(resp.status_code, 200)
+            json = resp.json()
+            self.assertTrue(len(json['caches']) <= 50)
+            found.update((entry['cache_id'], entry) for entry in json['caches'])
+            cursor = json['cursor']
+            if not cursor:
+                break
+        self.assertEqual(found[cache_id]['filename'], 'test.json')
+        self.assertEqual(found[cache_id]['size'], len(content))
+        self.assertFalse(found[cache_id]['placeholder'])
+        requests.delete(url + '/cache/' + cache_id, headers=headers)
+        resp = requests.get(url + '/caches', headers=headers, params={'cursor': cache_id[:-1]})
+        self.assertTrue(cache_id not in [entry['cache_id'] for entry in resp.json()['caches']])
+
+    def test_storage_usage(self):
+        """
+        Test the report of the files and bytes stored by each token.
+
+        GET /admin/usage
+        """
+        upload_cache('{"usage": "%s"}' % uuid4())
+        resp = requests.get(url + '/admin/usage', headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.status_code, 403)
+        resp = requests.get(url + '/admin/usage', headers={'Authorization': 'admin_token'}, params={'limit': 1000})
+        self.assertEqual(resp.status_code, 200)
+        json = resp.json()
+        usage = {entry['token_id'].split(':')[-1]: entry for entry in json['usage']}
+        self.assertTrue(usage['username']['objects'] >= 1)
+        self.assertEqual(json['total']['bytes'], sum(entry['bytes'] for entry in json['usage']))
+
+    def test_analytics(self):
+        """
+        Test counting the hits of an entry uploaded with its compute time, and reporting the time saved.
+
+        GET /admin/analytics
+        """
+        cache_id = get_cache_id('{"analytics": "%s"}' % uuid4())
+        headers = {'Authorization': 'non_admin_token', 'X-Compute-Duration': 'soon'}
+        resp = requests.post(url + '/cache/' + cache_id, headers=headers, files={'file': ('test.json', b'x')})
+        self.assertEqual(resp.status_code, 400)
+        headers['X-Compute-Duration'] = '7200'
+        resp = requests.post(url + '/cache/' + cache_id, headers=headers, files={'file': ('test.json', b'x')})
+        self.assertEqual(resp.status_code, 200)
+        requests.get(url + '/cache/' + cache_id, headers={'Authorization': 'non_admin_token'})
+        resp = requests.get(url + '/admin/analytics', headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.status_code, 403)
+        # Counts are written to the index every ANALYTICS_FLUSH_INTERVAL seconds
+        time.sleep(2)
+        resp = requests.get(url + '/admin/analytics', headers={'Authorization': 'admin_token'})
+        self.assertEqual(resp.status_code, 200)
+        total = resp.json()['total']
+        self.assertTrue(total['hits'] >= 1 and total['misses'] >= 1)
+        self.assertTrue(total['hours_saved'] >= 2)
+
+    def test_shared_namespace(self):
+        """
+        Test that every token gets the same cache ID in a namespace, which only its writers may
+        register and upload to, and all of its readers may download from.
+
+        POST /cache_id
+        """
+        params = json.dumps({'shared': str(uuid4())})
+        reader = {'Authorization': 'non_admin_token', 'X-Cache-Namespace': 'shared'}
+        writer = {'Authorization': 'admin_token', 'X-Cache-Namespace': 'shared'}
+        resp = requests.post(url + '/cache_id', headers=dict(reader, **{'Content-Type': 'application/json'}),
+                             data=params)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['metadata'], None, 'Readers do not register cache IDs')
+        cache_id = resp.json()['cache_id']
+        resp = requests.post(url + '/cache_id', headers=dict(writer, **{'Content-Type': 'application/json'}),
+                             data=params)
+        self.assertEqual(resp.json()['cache_id'], cache_id)
+        self.assertEqual(resp.json()['metadata']['token_id'], 'namespace:shared')
+        resp = requests.post(url + '/cache/' + cache_id, headers=reader, files={'file': ('test.json', b'x')})
+        self.assertEqual(resp.status_code, 403)
+        resp = requests.post(url + '/cache/' + cache_id, headers=writer, files={'file': ('test.json', b'shared')})
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(url + '/cache/' + cache_id, headers=reader)
+        self.assertEqual(resp.content, b'shared')
+        self.assertEqual(requests.delete(url + '/cache/' + cache_id, headers=reader).status_code, 403)
+        resp = requests.post(url + '/cache_id', data=params,
+                             headers={'Authorization': 'non_admin_token', 'Content-Type': 'application/json',
+                                      'X-Cache-Namespace': 'missing'})
+        self.assertEqual(resp.status_code, 400)
+
     def test_upload_cache_file_valid(self):
         """
         Test a call to upload a cache file successfully.
@@ -294,6 +530,60 @@ class TestApiV1(unittest.TestCase):
         self.assertEqual(json['status'], 'error', 'Status is set to "error"')
         self.assertTrue('missing' in json['error'])
 
+    def test_put_cache_file_valid(self):
+        """
+        Test uploading a cache file as a raw body, then downloading it.
+
+        PUT /cache/<cache_id>
+        """
+        cache_id = get_cache_id('{"put": "%s"}' % uuid4())
+        content = b'{"hallo": "raw"}'
+        headers = {
+            'Authorization': 'non_admin_token',
+            'Content-Type': 'application/octet-stream',
+            'X-Cache-Filename': 'test.json'
+        }
+        resp = requests.put(url + '/cache/' + cache_id, headers=headers, data=content)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['status'], 'ok')
+        resp = requests.get(url + '/cache/' + cache_id, headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.content, content)
+        resp = requests.head(url + '/cache/' + cache_id, headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.headers['X-Cache-Filename'], 'test.json')
+
+    def test_put_cache_file_chunked(self):
+        """
+        Test uploading a cache file as a raw body of unknown length.
+
+        PUT /cache/<cache_id>
+        """
+        cache_id = get_cache_id('{"chunked": "%s"}' % uuid4())
+        chunks = [b'x' * 100000, b'y' * 100000]
+        headers = {
+            'Authorization': 'non_admin_token',
+            'Content-Type': 'application/octet-stream',
+            'X-Cache-Filename': 'test.bin'
+        }
+        resp = requests.put(url + '/cache/' + cache_id, headers=headers, data=iter(chunks))
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(url + '/cache/' + cache_id, headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.content, b''.join(chunks))
+
+    def test_put_cache_file_missing_filename(self):
+        """
+        Test a raw upload without the filename header.
+
+        PUT /cache/<cache_id>
+        """
+        cache_id = get_cache_id()
+        resp = requests.put(
+            url + '/cache/' + cache_id,
+            headers={'Authorization': 'non_admin_token', 'Content-Type': 'application/octet-stream'},
+            data=b'xyz'
+        )
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue('X-Cache-Filename' in resp.json()['error'])
+
     def test_delete_valid(self):
         """
         Test a valid deletion of a cache entry.
@@ -344,3 +634,238 @@ class TestApiV1(unittest.TestCase):
         self.assertEqual(resp.status_code, 404, 'Status code is 404')
         self.assertEqual(json['status'], 'error', 'Status is set to "error"')
         self.assertTrue('not found' in json['error'])
+
+    def test_delete_tag(self):
+        """
+        Test deleting all of the entries that have a tag, with progress streamed as lines of JSON.
+
+        DELETE /tags/<tag>
+        """
+        tag = 'method:foo@' + str(uuid4())
+        headers = {'Authorization': 'non_admin_token', 'Content-Type': 'application/json', 'X-Cache-Tags': tag}
+        cache_ids = [
+            requests.post(url + '/cache_id', headers=headers, data='{"tagged": %d}' % num).json()['cache_id']
+            for num in range(3)
+        ]
+        untagged = get_cache_id()
+        resp = requests.delete(url + '/tags/' + tag, headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.status_code, 200)
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        self.assertEqual(lines[-1], {'status': 'ok', 'total': 3, 'deleted': 3, 'missing': 0, 'errors': 0})
+        for cache_id in cache_ids:
+            with self.assertRaises(MissingCache):
+                minio.get_metadata(cache_id)
+        minio.get_metadata(untagged)
+        # The tag is gone along with its entries
+        resp = requests.delete(url + '/tags/' + tag, headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(json.loads(resp.text), {'status': 'ok', 'total': 0, 'deleted': 0, 'missing': 0, 'errors': 0})
+
+    def test_upload_session_valid(self):
+        """
+        Test a resumable upload sent in two parts, out of order.
+
+        POST /cache/<cache_id>/uploads
+        PUT /cache/<cache_id>/uploads/<upload_id>/<part_number>
+        GET /cache/<cache_id>/uploads/<upload_id>
+        POST /cache/<cache_id>/uploads/<upload_id>/complete
+        """
+        cache_id = get_cache_id('{"upload": "session"}')
+        headers = {'Authorization': 'non_admin_token'}
+        resp = requests.post(
+            url + '/cache/' + cache_id + '/uploads',
+            headers={'Authorization': 'non_admin_token', 'X-Cache-Filename': 'parts.bin'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        session_url = url + '/cache/' + cache_id + '/uploads/' + resp.json()['upload_id']
+        # Every part but the last must be at least 5MiB
+        part1 = b'x' * (5 * 1024 * 1024)
+        part2 = b'yz'
+        resp = requests.put(session_url + '/2', headers=headers, data=part2)
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.put(session_url + '/1', headers=headers, data=part1)
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(session_url, headers=headers)
+        parts = resp.json()['parts']
+        self.assertEqual([part['part_number'] for part in parts], [1, 2])
+        resp = requests.post(session_url + '/complete', headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(url + '/cache/' + cache_id, headers=headers)
+        self.assertEqual(resp.content, part1 + part2)
+
+    def test_upload_session_missing(self):
+        """
+        Test uploading a part to a session that does not exist.
+
+        PUT /cache/<cache_id>/uploads/<upload_id>/<part_number>
+        """
+        cache_id = get_cache_id()
+        resp = requests.put(
+            url + '/cache/' + cache_id + '/uploads/xyz/1',
+            headers={'Authorization': 'non_admin_token'},
+            data=b'xyz'
+        )
+        json = resp.json()
+        self.assertEqual(resp.status_code, 404)
+        self.assertTrue('Unknown upload ID' in json['error'])
+
+    def test_upload_session_unauthorized_cache(self):
+        """
+        Test starting a resumable upload to a cache made by a different token ID.
+
+        POST /cache/<cache_id>/uploads
+        """
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, 'test_user')
+        resp = requests.post(
+            url + '/cache/' + cache_id + '/uploads',
+            headers={'Authorization': 'non_admin_token', 'X-Cache-Filename': 'parts.bin'}
+        )
+        self.assertEqual(resp.status_code, 403)
+
+    def test_lease(self):
+        """
+        Test that only the first client to register an empty cache ID is asked to produce it, and
+        that waiting clients get a response once it is uploaded.
+
+        POST /cache_id
+        GET /cache/<cache_id>/wait
+        """
+        params = '{"lease": "%s"}' % uuid4()
+        headers = {'Authorization': 'non_admin_token', 'Content-Type': 'application/json'}
+        first = requests.post(url + '/cache_id', headers=headers, data=params).json()
+        self.assertEqual(first['lease']['state'], 'acquired')
+        second = requests.post(url + '/cache_id', headers=headers, data=params).json()
+        self.assertEqual(second['lease']['state'], 'in_progress')
+        self.assertEqual(second['lease']['lease_id'], None)
+        cache_id = first['cache_id']
+        resp = requests.get(url + '/cache/' + cache_id + '/wait?timeout=0.1', headers=headers)
+        self.assertEqual(resp.json()['lease']['state'], 'in_progress')
+        requests.post(
+            url + '/cache/' + cache_id,
+            files={'file': ('x.txt', 'xyz')},
+            headers={'Authorization': 'non_admin_token'}
+        )
+        resp = requests.get(url + '/cache/' + cache_id + '/wait?timeout=0.1', headers=headers)
+        json = resp.json()
+        self.assertTrue('lease' not in json)
+        self.assertEqual(json['metadata']['filename'], 'x.txt')
+
+    def test_wait_invalid_timeout(self):
+        """
+        Test that waiting with a timeout that is not a number of seconds is rejected.
+
+        GET /cache/<cache_id>/wait
+        """
+        cache_id = get_cache_id('{"wait": "%s"}' % uuid4())
+        for timeout in ('abc', '-1', 'nan', '-inf'):
+            resp = requests.get(url + '/cache/' + cache_id + '/wait?timeout=' + timeout,
+                                headers={'Authorization': 'non_admin_token'})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json()['status'], 'error')
+
+    def test_release_lease(self):
+        """
+        Test that a released lease can be taken over by a waiting client.
+
+        DELETE /cache/<cache_id>/lease/<lease_id>
+        """
+        params = '{"lease": "%s"}' % uuid4()
+        headers = {'Authorization': 'non_admin_token', 'Content-Type': 'application/json'}
+        first = requests.post(url + '/cache_id', headers=headers, data=params).json()
+        cache_id = first['cache_id']
+        resp = requests.delete(url + '/cache/' + cache_id + '/lease/' + first['lease']['lease_id'], headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(url + '/cache/' + cache_id + '/wait', headers=headers)
+        self.assertEqual(resp.json()['lease']['state'], 'acquired')
+
+    def test_batch_download(self):
+        """
+        Test downloading several cache files as one tar archive.
+
+        POST /cache/batch_download
+        """
+        cache_ids = []
+        for num in range(3):
+            cache_id = get_cache_id('{"batch": %d}' % num)
+            requests.post(
+                url + '/cache/' + cache_id,
+                files={'file': ('x%d.txt' % num, 'contents %d' % num)},
+                headers={'Authorization': 'non_admin_token'}
+            )
+            cache_ids.append(cache_id)
+        time.sleep(2)
+        hits = requests.get(url + '/admin/analytics', headers={'Authorization': 'admin_token'}).json()['total']['hits']
+        resp = requests.post(
+            url + '/cache/batch_download',
+            headers={'Authorization': 'non_admin_token', 'Content-Type': 'application/json'},
+            data=json.dumps({'cache_ids': cache_ids})
+        )
+        self.assertEqual(resp.status_code, 200)
+        with tarfile.open(fileobj=io.BytesIO(resp.content)) as tar:
+            names = tar.getnames()
+            self.assertEqual(names, [cache_ids[num] + '/x%d.txt' % num for num in range(3)])
+            self.assertEqual(tar.extractfile(names[2]).read(), b'contents 2')
+        # Each file in the archive counts as a download
+        time.sleep(2)
+        resp = requests.get(url + '/admin/analytics', headers={'Authorization': 'admin_token'})
+        self.assertTrue(resp.json()['total']['hits'] >= hits + 3)
+
+    def test_batch_download_missing(self):
+        """
+        Test that a batch download fails up front if any of the cache IDs has no file.
+
+        POST /cache/batch_download
+        """
+        resp = requests.post(
+            url + '/cache/batch_download',
+            headers={'Authorization': 'non_admin_token', 'Content-Type': 'application/json'},
+            data=json.dumps({'cache_ids': [get_cache_id(), str(uuid4())]})
+        )
+        self.assertEqual(resp.status_code, 404)
+
+    def test_copy_cache_file(self):
+        """
+        Test copying a cache file to another cache ID.
+
+        POST /cache/<cache_id>/copy
+        """
+        cache_id = get_cache_id('{"copy": "source"}')
+        requests.post(
+            url + '/cache/' + cache_id,
+            files={'file': ('source.txt', 'xyz')},
+            headers={'Authorization': 'non_admin_token'}
+        )
+        dest_id = get_cache_id('{"copy": "%s"}' % uuid4())
+        resp = requests.post(
+            url + '/cache/' + cache_id + '/copy',
+            headers={'Authorization': 'non_admin_token', 'Content-Type': 'application/json'},
+            data=json.dumps({'destination': dest_id})
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['metadata']['filename'], 'source.txt')
+        resp = requests.get(url + '/cache/' + dest_id, headers={'Authorization': 'non_admin_token'})
+        self.assertEqual(resp.content, b'xyz')
+
+    def test_copy_tagged(self):
+        """
+        Test that a copy to a tagged cache ID gets deleted along with the tag.
+
+        POST /cache/<cache_id>/copy
+        DELETE /tags/<tag>
+        """
+        (cache_id, _) = upload_cache('{"copy": "tagged source"}')
+        tag = 'copy@' + str(uuid4())
+        headers = {'Authorization': 'non_admin_token', 'Content-Type': 'application/json', 'X-Cache-Tags': tag}
+        dest_id = requests.post(url + '/cache_id', headers=headers, data='{"copy": "%s"}' % tag).json()['cache_id']
+        resp = requests.post(
+            url + '/cache/' + cache_id + '/copy',
+            headers={'Authorization': 'non_admin_token', 'Content-Type': 'application/json'},
+            data=json.dumps({'destination': dest_id})
+        )
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.delete(url + '/tags/' + tag, headers={'Authorization': 'non_admin_token'})
+        progress = json.loads(resp.text.splitlines()[-1])
+        self.assertEqual(progress, {'status': 'ok', 'total': 1, 'deleted': 1, 'missing': 0, 'errors': 0})
+        with self.assertRaises(MissingCache):
+            minio.get_metadata(dest_id)
+        minio.get_metadata(cache_id)
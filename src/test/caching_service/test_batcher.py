@@ -0,0 +1,30 @@
+import time
+import unittest
+
+from src.caching_service.batcher import Batcher
+
+
+class TestBatcher(unittest.TestCase):
+
+    def test_flush_merges_updates(self):
+        """Updates to the same key get merged into one entry of a batch."""
+        batches = []
+        batcher = Batcher(batches.append, 3600, merge=max)
+        batcher.add('a', 1)
+        batcher.add('a', 3)
+        batcher.add('a', 2)
+        batcher.add('b', 1)
+        self.assertEqual(batches, [])
+        batcher.flush()
+        self.assertEqual(batches, [{'a': 3, 'b': 1}])
+        # Nothing is pending after a flush
+        batcher.flush()
+        self.assertEqual(len(batches), 1)
+
+    def test_background_flush(self):
+        """Pending updates get flushed by the background thread."""
+        batches = []
+        batcher = Batcher(batches.append, 0.05)
+        batcher.add('a', 1)
+        time.sleep(0.5)
+        self.assertEqual(batches, [{'a': 1}])
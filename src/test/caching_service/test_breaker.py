@@ -0,0 +1,145 @@
+"""
+Tests for the circuit breakers, including against local stand-ins for a backend that inject
+latency and errors.
+"""
+import http.server
+import json
+import threading
+import time
+import unittest
+import urllib3
+
+from src.caching_service import breaker
+from src.caching_service import exceptions
+from src.caching_service.authorization import service_token
+from src.caching_service.config import Config
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """A backend that responds after `delay` seconds with `status`, both set on the server."""
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = json.dumps({'user': 'username'}).encode()
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+        self.server.delay = 0
+        self.server.status = 200
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_opens_on_failures(self):
+        """The breaker opens once enough requests fail, then fails fast until its timeout."""
+        clock = FakeClock()
+        brk = breaker.CircuitBreaker('test', 0.5, 4, 30, 10, clock=clock)
+        for success in [True, False, True]:
+            brk.before()
+            brk.record(success)
+        self.assertEqual(brk.state, 'closed')
+        brk.before()
+        brk.record(False)
+        self.assertEqual(brk.state, 'open')
+        clock.now = 5
+        with self.assertRaises(exceptions.BackendUnavailable) as ctx:
+            brk.before()
+        self.assertEqual(ctx.exception.retry_after, 5)
+        self.assertEqual(brk.rejected_count, 1)
+
+    def test_window(self):
+        """Failures from an earlier window do not count toward opening the breaker."""
+        clock = FakeClock()
+        brk = breaker.CircuitBreaker('test', 0.5, 4, 30, 10, clock=clock)
+        for _ in range(3):
+            brk.record(False)
+        clock.now = 31
+        brk.record(False)
+        self.assertEqual(brk.state, 'closed')
+
+    def test_half_open(self):
+        """After its timeout, the breaker lets one probe through, and closes if it succeeds."""
+        clock = FakeClock()
+        brk = breaker.CircuitBreaker('test', 0.5, 1, 30, 10, clock=clock)
+        brk.record(False)
+        clock.now = 10
+        brk.before()
+        self.assertEqual(brk.state, 'half_open')
+        with self.assertRaises(exceptions.BackendUnavailable):
+            brk.before()
+        brk.record(False)
+        self.assertEqual(brk.state, 'open')
+        clock.now = 20
+        brk.before()
+        brk.record(True)
+        self.assertEqual(brk.state, 'closed')
+        brk.before()
+
+    def test_pool_manager_latency(self):
+        """Requests to a slow backend time out, open the breaker, and then fail fast."""
+        self.server.delay = 0.5
+        brk = breaker.CircuitBreaker('slow', 0.5, 2, 30, 60)
+        http = breaker.BreakerPoolManager(brk, timeout=urllib3.util.Timeout(connect=1, read=0.1), retries=False)
+        for _ in range(2):
+            with self.assertRaises(exceptions.BackendUnavailable):
+                http.urlopen('GET', self.url)
+        self.assertEqual(brk.state, 'open')
+        start = time.time()
+        with self.assertRaises(exceptions.BackendUnavailable):
+            http.urlopen('GET', self.url)
+        self.assertTrue(time.time() - start < 0.1)
+
+    def test_pool_manager_errors(self):
+        """Server errors count as failures, but client errors do not."""
+        brk = breaker.CircuitBreaker('errors', 0.5, 2, 30, 60)
+        http = breaker.BreakerPoolManager(brk, retries=False)
+        self.server.status = 404
+        for _ in range(2):
+            self.assertEqual(http.urlopen('GET', self.url).status, 404)
+        self.assertEqual(brk.state, 'closed')
+        self.server.status = 500
+        for _ in range(2):
+            self.assertEqual(http.urlopen('GET', self.url).status, 500)
+        self.assertEqual(brk.state, 'open')
+
+    def test_auth_stale_tokens(self):
+        """Tokens that the auth service accepted are still accepted for a while once it goes down."""
+        orig = (Config.kbase_auth_url, Config.auth_cache_ttl, Config.auth_timeout, breaker.auth_breaker)
+        Config.kbase_auth_url = self.url
+        Config.auth_cache_ttl = 0
+        Config.auth_timeout = 0.1
+        service_token.auth_breaker = breaker.CircuitBreaker('auth', 0.5, 100, 30, 60)
+        try:
+            self.assertEqual(service_token.get_token_id('stale'), self.url + ':username')
+            self.server.status = 503
+            self.assertEqual(service_token.get_token_id('stale'), self.url + ':username')
+            with self.assertRaises(exceptions.BackendUnavailable):
+                service_token.get_token_id('unknown')
+            self.server.status = 200
+            self.server.delay = 0.5
+            self.assertEqual(service_token.get_token_id('stale'), self.url + ':username')
+        finally:
+            (Config.kbase_auth_url, Config.auth_cache_ttl, Config.auth_timeout, service_token.auth_breaker) = orig
@@ -0,0 +1,119 @@
+import time
+import unittest
+
+from src.caching_service import index
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class TestIndex(ConfigMixin, unittest.TestCase):
+
+    temp_index = True
+
+    def test_placeholders(self):
+        """Test adding, fetching, and removing placeholders."""
+        now = time.time()
+        index.add_placeholder('cid', 'url:user', now + 100)
+        self.assertEqual(index.get_placeholder('cid', now), ('url:user', int(now + 100)))
+        self.assertEqual(index.get_placeholder('other', now), None)
+        # Expired placeholders are not returned
+        self.assertEqual(index.get_placeholder('cid', now + 200), None)
+        index.remove_placeholder('cid')
+        self.assertEqual(index.get_placeholder('cid', now), None)
+
+    def test_remove_expired_placeholders(self):
+        """Test removing placeholders in bulk by expiration."""
+        index.add_placeholder('a', 'url:user', 100)
+        index.add_placeholder('b', 'url:user', 200)
+        index.add_placeholder('c', 'url:user', 300)
+        self.assertEqual(index.remove_placeholders_expiring_before(250), 2)
+        self.assertEqual(index.get_placeholder('c', 0), ('url:user', 300))
+
+    def test_packs(self):
+        """Test recording packed files and how much of each pack is still in use."""
+        entry = {'length': 10, 'etag': 'x', 'filename': 'f', 'token_id': 'url:user', 'accessed': 1}
+        index.add_unpacked('a', 10)
+        index.add_unpacked('b', 10)
+        index.add_pack('p1', 20, [
+            dict(entry, cache_id='a', offset=0, expiration=100),
+            dict(entry, cache_id='b', offset=10, expiration=300)
+        ])
+        self.assertEqual(index.get_unpacked(), [])
+        self.assertEqual(index.get_packed('a', 0)['offset'], 0)
+        self.assertEqual(index.get_packed('b', 0)['pack'], 'p1')
+        self.assertEqual(index.get_packed('a', 200), None)
+        self.assertEqual(index.get_pack_usage(200), [('p1', 20, 10)])
+        # Compaction moves the live file into a new pack
+        index.move_packed('p2', 10, [dict(index.get_packed('b', 200), offset=0)])
+        index.remove_pack('p1')
+        self.assertEqual(index.get_pack_usage(200), [('p2', 10, 10)])
+        self.assertEqual((index.get_packed('b', 0)['pack'], index.get_packed('b', 0)['offset']), ('p2', 0))
+        self.assertEqual(index.get_packed('a', 0), None)
+
+    def test_locks(self):
+        """Test that a lock has one holder at a time until it expires."""
+        self.assertTrue(index.acquire_lock('job', 'a', 110, 100))
+        self.assertFalse(index.acquire_lock('job', 'b', 110, 100))
+        # The holder can renew it
+        self.assertTrue(index.acquire_lock('job', 'a', 120, 105))
+        self.assertFalse(index.acquire_lock('job', 'b', 125, 115))
+        self.assertTrue(index.acquire_lock('job', 'b', 130, 120))
+
+    def test_values(self):
+        """Test storing and fetching shared values by prefix."""
+        index.set_values({'job.a': 1, 'job.b': 'x', 'other': 2})
+        self.assertEqual(index.get_values('job.'), {'job.a': '1', 'job.b': 'x'})
+
+    def test_owners(self):
+        """Test listing a token's unexpired entries a page at a time."""
+        index.set_owners([
+            ('c', 'token1', 'c.txt', 3, 200),
+            ('a', 'token1', 'a.txt', 1, 200),
+            ('b', 'token2', 'b.txt', 2, 200),
+            ('d', 'token1', 'placeholder', 0, 50),
+            ('e', 'token1', 'e.txt', 5, 200),
+        ])
+        self.assertEqual(index.get_owned('token1', '', 2, 100), [('a', 'a.txt', 1, 200), ('c', 'c.txt', 3, 200)])
+        self.assertEqual(index.get_owned('token1', 'c', 2, 100), [('e', 'e.txt', 5, 200)])
+        index.set_owner_expiration('a', 80)
+        index.remove_owners(['e'])
+        self.assertEqual([row[0] for row in index.get_owned('token1', '', 10, 40)], ['a', 'c', 'd'])
+        index.remove_owners_expiring_before(100, placeholders_only=True)
+        self.assertEqual([row[0] for row in index.get_owned('token1', '', 10, 0)], ['a', 'c'])
+        index.remove_owners_expiring_before(100)
+        self.assertEqual([row[0] for row in index.get_owned('token1', '', 10, 0)], ['c'])
+
+    def test_tags(self):
+        """Test tagging entries, and finding and removing the entries with a tag."""
+        index.set_tags('a', 'token1', ['t1', 't2'], 100)
+        index.set_tags('b', 'token1', ['t1'], 100)
+        index.set_tags('c', 'token2', ['t1'], 100)
+        self.assertEqual(index.get_tagged('token1', 't1'), ['a', 'b'])
+        self.assertEqual(index.get_tagged('token2', 't2'), [])
+        self.assertTrue(index.has_tags('a'))
+        # Tagging an entry again moves the expiration of all of its tags
+        index.set_tags('a', 'token1', [], 200)
+        index.set_tag_expiration('c', 50)
+        index.remove_tags_expiring_before(150)
+        self.assertEqual(index.get_tagged('token1', 't1'), ['a'])
+        self.assertEqual(index.get_tagged('token2', 't1'), [])
+        index.remove_tags(['a'])
+        self.assertFalse(index.has_tags('a'))
+
+    def test_usage(self):
+        """Test the running usage totals of each token, as entries come and go."""
+        index.set_owners([('a', 'token1', 'placeholder', 0, 200), ('b', 'token2', 'b.txt', 2, 200)])
+        self.assertEqual(index.get_usage(10), [('token2', 1, 2)])
+        # Uploading a file over a placeholder, and replacing a file
+        index.set_owners([('a', 'token1', 'a.txt', 5, 50), ('b', 'token2', 'b.txt', 3, 200)])
+        index.set_owners([('c', 'token2', 'c.txt', 1, 200)])
+        self.assertEqual(index.get_usage(10), [('token1', 1, 5), ('token2', 2, 4)])
+        self.assertEqual(index.get_usage(1), [('token1', 1, 5)])
+        self.assertEqual(index.get_total_usage(), (2, 3, 9))
+        index.remove_owners(['c', 'missing'])
+        index.remove_owners_expiring_before(100)
+        self.assertEqual(index.get_usage(10), [('token2', 1, 3)])
+        # Recounting corrects totals that have drifted
+        index.execute("UPDATE usage SET bytes = 10 WHERE token_id = 'token2'")
+        index.execute("INSERT INTO usage (token_id, objects, bytes) VALUES ('token3', 1, 1)")
+        index.recount_usage()
+        self.assertEqual(index.get_usage(), [('token2', 1, 3)])
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+
+from src.caching_service import index
+from src.caching_service import leases
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class TestLeases(ConfigMixin, unittest.TestCase):
+
+    temp_index = True
+
+    def setUp(self):
+        super().setUp()
+        Config.leases = True
+        Config.lease_poll_interval = 0.05
+
+    def test_acquire_once(self):
+        """Only the first client gets the lease, until it expires."""
+        (lease_id, expiration) = leases.acquire('cid')
+        self.assertTrue(lease_id)
+        self.assertEqual(leases.acquire('cid'), (None, expiration))
+        # Expire the lease; the next client takes it over
+        index.execute('UPDATE leases SET expiration = 0')
+        (lease_id2, _) = leases.acquire('cid')
+        self.assertTrue(lease_id2 and lease_id2 != lease_id)
+
+    def test_disabled(self):
+        """Without leases, every client gets a lease of its own and nobody waits."""
+        Config.leases = False
+        (first, _) = leases.acquire('cid')
+        (second, _) = leases.acquire('cid')
+        self.assertTrue(first and second and first != second)
+        self.assertTrue(leases.wait('cid', 10))
+
+    def test_release_other_lease(self):
+        """Releasing with a stale lease ID leaves the current lease alone."""
+        (lease_id, _) = leases.acquire('cid')
+        leases.release('cid', 'stale')
+        self.assertEqual(index.get_lease('cid', time.time())[0], lease_id)
+        leases.release('cid', lease_id)
+        self.assertEqual(index.get_lease('cid', time.time()), None)
+
+    def test_wait_released(self):
+        """Waiters are woken as soon as the lease is released."""
+        leases.acquire('cid')
+        timer = threading.Timer(0.1, leases.release, ['cid'])
+        timer.start()
+        start = time.time()
+        self.assertTrue(leases.wait('cid', 5))
+        self.assertTrue(time.time() - start < 1)
+
+    def test_wait_released_elsewhere(self):
+        """Waiters are woken when another worker removes the lease from the index."""
+        leases.acquire('cid')
+        timer = threading.Timer(0.1, index.remove_lease, ['cid'])
+        timer.start()
+        self.assertTrue(leases.wait('cid', 5))
+
+    def test_wait_expired(self):
+        """Waiters are woken when the lease expires."""
+        Config.lease_ttl = 0.2
+        leases.acquire('cid')
+        self.assertTrue(leases.wait('cid', 5))
+
+    def test_wait_timeout(self):
+        """Waiting gives up after the timeout."""
+        leases.acquire('cid')
+        self.assertFalse(leases.wait('cid', 0.1))
+        # No lease at all
+        self.assertTrue(leases.wait('other', 0.1))
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import sys
+import unittest
+
+from src.caching_service import log
+
+
+class TestLog(unittest.TestCase):
+
+    def test_json_formatter(self):
+        """Log records are formatted as a single line of JSON with their extra fields."""
+        record = logging.LogRecord('x', logging.INFO, __file__, 1, 'request', (), None)
+        record.fields = {'status': 200, 'route': '/v1/cache/<cache_id>'}
+        line = log.JSONFormatter().format(record)
+        self.assertTrue('\n' not in line)
+        entry = json.loads(line)
+        self.assertEqual(entry['message'], 'request')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['route'], '/v1/cache/<cache_id>')
+
+    def test_json_formatter_traceback(self):
+        """Tracebacks go in their own field."""
+        try:
+            raise ValueError('xyz')
+        except ValueError:
+            record = logging.LogRecord('x', logging.ERROR, __file__, 1, 'error', (), sys.exc_info())
+        # The traceback is rendered before the record is queued
+        record = log.DroppingQueueHandler(logging.NullHandler(), 1).prepare(record)
+        entry = json.loads(log.JSONFormatter().format(record))
+        self.assertEqual(entry['message'], 'error')
+        self.assertTrue('ValueError: xyz' in entry['traceback'])
+
+    def test_dropping_queue_handler(self):
+        """Records are dropped instead of blocking when the queue is full."""
+        handler = log.DroppingQueueHandler(logging.NullHandler(), 2)
+        # Pretend the writer thread is already running, so that nothing empties the queue
+        handler._pid = os.getpid()
+        for _ in range(5):
+            handler.emit(logging.LogRecord('x', logging.INFO, __file__, 1, 'msg', (), None))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_writer_thread(self):
+        """Queued records are passed on to the handler by the writer thread, which writes them all out when stopped."""
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        queue_handler = log.DroppingQueueHandler(handler, 10)
+        for num in range(3):
+            queue_handler.emit(logging.LogRecord('x', logging.INFO, __file__, 1, 'msg %d' % num, (), None))
+        queue_handler.stop()
+        self.assertEqual([record.msg for record in records], ['msg 0', 'msg 1', 'msg 2'])
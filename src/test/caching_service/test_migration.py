@@ -0,0 +1,64 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from uuid import uuid4
+
+from src.caching_service import migration
+import src.caching_service.minio as minio
+
+
+class TestMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_interrupted_journal(self):
+        """A line that was cut short is skipped, and the next line starts after it."""
+        path = os.path.join(self.tmp_dir, 'journal.jsonl')
+        with open(path, 'w') as fd:
+            fd.write(json.dumps({'cache_id': 'a'}) + '\n' + json.dumps({'cache_id': 'b'})[:-3])
+        self.assertEqual(migration.read_ids(path), {'a'})
+        with migration.open_journal(path) as fd:
+            fd.write(json.dumps({'cache_id': 'c'}) + '\n')
+        self.assertEqual(migration.read_ids(path), {'a', 'c'})
+        self.assertEqual(migration.read_ids(os.path.join(self.tmp_dir, 'missing.jsonl')), set())
+
+    def test_checksum(self):
+        path = os.path.join(self.tmp_dir, 'file')
+        with open(path, 'wb') as fd:
+            fd.write(b'contents')
+        self.assertEqual(migration.checksum(path), (8, hashlib.sha256(b'contents').hexdigest()))
+
+    def test_export_import(self):
+        """Test exporting cache files to an archive, and importing them again, each only once."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        minio.upload_stream(cache_id, token_id, 'test.bin', io.BytesIO(b'contents'), 8)
+        placeholder_id = str(uuid4())
+        minio.create_placeholder(placeholder_id, token_id)
+        archive = os.path.join(self.tmp_dir, 'archive')
+        migration.export_entries(archive)
+        records = migration.read_records(os.path.join(archive, 'manifest.jsonl'))
+        manifest = {entry['cache_id']: entry for entry in records}
+        self.assertNotIn(placeholder_id, manifest)
+        entry = manifest[cache_id]
+        self.assertEqual(entry['metadata']['filename'], 'test.bin')
+        self.assertEqual((entry['size'], entry['sha256']), (8, hashlib.sha256(b'contents').hexdigest()))
+        self.assertEqual(migration.export_entries(archive), (0, 0), 'Exported files are not exported again')
+        minio.delete_cache(cache_id, token_id)
+        self.assertTrue(migration.import_entries(archive)[0] >= 1)
+        self.assertEqual(migration.import_entries(archive), (0, 0), 'Imported files are not imported again')
+        tmp_dir = tempfile.mkdtemp()
+        with open(minio.download_cache(cache_id, token_id, tmp_dir), 'rb') as fd:
+            self.assertEqual(fd.read(), b'contents')
+        shutil.rmtree(tmp_dir)
+        self.assertTrue(int(minio.get_metadata(cache_id)['expiration']) > time.time())
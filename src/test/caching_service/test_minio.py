@@ -3,6 +3,7 @@ import shutil
 import time
 import os
 import io
+from minio.error import S3Error
 from werkzeug.datastructures import FileStorage
 from uuid import uuid4
 import tempfile
@@ -65,6 +66,46 @@ class TestMinio(unittest.TestCase):
             saved_contents = fd.read().decode('utf-8')
             self.assertEqual(saved_contents, 'contents', 'Correct file contents uploaded')
 
+    def test_read_ranges(self):
+        """Test reading a file in concurrent chunks, in order, and failing if it is replaced."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        contents = bytes(range(256)) * 4
+        minio.create_placeholder(cache_id, token_id)
+        minio.upload_stream(cache_id, token_id, 'test.bin', io.BytesIO(contents), len(contents))
+        (_, size, etag) = minio.authorize_download(cache_id, token_id)
+        orig = (minio.Config.download_chunk_size, minio.Config.download_connections)
+        (minio.Config.download_chunk_size, minio.Config.download_connections) = (100, 3)
+        try:
+            chunks = list(minio.read_ranges(cache_id, 0, size, etag))
+            self.assertEqual(len(chunks), 11)
+            self.assertEqual(b''.join(chunks), contents)
+            self.assertEqual(b''.join(minio.read_ranges(cache_id, 250, 420, etag)), contents[250:420])
+            minio.upload_stream(cache_id, token_id, 'test.bin', io.BytesIO(contents[::-1]), len(contents))
+            with self.assertRaises(S3Error):
+                list(minio.read_ranges(cache_id, 0, size, etag))
+        finally:
+            (minio.Config.download_chunk_size, minio.Config.download_connections) = orig
+
+    def test_cache_info(self):
+        """Test fetching the metadata, size, and ETag of a cache entry."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        info = minio.get_cache_info(cache_id, token_id)
+        self.assertEqual(info['size'], 0)
+        self.assertTrue(info['placeholder'])
+        file_storage = self.make_test_file_storage(cache_id, token_id)
+        minio.upload_cache(cache_id, token_id, file_storage)
+        file_storage.stream.close()
+        info = minio.get_cache_info(cache_id, token_id)
+        self.assertEqual(info['size'], len(b'contents'))
+        self.assertEqual(info['filename'], 'test.json')
+        self.assertFalse(info['placeholder'])
+        self.assertTrue(info['etag'])
+        with self.assertRaises(exceptions.UnauthorizedAccess):
+            minio.get_cache_info(cache_id, token_id + 'x')
+
     def test_cache_delete(self):
         """Test a valid file deletion."""
         token_id = 'url:user:name'
@@ -134,3 +175,149 @@ class TestMinio(unittest.TestCase):
         (removed_count, total_count) = minio.expire_entries()
         self.assertTrue(removed_count >= 1, 'Removes at least 1 expired object.')
         self.assertTrue(total_count > 0, 'The bucket is non-empty.')
+
+    def test_refresh_access(self):
+        """Test that batched download times get written to the metadata."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        file_storage = self.make_test_file_storage(cache_id, token_id)
+        minio.upload_cache(cache_id, token_id, file_storage)
+        file_storage.stream.close()
+        now = int(time.time())
+        minio.refresh_access({cache_id: now})
+        metadata = minio.get_metadata(cache_id)
+        self.assertEqual(metadata['accessed'], str(now))
+        self.assertEqual(metadata['filename'], 'test.json', 'Other metadata is kept')
+        self.assertEqual(metadata['token_id'], token_id, 'Other metadata is kept')
+        etag = minio.stat_cache(cache_id).etag
+        minio.refresh_access({cache_id: now + 60})
+        self.assertEqual(minio.get_metadata(cache_id)['accessed'], str(now), 'Refreshes are spaced out')
+        self.assertEqual(minio.stat_cache(cache_id).etag, etag, 'The ETag is kept')
+
+    def test_evict_entries(self):
+        """Test that eviction brings the bucket under its byte budget."""
+        (removed_count, remaining_bytes) = minio.evict_entries(10 ** 15)
+        self.assertEqual(removed_count, 0, 'Nothing is removed under budget')
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        file_storage = self.make_test_file_storage(cache_id, token_id)
+        minio.upload_cache(cache_id, token_id, file_storage)
+        file_storage.stream.close()
+        (removed_count, remaining_bytes) = minio.evict_entries(0)
+        self.assertTrue(removed_count >= 1, 'Removes at least 1 object')
+        self.assertEqual(remaining_bytes, 0)
+        with self.assertRaises(exceptions.MissingCache):
+            minio.get_metadata(cache_id)
+
+    def test_placeholder_index(self):
+        """Test that placeholders can be kept in the local index instead of Minio."""
+        minio.Config.placeholder_index = True
+        try:
+            token_id = 'url:user:name'
+            cache_id = str(uuid4())
+            minio.create_placeholder(cache_id, token_id)
+            with self.assertRaises(exceptions.MissingCache):
+                minio.stat_cache(cache_id)
+            self.assertEqual(minio.get_metadata(cache_id)['token_id'], token_id)
+            self.assertTrue(minio.get_cache_info(cache_id, token_id)['placeholder'])
+            file_storage = self.make_test_file_storage(cache_id, token_id)
+            minio.upload_cache(cache_id, token_id, file_storage)
+            file_storage.stream.close()
+            self.assertEqual(minio.get_metadata(cache_id)['filename'], 'test.json')
+            self.assertEqual(minio.index.get_placeholder(cache_id, time.time()), None)
+        finally:
+            minio.Config.placeholder_index = False
+
+    def test_reap_placeholders(self):
+        """Test that old placeholders are removed, but not uploaded files."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        uploaded_id = str(uuid4())
+        file_storage = self.make_test_file_storage(uploaded_id, token_id)
+        minio.upload_cache(uploaded_id, token_id, file_storage)
+        file_storage.stream.close()
+        # Nothing is old enough yet
+        minio.reap_placeholders(3600)
+        minio.get_metadata(cache_id)
+        removed_count = minio.reap_placeholders(-60)
+        self.assertTrue(removed_count >= 1, 'Removes at least 1 placeholder')
+        with self.assertRaises(exceptions.MissingCache):
+            minio.get_metadata(cache_id)
+        self.assertEqual(minio.get_metadata(uploaded_id)['filename'], 'test.json')
+
+    def test_copy_cache(self):
+        """Test copying a cache file to another cache ID of the same token."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        file_storage = self.make_test_file_storage(cache_id, token_id)
+        minio.upload_cache(cache_id, token_id, file_storage)
+        file_storage.stream.close()
+        dest_id = str(uuid4())
+        minio.create_placeholder(dest_id, token_id)
+        metadata = minio.copy_cache(cache_id, dest_id, token_id, filename='copy.json')
+        self.assertEqual(metadata['filename'], 'copy.json')
+        self.assertEqual(minio.get_metadata(dest_id), metadata)
+        tmp_dir = tempfile.mkdtemp()
+        with open(minio.download_cache(dest_id, token_id, tmp_dir), 'rb') as fd:
+            self.assertEqual(fd.read(), b'contents')
+        shutil.rmtree(tmp_dir)
+        # The destination must belong to the same token
+        other_id = str(uuid4())
+        minio.create_placeholder(other_id, 'url:other:name')
+        with self.assertRaises(exceptions.UnauthorizedAccess):
+            minio.copy_cache(cache_id, other_id, token_id)
+
+    def test_delete_tagged_errors(self):
+        """Test that tagged entries that Minio fails to remove are counted as errors, and keep their tags."""
+        token_id = 'url:user:name'
+        tag = str(uuid4())
+        cache_ids = sorted(str(uuid4()) for _ in range(2))
+        orig = (minio.Config.tags, minio.remove_many)
+        minio.Config.tags = True
+        try:
+            for cache_id in cache_ids:
+                minio.upload_cache(cache_id, token_id, self.make_test_file_storage(cache_id, token_id), tags=[tag])
+            minio.remove_many = lambda names: orig[1](names[1:]) + names[:1]
+            progress = list(minio.delete_tagged(token_id, tag))
+            self.assertEqual(progress[-1], {'total': 2, 'deleted': 1, 'missing': 0, 'errors': 1})
+            self.assertEqual(minio.index.get_tagged(token_id, tag), cache_ids[:1])
+            with self.assertRaises(exceptions.MissingCache):
+                minio.get_metadata(cache_ids[1])
+        finally:
+            (minio.Config.tags, minio.remove_many) = orig
+
+    def test_tiering(self):
+        """Test moving a cache file to the cold tier and back, and collecting its unused copy."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        contents = bytes(range(256)) * 4
+        minio.create_placeholder(cache_id, token_id)
+        minio.upload_stream(cache_id, token_id, 'test.bin', io.BytesIO(contents), len(contents))
+        orig = minio.cold_bucket_name
+        minio.cold_bucket_name = 'kbase-cache-cold'
+        minio.make_bucket(minio.cold_client, minio.cold_bucket_name)
+        try:
+            # Files downloaded since the cutoff stay where they are
+            self.assertEqual(minio.demote_cache(cache_id, time.time() - 3600), 0)
+            self.assertEqual(minio.demote_cache(cache_id, time.time() + 1), len(contents))
+            self.assertEqual(minio.stat_cache(cache_id).size, 0)
+            (metadata, size, etag) = minio.authorize_download(cache_id, token_id)
+            self.assertTrue(minio.is_cold(metadata))
+            self.assertEqual(size, len(contents))
+            tmp_dir = tempfile.mkdtemp()
+            with open(minio.save_download(cache_id, (metadata, size, etag), tmp_dir), 'rb') as fd:
+                self.assertEqual(fd.read(), contents)
+            shutil.rmtree(tmp_dir)
+            self.assertEqual(b''.join(minio.read_ranges(cache_id, 10, 500, etag, cold=True)), contents[10:500])
+            [copy] = minio.cold_client.list_objects(minio.cold_bucket_name, prefix=cache_id)
+            self.assertFalse(minio.is_cold_orphan(copy, time.time() + 1))
+            self.assertEqual(minio.promote_cache(cache_id), len(contents))
+            self.assertEqual(minio.promote_cache(cache_id), 0)
+            self.assertEqual(minio.lookup_cache(cache_id)[1:], (len(contents), minio.stat_cache(cache_id).etag))
+            self.assertFalse(minio.is_cold(minio.get_metadata(cache_id)))
+            self.assertFalse(minio.is_cold_orphan(copy, time.time() - 3600), 'A new copy is kept for a while')
+            self.assertTrue(minio.is_cold_orphan(copy, time.time() + 1))
+        finally:
+            minio.cold_client.remove_object(minio.cold_bucket_name, cache_id)
+            minio.cold_bucket_name = orig
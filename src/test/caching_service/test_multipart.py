@@ -0,0 +1,45 @@
+import io
+import unittest
+from uuid import uuid4
+
+import src.caching_service.minio as minio
+import src.caching_service.multipart as multipart
+import src.caching_service.exceptions as exceptions
+
+
+class TestMultipart(unittest.TestCase):
+
+    def test_session(self):
+        """Test a session through to completion."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        upload_id = multipart.create_session(cache_id, token_id, 'test.bin')
+        multipart.upload_part(cache_id, token_id, upload_id, 1, io.BytesIO(b'contents'), 8)
+        parts = multipart.list_parts(cache_id, token_id, upload_id)
+        self.assertEqual([(part['part_number'], part['size']) for part in parts], [(1, 8)])
+        multipart.complete_session(cache_id, token_id, upload_id)
+        metadata = minio.get_metadata(cache_id)
+        self.assertEqual(metadata['filename'], 'test.bin')
+        self.assertEqual(metadata['token_id'], token_id)
+        with self.assertRaises(exceptions.MissingUpload):
+            multipart.list_parts(cache_id, token_id, upload_id)
+
+    def test_unauthorized_session(self):
+        """Test that only the cache's token can start a session."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        with self.assertRaises(exceptions.UnauthorizedAccess):
+            multipart.create_session(cache_id, token_id + 'x', 'test.bin')
+
+    def test_abort_stale_sessions(self):
+        """Test that abandoned sessions get aborted."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        upload_id = multipart.create_session(cache_id, token_id, 'test.bin')
+        multipart.upload_part(cache_id, token_id, upload_id, 1, io.BytesIO(b'contents'), 8)
+        self.assertTrue(multipart.abort_stale_sessions(-60) >= 1)
+        with self.assertRaises(exceptions.MissingUpload):
+            multipart.list_parts(cache_id, token_id, upload_id)
@@ -0,0 +1,42 @@
+import unittest
+
+from src.caching_service import config
+from src.caching_service.authorization import namespaces
+from src.caching_service.config import Config
+from src.caching_service.exceptions import InvalidRequest
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class TestNamespaces(ConfigMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        Config.namespaces = config._parse_namespaces('public:*:producer, team:alice|bob:bob')
+        self.auth_url = Config.kbase_auth_url + ':'
+
+    def test_parse_namespaces(self):
+        self.assertEqual(Config.namespaces, {
+            'public': {'read': {'*'}, 'write': {'producer'}},
+            'team': {'read': {'alice', 'bob'}, 'write': {'bob'}}
+        })
+        self.assertEqual(config._parse_namespaces('empty::'), {'empty': {'read': set(), 'write': set()}})
+
+    def test_owner_id(self):
+        self.assertEqual(namespaces.owner_id('team'), 'namespace:team')
+        with self.assertRaises(InvalidRequest):
+            namespaces.owner_id('missing')
+
+    def test_allows(self):
+        """Readers may read the entries of a namespace, and only writers may also write them."""
+        team = namespaces.owner_id('team')
+        self.assertTrue(namespaces.allows(team, self.auth_url + 'alice'))
+        self.assertFalse(namespaces.allows(team, self.auth_url + 'alice', write=True))
+        self.assertTrue(namespaces.allows(team, self.auth_url + 'bob', write=True))
+        self.assertFalse(namespaces.allows(team, self.auth_url + 'carol'))
+        self.assertFalse(namespaces.allows(team, 'http://other-auth:alice'), 'Users of another auth service')
+        self.assertTrue(namespaces.allows(namespaces.owner_id('public'), self.auth_url + 'carol'))
+        self.assertTrue(namespaces.allows(namespaces.owner_id('public'), self.auth_url + 'producer', write=True))
+        # Tokens own their own entries, and nobody else's
+        self.assertTrue(namespaces.allows(self.auth_url + 'carol', self.auth_url + 'carol', write=True))
+        self.assertFalse(namespaces.allows(self.auth_url + 'carol', self.auth_url + 'bob'))
+        self.assertFalse(namespaces.allows('namespace:missing', self.auth_url + 'alice'))
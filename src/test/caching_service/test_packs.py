@@ -0,0 +1,130 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from uuid import uuid4
+from werkzeug.datastructures import FileStorage
+
+import src.caching_service.minio as minio
+import src.caching_service.packs as packs
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class TestPacks(ConfigMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        Config.pack_threshold = 1024
+        Config.pack_size = 4096
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super().tearDown()
+
+    def upload(self, contents):
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        minio.upload_cache(cache_id, token_id, FileStorage(filename='test.txt', stream=io.BytesIO(contents)))
+        return cache_id
+
+    def download(self, cache_id):
+        path = minio.download_cache(cache_id, 'url:user:name', self.tmp_dir)
+        with open(path, 'rb') as fd:
+            contents = fd.read()
+        os.remove(path)
+        return contents
+
+    def test_pack_and_compact(self):
+        """Test that small files are moved into packs and can be downloaded from there."""
+        small = [self.upload(b'small %d' % num) for num in range(3)]
+        large = self.upload(b'x' * 2048)
+        self.assertTrue(packs.pack_entries() >= 3)
+        for (num, cache_id) in enumerate(small):
+            with self.assertRaises(minio.exceptions.MissingCache):
+                minio.stat_cache(cache_id)
+            self.assertEqual(self.download(cache_id), b'small %d' % num)
+            self.assertEqual(minio.get_metadata(cache_id)['filename'], 'test.txt')
+        self.assertEqual(minio.stat_cache(large).size, 2048, 'Large files are not packed')
+        # Expire one of the files, and compact its pack
+        minio.index.execute('UPDATE packed SET expiration = 0 WHERE cache_id = ?', (small[0],))
+        self.assertTrue(packs.compact_packs(0.01) >= 1)
+        self.assertEqual(minio.index.get_packed(small[0], time.time()), None)
+        self.assertEqual(self.download(small[1]), b'small 1')
+        self.assertEqual(self.download(small[2]), b'small 2')
+
+    def test_restore_packs(self):
+        """Test rebuilding a lost pack index from the manifests of the packs."""
+        cache_id = self.upload(b'packed')
+        replaced = self.upload(b'old')
+        packs.pack_entries()
+        minio.upload_cache(replaced, 'url:user:name', FileStorage(filename='new.txt', stream=io.BytesIO(b'new')))
+        minio.index.execute('DELETE FROM packed')
+        minio.index.execute('DELETE FROM packs')
+        self.assertTrue(packs.restore_packs() >= 1)
+        self.assertEqual(self.download(cache_id), b'packed')
+        self.assertEqual(minio.get_metadata(cache_id)['filename'], 'test.txt')
+        self.assertEqual(self.download(replaced), b'new', 'A file uploaded again keeps its own object')
+
+    def test_copy_packed(self):
+        """Test that a copy of a packed file is its own object, and outlives compaction of the pack."""
+        cache_id = self.upload(b'packed')
+        packs.pack_entries()
+        dest_id = self.upload(b'dest')
+        minio.copy_cache(cache_id, dest_id, 'url:user:name')
+        self.assertEqual(minio.stat_cache(dest_id).size, 6)
+        minio.index.execute('UPDATE packed SET expiration = 0 WHERE cache_id = ?', (cache_id,))
+        packs.compact_packs(0.01)
+        self.assertEqual(self.download(dest_id), b'packed')
+
+    def test_compact_new_entries(self):
+        """Test that compaction keeps a pack that gained files while it was being rewritten."""
+        cache_id = self.upload(b'packed')
+        packs.pack_entries()
+        pack = minio.index.get_packed(cache_id, time.time())['pack']
+        restored = dict(minio.index.get_packed(cache_id, time.time()), cache_id=str(uuid4()))
+        orig = packs.PackWriter.flush
+
+        def flush(writer):
+            orig(writer)
+            minio.index.restore_pack(pack, 0, [restored])
+        packs.PackWriter.flush = flush
+        try:
+            self.assertEqual(packs.compact_packs(0), 0)
+        finally:
+            packs.PackWriter.flush = orig
+        self.assertEqual(self.download(restored['cache_id']), b'packed')
+        self.assertEqual(self.download(cache_id), b'packed')
+
+    def test_evict_packed(self):
+        """Test that evicting packed files does not count their space as freed before compaction."""
+        cache_id = self.upload(b'packed')
+        packs.pack_entries()
+        (removed_count, remaining_bytes) = minio.evict_entries(0)
+        self.assertTrue(removed_count >= 1)
+        self.assertTrue(remaining_bytes > 0, 'The pack is still stored')
+        self.assertEqual(minio.index.get_packed(cache_id, time.time()), None)
+        with self.assertRaises(minio.exceptions.MissingCache):
+            minio.get_metadata(cache_id)
+
+    def test_reap_placeholders(self):
+        """Test that reaping placeholders skips over the packs."""
+        cache_id = self.upload(b'packed')
+        packs.pack_entries()
+        minio.reap_placeholders(-60)
+        self.assertEqual(self.download(cache_id), b'packed')
+
+    def test_replace_packed(self):
+        """Test that uploading to the cache ID of a packed file replaces it."""
+        cache_id = self.upload(b'old')
+        packs.pack_entries()
+        token_id = 'url:user:name'
+        minio.upload_cache(cache_id, token_id, FileStorage(filename='new.txt', stream=io.BytesIO(b'new')))
+        self.assertEqual(self.download(cache_id), b'new')
+        minio.delete_cache(cache_id, token_id)
+        with self.assertRaises(minio.exceptions.MissingCache):
+            minio.get_metadata(cache_id)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from src.caching_service import peers
+from src.caching_service import config
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+nodes = ['http://127.0.0.1:5001', 'http://127.0.0.1:5002', 'http://127.0.0.1:5003']
+keys = ['cache_id_' + str(num) for num in range(3000)]
+_local_index_keys = ['placeholder_index', 'owner_index', 'pack_threshold', 'leases', 'tags', 'analytics', 'sweeper']
+
+
+class TestPeers(ConfigMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super().tearDown()
+
+    def test_ring_is_stable(self):
+        """Every replica computes the same owner for a key, whatever the order of its peer list."""
+        ring1 = peers.HashRing(nodes, 100)
+        ring2 = peers.HashRing(list(reversed(nodes)), 100)
+        for key in keys[:100]:
+            self.assertEqual(ring1.owner(key), ring2.owner(key))
+
+    def test_ring_spread(self):
+        """Keys are spread roughly evenly over the replicas."""
+        ring = peers.HashRing(nodes, 100)
+        counts = {node: 0 for node in nodes}
+        for key in keys:
+            counts[ring.owner(key)] += 1
+        for count in counts.values():
+            self.assertTrue(600 < count < 1400, counts)
+
+    def test_remove_node(self):
+        """Removing a replica only moves the keys that it owned."""
+        ring = peers.HashRing(nodes, 100)
+        smaller = peers.HashRing(nodes[:2], 100)
+        for key in keys:
+            if ring.owner(key) != nodes[2]:
+                self.assertEqual(ring.owner(key), smaller.owner(key))
+
+    def test_empty_ring(self):
+        """Without peers, nothing has an owner."""
+        self.assertEqual(peers.HashRing([], 100).owner('xyz'), None)
+
+    def test_trim_hot_copies(self):
+        """The least recently used hot copies are removed first."""
+        for (num, name) in enumerate(['a', 'b', 'c']):
+            path = os.path.join(self.tmp_dir, name)
+            with open(path, 'wb') as fd:
+                fd.write(b'x' * 10)
+            os.utime(path, (time.time() - 100 + num, time.time() - 100 + num))
+        # Using a file makes it the most recent
+        os.utime(os.path.join(self.tmp_dir, 'a'))
+        peers.trim_hot_copies(self.tmp_dir, 20)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['a', 'c'])
+
+    def test_is_authorized(self):
+        """Peer requests need the shared secret, and are refused if none is configured."""
+        Config.peer_secret = ''
+        self.assertFalse(peers.is_authorized(''))
+        Config.peer_secret = 'xyz'
+        self.assertFalse(peers.is_authorized(None))
+        self.assertFalse(peers.is_authorized('abc'))
+        self.assertTrue(peers.is_authorized('xyz'))
+
+    def test_check_replicas(self):
+        """Several replicas refuse to start with a feature that keeps its records in the local index."""
+        for key in _local_index_keys:
+            setattr(Config, key, False)
+        Config.peers = nodes
+        config.check_replicas()
+        Config.owner_index = True
+        with self.assertRaises(RuntimeError):
+            config.check_replicas()
+        Config.peers = []
+        config.check_replicas()
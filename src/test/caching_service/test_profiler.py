@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+import flask
+
+from src.caching_service import index
+from src.caching_service import profiler
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+app = flask.Flask(__name__)
+
+
+@app.route('/work')
+def work():
+    return 'ok'
+
+
+def spin(seconds):
+    """Keep the CPU busy, to be found in the samples."""
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestProfiler(ConfigMixin, unittest.TestCase):
+
+    temp_index = True
+
+    def setUp(self):
+        super().setUp()
+        Config.profile_poll_interval = 0
+
+    def tearDown(self):
+        profiler.close_window()
+        super().tearDown()
+
+    def test_sample_thread(self):
+        """The stacks of a tracked thread are sampled and summed in the index."""
+        profiler.open_window(10)
+
+        def run():
+            key = profiler.track()
+            spin(0.2)
+            profiler.untrack(key)
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        stacks = dict(index.get_profile())
+        spun = [stack for stack in stacks if stack.endswith('spin (caching_service/test_profiler.py)')]
+        self.assertEqual(len(spun), 1)
+        self.assertTrue(stacks[spun[0]] >= 5)
+        self.assertTrue(profiler.render().startswith(spun[0] + ' '))
+        # Opening another window discards the earlier samples
+        profiler.open_window(10)
+        self.assertEqual(profiler.render(), '')
+
+    def test_pick_requests(self):
+        """Only requests to the window's route are picked, and none once it has closed."""
+        profiler.open_window(10, route='/other')
+        with app.test_request_context('/work'):
+            profiler.start_request()
+            self.assertEqual(flask.g.get('profile_key'), None)
+        profiler.open_window(10, route='work')
+        with app.test_request_context('/work'):
+            profiler.start_request()
+            key = flask.g.get('profile_key')
+            self.assertTrue(key in profiler._tasks)
+            profiler.untrack(key)
+        profiler.close_window()
+        with app.test_request_context('/work'):
+            profiler.start_request()
+            self.assertEqual(flask.g.get('profile_key'), None)
@@ -0,0 +1,32 @@
+import unittest
+
+from src.caching_service import retention
+from src.caching_service.config import Config
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class TestRetention(ConfigMixin, unittest.TestCase):
+
+    def test_cache_ttl_default(self):
+        """Without size classes, every file gets the default TTL."""
+        Config.cache_ttl_by_size = []
+        self.assertEqual(retention.cache_ttl(0), Config.cache_ttl)
+        self.assertEqual(retention.cache_ttl(10 ** 12), Config.cache_ttl)
+
+    def test_cache_ttl_by_size(self):
+        """A file gets the TTL of the smallest size class it fits in."""
+        Config.cache_ttl_by_size = [(100, 10), (1000, 5)]
+        self.assertEqual(retention.cache_ttl(50), 10)
+        self.assertEqual(retention.cache_ttl(100), 10)
+        self.assertEqual(retention.cache_ttl(500), 5)
+        self.assertEqual(retention.cache_ttl(5000), Config.cache_ttl)
+
+    def test_expiration(self):
+        self.assertEqual(retention.expiration(10, 100.5), '110')
+
+    def test_least_recently_used(self):
+        """The oldest entries are evicted until the total fits in the budget."""
+        entries = [(30, 'c', 10), (10, 'a', 10), (20, 'b', 10)]
+        self.assertEqual(retention.least_recently_used(entries, 30, 30), [])
+        self.assertEqual(retention.least_recently_used(entries, 30, 15), ['a', 'b'])
+        self.assertEqual(retention.least_recently_used(entries, 30, 0), ['a', 'b', 'c'])
@@ -0,0 +1,37 @@
+import io
+import unittest
+from uuid import uuid4
+from minio.datatypes import Object
+from werkzeug.datastructures import FileStorage
+
+import src.caching_service.minio as minio
+from src.caching_service import sweeper
+from src.caching_service.sweeper import RateLimiter
+
+
+class TestSweeper(unittest.TestCase):
+
+    def test_rate_limiter_backoff(self):
+        """Test that the rate drops while latency is high, and then recovers."""
+        latency = [5.0]
+        limiter = RateLimiter(1000, 1, lambda: latency[0])
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(limiter.rate, 125)
+        for _ in range(10):
+            limiter.wait()
+        self.assertEqual(limiter.rate, 1000 / 64, 'The rate has a floor')
+        latency[0] = 0.1
+        for _ in range(25):
+            limiter.wait()
+        self.assertEqual(limiter.rate, 1000)
+
+    def test_stale_listing(self):
+        """Test that an object that looks expired in a stale listing is looked up again before removal."""
+        token_id = 'url:user:name'
+        cache_id = str(uuid4())
+        minio.create_placeholder(cache_id, token_id)
+        minio.upload_cache(cache_id, token_id, FileStorage(filename='test.txt', stream=io.BytesIO(b'fresh')))
+        stale = Object(minio.bucket_name, cache_id, metadata={'X-Amz-Meta-Expiration': '0'})
+        self.assertEqual(sweeper._sweep_object(stale, RateLimiter(1000, 1, lambda: 0)), 0)
+        self.assertEqual(minio.get_metadata(cache_id)['filename'], 'test.txt')
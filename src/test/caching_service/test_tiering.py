@@ -0,0 +1,45 @@
+import datetime
+import unittest
+
+from src.caching_service import tiering
+from src.caching_service.config import Config
+from src.caching_service.sweeper import RateLimiter
+from src.test.caching_service.helpers import ConfigMixin
+
+
+class Listed:
+    """Stands in for an object from list_objects."""
+
+    def __init__(self, name, size, modified, metadata=None):
+        self.object_name = name
+        self.size = size
+        self.last_modified = datetime.datetime.fromtimestamp(modified, datetime.timezone.utc)
+        self.metadata = metadata
+        self.is_dir = False
+
+
+class TestTiering(ConfigMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        Config.cold_min_size = 100
+
+    def test_is_candidate(self):
+        """Only cache files that are big enough and have not been downloaded since the cutoff are moved."""
+        self.assertTrue(tiering.is_candidate(Listed('a', 100, 500), 1000))
+        self.assertFalse(tiering.is_candidate(Listed('a', 100, 1500), 1000), 'Uploaded since the cutoff')
+        self.assertFalse(tiering.is_candidate(Listed('a', 99, 500), 1000), 'Too small')
+        self.assertFalse(tiering.is_candidate(Listed('_packs/a', 1000, 500), 1000), 'Packs stay in the hot tier')
+        downloaded = Listed('a', 100, 500, {'X-Amz-Meta-Accessed': '1500'})
+        self.assertFalse(tiering.is_candidate(downloaded, 1000), 'Downloaded since the cutoff')
+        Config.cold_min_size = 0
+        stub = Listed('a', 0, 500, {'X-Amz-Meta-Tier': 'cold'})
+        self.assertFalse(tiering.is_candidate(stub, 1000), 'Already in the cold tier')
+
+    def test_rate_limiter_amount(self):
+        """Test that an operation can use up more than one unit of the rate."""
+        limiter = RateLimiter(1000, 1, lambda: 0)
+        limiter.wait(500)
+        start = limiter._next
+        limiter.wait(250)
+        self.assertAlmostEqual(limiter._next - start, 0.25, places=2)